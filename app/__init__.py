@@ -1,3 +1,4 @@
+from . import warmup  # first, so its BOOT_TIME marks the start of the cold start
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -13,6 +14,10 @@ def create_app():
     migrate.init_app(app, db)
 
     import models
+    from . import reembed, tenant_directory
+    reembed.register_listeners()
+    tenant_directory.register_listeners()
+
     from .routes import main
     app.register_blueprint(main)
 
@@ -1,16 +1,139 @@
 import requests
 import os
 import json
-
-from config import OPENAI_API_KEY
+import time
+import random
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (OPENAI_API_KEY, AI_PREFETCH_WORKERS, INTENT_CLASSIFIER, INTENT_SHADOW_SAMPLE_RATE, RETRIEVAL_BACKEND,
+                    STREAM_CHUNK_MIN_CHARS, ORDER_DEDUPE_WINDOW)
 from models import Client, TenantInfo, Service, Product
+from .intent import INTENT_LABELS, classify_local, is_confident, record_decision, record_agreement
 from .redis_config import CONVERSATION_MAX_LENGTH
 from .log_config import logger
+from .prompt import build_messages, get_summary, schedule_summary
+from . import http_client, embedding_cache, vector_index, rate_limit, semantic_cache
 
 api_key = os.getenv("OPEN_AI_API_KEY")
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+INTENT_MODEL = "gpt-3.5-turbo"
+
+STRUCTURED_REPLY_PROMPT = (
+    "Answer by calling reply_to_client. Put your reply to the client in 'reply', the intent of "
+    "the client's last message ('product', 'service' or 'general') in 'intent', and the client's "
+    "full name, email address and the pack/service they want to purchase in 'client_name', "
+    "'client_email' and 'pack_name' when they appear anywhere in the conversation or in your reply, "
+    "otherwise null. The phone number is already known."
+)
+
+STRUCTURED_REPLY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "reply_to_client",
+        "description": "Send the reply to the client together with the detected intent and lead information",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "reply": {"type": "string"},
+                "intent": {"type": "string", "enum": ["product", "service", "general"]},
+                "client_name": {"type": ["string", "null"]},
+                "client_email": {"type": ["string", "null"]},
+                "pack_name": {"type": ["string", "null"]}
+            },
+            "required": ["reply", "intent", "client_name", "client_email", "pack_name"]
+        }
+    }
+}
+
+prefetch_executor = ThreadPoolExecutor(max_workers=AI_PREFETCH_WORKERS, thread_name_prefix="ai-prefetch")
+
+# End of a sentence (with closing quotes/brackets) or a line break
+SENTENCE_BOUNDARY = re.compile(r'[.!?\u2026\u061f]+["\')\]]*\s+|\n+')
+
+_stream_stats = {"streams": 0, "chunks": 0, "ttfb_total": 0.0, "duration_total": 0.0}
+_stream_stats_lock = threading.Lock()
+
+
+def prepare_request(message, client_phone=None, tenant_id=None, question_type=None, llm_intent=True):
+    """
+    Run the independent pre-completion steps concurrently: intent classification,
+    query embedding and the conversation history and summary reads.
+
+    Returns:
+        dict: {"question_type", "embedding", "conversation", "summary"}, shared by every step of
+              the request so nothing is computed twice. With llm_intent=False the intent
+              is only classified locally and left as None when not confident.
+    """
+    from .conversation_store import get_conversation
+
+    start_time = time.time()
+
+    # The local classifier scores the embedding, so only the LLM classifier runs in parallel with it
+    local_intent = (INTENT_CLASSIFIER == 'local' or not llm_intent) and tenant_id
+
+    embedding_future = prefetch_executor.submit(get_embedding, message, tenant_id)
+    intent_future = None
+    if not question_type and not local_intent and llm_intent:
+        intent_future = prefetch_executor.submit(classify_intent, message, tenant_id)
+    conversation_future = summary_future = None
+    if tenant_id and client_phone:
+        conversation_future = prefetch_executor.submit(get_conversation, tenant_id, client_phone)
+        summary_future = prefetch_executor.submit(get_summary, tenant_id, client_phone)
+
+    embedding = embedding_future.result()
+    if intent_future:
+        question_type = intent_future.result()
+    elif not question_type:
+        question_type = resolve_intent(message, embedding, tenant_id, llm_fallback=llm_intent)
+
+    prepared = {
+        "embedding": embedding,
+        "question_type": question_type,
+        "conversation": conversation_future.result() if conversation_future else None,
+        "summary": summary_future.result() if summary_future else None
+    }
 
-def open_ai_gpt(message, client_phone=None, question_type=None, tenant_id=None):
+    logger.debug("Request prepared", extra={
+        "duration_ms": round((time.time() - start_time) * 1000),
+        "question_type": prepared["question_type"],
+        "has_embedding": prepared["embedding"] is not None
+    })
+    return prepared
+
+
+def resolve_intent(message, embedding, tenant_id, llm_fallback=True):
+    """
+    Classify the message locally against the tenant's catalog centroids and only fall
+    back to the LLM classifier when the local decision is not confident.
+    """
+    label, margin = None, 0.0
+    if embedding:
+        try:
+            label, margin = classify_local(embedding, tenant_id)
+        except Exception as e:
+            logger.error("Local intent classification failed", extra={"error": str(e), "tenant": tenant_id})
+
+    if label and is_confident(margin):
+        record_decision(fallback=False)
+        if random.random() < INTENT_SHADOW_SAMPLE_RATE:
+            # Sample the LLM in the background to keep measuring agreement
+            prefetch_executor.submit(lambda: record_agreement(label, classify_intent(message, tenant_id, optional=True)))
+        logger.debug("Intent classified locally", extra={"intent": label, "margin": round(margin, 4)})
+        return label
+
+    if not llm_fallback:
+        return None
+
+    record_decision(fallback=True)
+    llm_label = classify_intent(message, tenant_id)
+    record_agreement(label, llm_label, fallback=True)
+    return llm_label
+
+
+def open_ai_gpt(message, client_phone=None, question_type=None, tenant_id=None, prepared=None, use_semantic_cache=False):
     # Mask sensitive identifiers for logging
     masked_phone = mask_identifier(client_phone) if client_phone else None
 
@@ -20,42 +143,17 @@ def open_ai_gpt(message, client_phone=None, question_type=None, tenant_id=None):
         "question_type": question_type
     })
 
-    embedding = get_embedding(message)
-    if not embedding:
-        logger.warning("Embedding generation failed", {
-            "client": masked_phone,
-            "tenant": tenant_id
-        })
+    if prepared is None:
+        prepared = prepare_request(message, client_phone, tenant_id, question_type)
 
-    if not question_type:
-        question_type = classify_intent(message)
+    cacheable = use_semantic_cache and is_cacheable(question_type or prepared["question_type"], prepared)
+    if cacheable:
+        cached = cached_reply(message, client_phone, tenant_id, prepared)
+        if cached:
+            return cached
 
-    # Build context information based on message type
-    context_info = ""
-    if embedding and tenant_id:
-        if question_type == 'service':
-            services = Service.search_services_by_embedding(embedding, tenant_id)
-            if services:
-                context_info = build_services_context(services)
-                logger.debug("Services context added", {"count": len(services)})
-        elif question_type == 'product':
-            products = Product.search_products_by_embedding(embedding, tenant_id)
-            if products:
-                context_info = build_products_context(products)
-                logger.debug("Products context added", {"count": len(products)})
-        elif question_type == 'general':
-            tenant_info = TenantInfo.get_tenant_information(embedding, tenant_id)
-            if tenant_info:
-                context_info = build_tenant_context(tenant_info)
-                logger.debug("Tenant context added")
-
-    user_content = message
-    if context_info:
-        user_content = f"User question: {message}\n\nContext information (not visible to user):{context_info}"
-
-    # Track conversation history
     start_time = time.time()
-    messages = context_memory(client_phone, {"role": "user", "content": user_content}, tenant_id=tenant_id)
+    messages, question_type = chat_messages(message, client_phone, question_type, tenant_id, prepared)
 
     # Call OpenAI API
     url = "https://api.openai.com/v1/chat/completions"
@@ -69,8 +167,11 @@ def open_ai_gpt(message, client_phone=None, question_type=None, tenant_id=None):
         "messages": messages
     }
 
+    if not rate_limit.acquire(tenant_id, rate_limit.estimate_tokens(messages)):
+        return rate_limit.RATE_LIMITED
+
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = http_client.post(url, service='openai', headers=headers, data=json.dumps(data))
         response_time = time.time() - start_time
 
         # Log API metrics
@@ -94,7 +195,10 @@ def open_ai_gpt(message, client_phone=None, question_type=None, tenant_id=None):
         })
 
         # Save AI response to conversation history
-        context_memory(client_phone, {"role": "assistant", "content": ai_response}, tenant_id=tenant_id)
+        save_reply(client_phone, ai_response, tenant_id, prepared["conversation"])
+        if cacheable:
+            semantic_cache.record_completion(response_time)
+            semantic_cache.store(tenant_id, message, prepared["embedding"], ai_response)
         return response_data
 
     except requests.exceptions.ConnectionError:
@@ -139,8 +243,364 @@ def open_ai_gpt(message, client_phone=None, question_type=None, tenant_id=None):
         return None
 
 
-def context_memory(client_phone, message=None, tenant_id=None):
-    from .redis_client import get_conversation, save_conversation
+def chat_messages(message, client_phone, question_type, tenant_id, prepared):
+    """
+    Retrieve context for the message and record it in the history.
+
+    Returns:
+        tuple: (prompt messages, question_type)
+    """
+    embedding = prepared["embedding"]
+    if not embedding:
+        logger.warning("Embedding generation failed", {
+            "client": mask_identifier(client_phone) if client_phone else None,
+            "tenant": tenant_id
+        })
+
+    if not question_type:
+        question_type = prepared["question_type"]
+
+    # Build context information based on message type
+    context_info = build_context_info(question_type, embedding, tenant_id)
+
+    # Track conversation history; retrieval context only goes into this turn's prompt
+    messages = context_memory(client_phone, {"role": "user", "content": message}, tenant_id=tenant_id,
+                              conversation=prepared["conversation"], context_info=context_info, summary=prepared.get("summary"))
+    return messages, question_type
+
+
+def is_cacheable(question_type, prepared):
+    return bool(prepared["embedding"]) and semantic_cache.is_eligible(question_type, prepared["conversation"])
+
+
+def cached_reply(message, client_phone, tenant_id, prepared):
+    """
+    Answer from the tenant's semantic cache, recording the turn in the history as usual.
+
+    Returns:
+        dict: A completion-shaped response with "cached": True, or None on a miss
+    """
+    answer = semantic_cache.lookup(tenant_id, prepared["embedding"])
+    if answer is None:
+        return None
+
+    from .conversation_store import append_conversation
+
+    append_conversation(tenant_id, client_phone, {"role": "user", "content": message}, {"role": "assistant", "content": answer})
+    logger.info("Reply served from semantic cache", {"client": mask_identifier(client_phone) if client_phone else None, "tenant": tenant_id})
+    return {
+        "model": None,
+        "choices": [{"message": {"role": "assistant", "content": answer}}],
+        "cached": True
+    }
+
+
+def split_sentences(buffer, min_chars=STREAM_CHUNK_MIN_CHARS):
+    """
+    Returns:
+        tuple: (chunk ready to send or None, rest of the buffer). A chunk ends at the last
+               sentence boundary once the buffer holds at least min_chars.
+    """
+    if len(buffer) < min_chars:
+        return None, buffer
+    boundaries = list(SENTENCE_BOUNDARY.finditer(buffer))
+    if not boundaries:
+        return None, buffer
+    end = boundaries[-1].end()
+    return buffer[:end].strip(), buffer[end:]
+
+
+def open_ai_gpt_stream(message, client_phone=None, question_type=None, tenant_id=None, prepared=None, on_chunk=None,
+                       use_semantic_cache=False):
+    """
+    Stream the chat completion (server-sent events). With on_chunk, every complete run of
+    sentences is handed over as soon as it arrives, and the tail when the stream ends.
+
+    Returns:
+        dict: The same shape as a non-streamed completion, rate_limit.RATE_LIMITED when the
+              quota denied the call, or None on failure
+    """
+    masked_phone = mask_identifier(client_phone) if client_phone else None
+
+    if prepared is None:
+        prepared = prepare_request(message, client_phone, tenant_id, question_type)
+
+    cacheable = use_semantic_cache and is_cacheable(question_type or prepared["question_type"], prepared)
+    if cacheable:
+        cached = cached_reply(message, client_phone, tenant_id, prepared)
+        if cached:
+            if on_chunk:
+                on_chunk(cached['choices'][0]['message']['content'])
+                cached["chunks_sent"] = 1
+            return cached
+
+    messages, question_type = chat_messages(message, client_phone, question_type, tenant_id, prepared)
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+    data = {
+        "model": "gpt-3.5-turbo",
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True}
+    }
+
+    if not rate_limit.acquire(tenant_id, rate_limit.estimate_tokens(messages)):
+        return rate_limit.RATE_LIMITED
+
+    start_time = time.time()
+    first_token_at = None
+    parts, buffer, chunks = [], "", 0
+    model, usage = None, {}
+
+    try:
+        with http_client.post("https://api.openai.com/v1/chat/completions", service='openai',
+                              headers=headers, json=data, stream=True) as response:
+            response.raise_for_status()
+
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+
+                event = json.loads(payload)
+                model = event.get('model', model)
+                usage = event.get('usage') or usage
+                if not event.get('choices'):
+                    continue
+
+                delta = event['choices'][0].get('delta', {}).get('content')
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.time()
+
+                parts.append(delta)
+                if on_chunk:
+                    buffer += delta
+                    chunk, buffer = split_sentences(buffer)
+                    if chunk:
+                        on_chunk(chunk)
+                        chunks += 1
+
+        if on_chunk and buffer.strip():
+            on_chunk(buffer.strip())
+            chunks += 1
+
+        ai_response = "".join(parts)
+        duration = time.time() - start_time
+        ttfb = (first_token_at or time.time()) - start_time
+        record_stream(ttfb, duration, chunks)
+
+        logger.info("OpenAI stream completed", {
+            "model": model or 'unknown',
+            "ttfb_ms": round(ttfb * 1000),
+            "duration_ms": round(duration * 1000),
+            "chunks_sent": chunks,
+            "prompt_tokens": usage.get('prompt_tokens', 0),
+            "completion_tokens": usage.get('completion_tokens', 0),
+            "question_type": question_type
+        })
+
+        if not ai_response:
+            return None
+
+        save_reply(client_phone, ai_response, tenant_id, prepared["conversation"])
+        if cacheable:
+            semantic_cache.record_completion(duration)
+            semantic_cache.store(tenant_id, message, prepared["embedding"], ai_response)
+        return {
+            "model": model,
+            "usage": usage,
+            "choices": [{"message": {"role": "assistant", "content": ai_response}}],
+            "chunks_sent": chunks
+        }
+
+    except requests.exceptions.RequestException as e:
+        logger.error("OpenAI stream failed", {
+            "client": masked_phone,
+            "error_type": type(e).__name__,
+            "error": str(e),
+            "chunks_sent": chunks
+        })
+        return None
+    except Exception as e:
+        logger.error("OpenAI stream unexpected error", {
+            "client": masked_phone,
+            "error_type": "unexpected",
+            "error": str(e),
+            "chunks_sent": chunks
+        })
+        return None
+
+
+def record_stream(ttfb, duration, chunks):
+    with _stream_stats_lock:
+        _stream_stats["streams"] += 1
+        _stream_stats["chunks"] += chunks
+        _stream_stats["ttfb_total"] += ttfb
+        _stream_stats["duration_total"] += duration
+
+
+def stream_stats():
+    with _stream_stats_lock:
+        stats = dict(_stream_stats)
+    streams = stats.pop("streams")
+    ttfb_total = stats.pop("ttfb_total")
+    duration_total = stats.pop("duration_total")
+    stats["streams"] = streams
+    stats["avg_ttfb_ms"] = round(ttfb_total / streams * 1000) if streams else None
+    stats["avg_duration_ms"] = round(duration_total / streams * 1000) if streams else None
+    return stats
+
+
+def retrieve(model, embedding, tenant_id, limit=3):
+    """Nearest catalog rows from the configured backend: pgvector or the in-process NumPy index"""
+    if RETRIEVAL_BACKEND == 'memory':
+        return vector_index.search(model, embedding, tenant_id, limit)
+    if model is Service:
+        return Service.search_services_by_embedding(embedding, tenant_id, limit)
+    if model is Product:
+        return Product.search_products_by_embedding(embedding, tenant_id, limit)
+    return TenantInfo.get_tenant_information(embedding, tenant_id, limit)
+
+
+def context_source(question_type):
+    """
+    Returns:
+        tuple: (model, limit, formatter) retrieved for the intent, or None for an unknown intent
+    """
+    return {
+        'service': (Service, 3, build_services_context),
+        'product': (Product, 3, build_products_context),
+        'general': (TenantInfo, 1, build_tenant_context),
+    }.get(question_type)
+
+
+def build_context_info(question_type, embedding, tenant_id):
+    """Retrieve the catalog rows matching the intent and format them for the prompt"""
+    source = context_source(question_type)
+    if not embedding or not tenant_id or not source:
+        return ""
+
+    model, limit, formatter = source
+    rows = retrieve(model, embedding, tenant_id, limit)
+    if not rows:
+        return ""
+
+    logger.debug("Catalog context added", {"question_type": question_type, "count": len(rows)})
+    return formatter(rows)
+
+
+def open_ai_structured(message, client_phone=None, tenant_id=None, prepared=None, client_id=None):
+    """
+    Single completion pipeline: one forced tool call returns the reply text, the detected
+    intent and the lead fields, replacing the classify/reply/extract/extract calls.
+
+    Returns:
+        dict: {"reply", "intent", "client_name", "client_email", "pack_name"},
+              rate_limit.RATE_LIMITED when the quota denied the call, or None on failure
+    """
+    masked_phone = mask_identifier(client_phone) if client_phone else None
+
+    if prepared is None:
+        prepared = prepare_request(message, client_phone, tenant_id, llm_intent=False)
+
+    embedding = prepared["embedding"]
+    question_type = prepared["question_type"]
+
+    # Without a confident local intent, retrieve for every intent rather than spend a classification call
+    context_info = "\n".join(filter(None, (
+        build_context_info(intent, embedding, tenant_id)
+        for intent in ((question_type,) if question_type else INTENT_LABELS)
+    )))
+
+    messages = context_memory(client_phone, {"role": "user", "content": message}, tenant_id=tenant_id,
+                              conversation=prepared["conversation"], context_info=context_info, summary=prepared.get("summary"))
+    messages.append({"role": "system", "content": STRUCTURED_REPLY_PROMPT})
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {OPENAI_API_KEY}"
+    }
+
+    payload = {
+        "model": "gpt-3.5-turbo",
+        "messages": messages,
+        "tools": [STRUCTURED_REPLY_TOOL],
+        "tool_choice": {"type": "function", "function": {"name": STRUCTURED_REPLY_TOOL["function"]["name"]}}
+    }
+
+    if not rate_limit.acquire(tenant_id, rate_limit.estimate_tokens(messages)):
+        return rate_limit.RATE_LIMITED
+
+    try:
+        start_time = time.time()
+        response = http_client.post("https://api.openai.com/v1/chat/completions", service='openai', headers=headers, json=payload)
+
+        logger.debug("Structured completion API call completed", extra={
+            "duration_ms": round((time.time() - start_time) * 1000),
+            "status_code": response.status_code
+        })
+
+        response.raise_for_status()
+        data = response.json()
+        tool_call = data['choices'][0]['message']['tool_calls'][0]
+        result = json.loads(tool_call['function']['arguments'])
+
+        usage = data.get('usage', {})
+        logger.info("OpenAI structured request successful", extra={
+            "prompt_tokens": usage.get('prompt_tokens', 0),
+            "completion_tokens": usage.get('completion_tokens', 0),
+            "local_intent": question_type,
+            "intent": result.get('intent')
+        })
+
+        if not result.get('reply'):
+            logger.error("Structured completion returned no reply", extra={"client": masked_phone})
+            return None
+
+        save_reply(client_phone, result['reply'], tenant_id, prepared["conversation"])
+
+        handle_extracted_client_data(result, client_phone, tenant_id, client_id, dedupe_window=ORDER_DEDUPE_WINDOW)
+        return result
+
+    except requests.exceptions.HTTPError as e:
+        status_code = e.response.status_code if e.response is not None else 'unknown'
+        logger.error("OpenAI API error during structured completion", extra={
+            "client": masked_phone,
+            "status_code": status_code,
+            "error": str(e)
+        })
+        return None
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        logger.error("Malformed structured completion", extra={
+            "client": masked_phone,
+            "error": str(e)
+        })
+        return None
+    except Exception as e:
+        logger.error("Structured completion unexpected error", extra={
+            "client": masked_phone,
+            "error_type": type(e).__name__,
+            "error": str(e)
+        })
+        return None
+
+
+def context_memory(client_phone, message=None, tenant_id=None, conversation=None, context_info=None, summary=None):
+    """
+    Append message to the stored history and return the prompt fitted to PROMPT_TOKEN_BUDGET.
+    A conversation list already read for this request is updated in place instead of re-read;
+    the store itself only ever receives the appended message. context_info is added to the
+    current message in the prompt only, never to the stored history.
+    """
+    from .conversation_store import get_conversation, append_conversation
 
     # Mask phone number for logging
     masked_phone = mask_identifier(client_phone) if client_phone else None
@@ -153,37 +613,29 @@ def context_memory(client_phone, message=None, tenant_id=None):
         return []
 
     try:
-        conversation = get_conversation(tenant_id, client_phone)
+        if conversation is None:
+            summary = get_summary(tenant_id, client_phone)
+            if message:
+                # Append and read back in the same round-trip
+                conversation = append_conversation(tenant_id, client_phone, message, read=True)
+            else:
+                conversation = get_conversation(tenant_id, client_phone)
+        elif message:
+            conversation.append(message)
+            del conversation[:-CONVERSATION_MAX_LENGTH]
+            append_conversation(tenant_id, client_phone, message)
 
         if message:
             message_type = message.get('role', 'unknown')
-            conversation.append(message)
-
-            if len(conversation) > CONVERSATION_MAX_LENGTH:
-                logger.debug("Trimming conversation history", {
-                    "client": masked_phone,
-                    "original_length": len(conversation),
-                    "new_length": CONVERSATION_MAX_LENGTH
-                })
-                while len(conversation) > CONVERSATION_MAX_LENGTH:
-                    conversation.pop(0)
-
-            save_conversation(tenant_id, client_phone, conversation)
             logger.debug("Conversation updated", {
                 "client": masked_phone,
                 "message_type": message_type,
                 "conversation_length": len(conversation)
             })
 
-        complete_context = [
-            {
-                "role": "system",
-                "content": "You are an expert marketing consultant representing this business. Your goals are to:\n1. Identify client needs and match them to our products/services\n2. Overcome objections professionally (e.g., if price concerns arise, suggest more affordable alternatives)\n3. Actively sell and recommend our offerings based on client interests\n4. IMPORTANT: Do **not** request the client's personal information (name, email, the offer they like) until they show clear interest in a specific product or service\n5. CRITICAL: Once interest is shown, collect the client's full name, email address and the offer they want\n6. Then identify and confirm which specific pack/service the client wants to purchase\n7. Create detailed lead information including: client name, email, and selected pack/service\n8. Answer only business-related questions and politely redirect other inquiries by saying: 'That's outside my area. I can help you with our services instead.'\n9. Communicate in the same language as the client (French, Arabic, English, or Moroccan Darija)\n10. Analyze sentiment to provide personalized responses\n11. If the conversation stalls or gets off-topic, ask relevant questions to bring focus back\n12. NEVER answer questions unrelated to our business (e.g., AI, politics, programming, personal advice). Politely decline and refocus on business.\n\nMake responses concise, professional and sales-focused. Always guide the conversation toward understanding client needs first, and only collect personal info after they express interest in a product or service."
-            }
-        ]
-
-        complete_context.extend(conversation)
-        return complete_context
+        messages, uncovered = build_messages(conversation, summary, context_info)
+        schedule_summary(tenant_id, client_phone, summary, uncovered)
+        return messages
 
     except Exception as e:
         logger.error("Conversation history error", {
@@ -198,10 +650,24 @@ def context_memory(client_phone, message=None, tenant_id=None):
         }]
 
 
-def get_embedding(text):
+def save_reply(client_phone, reply, tenant_id, conversation=None):
+    """Append the assistant reply to the stored history (and to the request's copy of it)"""
+    from .conversation_store import append_conversation
+
+    if conversation is not None:
+        conversation.append({"role": "assistant", "content": reply})
+        del conversation[:-CONVERSATION_MAX_LENGTH]
+    append_conversation(tenant_id, client_phone, {"role": "assistant", "content": reply})
+
+
+def get_embedding(text, tenant_id=None):
     """ Convert the user message into embedding using OpenAI API """
     start_time = time.time()
 
+    cached = embedding_cache.get_embedding(EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
+
     if not OPENAI_API_KEY:
         logger.error("OpenAI API key missing", {
             "function": "get_embedding"
@@ -214,12 +680,15 @@ def get_embedding(text):
     }
 
     payload = {
-        "model": "text-embedding-ada-002",
+        "model": EMBEDDING_MODEL,
         "input": text
     }
 
+    if not rate_limit.acquire(tenant_id, rate_limit.estimate_text_tokens(text)):
+        return None
+
     try:
-        response = requests.post("https://api.openai.com/v1/embeddings", headers=headers, json=payload)
+        response = http_client.post("https://api.openai.com/v1/embeddings", service='openai', headers=headers, json=payload)
         response_time = time.time() - start_time
 
         logger.debug("Embedding API call completed", {
@@ -234,7 +703,9 @@ def get_embedding(text):
             "usage": data.get('usage', {}).get('total_tokens', 0)
         })
 
-        return data['data'][0]['embedding']
+        embedding = data['data'][0]['embedding']
+        embedding_cache.set_embedding(EMBEDDING_MODEL, text, embedding)
+        return embedding
 
     except requests.exceptions.HTTPError as e:
         status_code = e.response.status_code if hasattr(e, 'response') else 'unknown'
@@ -252,8 +723,6 @@ def get_embedding(text):
 
 
 def extract_client_info_with_ai(message, client_phone=None, tenant_id=None, client_id=None):
-    from models import Order
-
     masked_phone = mask_identifier(client_phone) if client_phone else None
 
     logger.info("Extracting client information", {
@@ -299,9 +768,13 @@ def extract_client_info_with_ai(message, client_phone=None, tenant_id=None, clie
         ],
     }
 
+    # Lead extraction is the first thing to go when the quota is tight
+    if not rate_limit.acquire(tenant_id, rate_limit.estimate_tokens(payload["messages"]), optional=True):
+        return None
+
     try:
         start_time = time.time()
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        response = http_client.post("https://api.openai.com/v1/chat/completions", service='openai', headers=headers, json=payload)
         response_time = time.time() - start_time
 
         logger.debug("Client info extraction API call completed", {
@@ -315,49 +788,7 @@ def extract_client_info_with_ai(message, client_phone=None, tenant_id=None, clie
 
         client_data = json.loads(ai_response)
 
-        # Safely log data with PII masked
-        log_info = {}
-        if client_data.get('client_name'):
-            log_info['has_name'] = True
-        if client_data.get('client_email'):
-            log_info['has_email'] = True
-        if client_data.get('pack_name'):
-            log_info['pack_name'] = client_data.get('pack_name')
-
-        logger.info("Client data extracted", log_info)
-
-        # Prepare complete client data
-        client_data['client_id'] = client_id
-        client_data['client_phone'] = client_phone
-        client_data['tenant_id'] = tenant_id
-        client_data['client_id'] = Client.get_client_id_from_phone(client_phone)
-
-        # Process complete information if available
-        if client_data['client_name'] and client_data['client_email'] and client_data['pack_name']:
-            logger.info("Complete client information received, creating order", {
-                "client": masked_phone,
-                "pack": client_data['pack_name']
-            })
-
-            order = Order.insert_from_ai_extraction(client_data)
-
-            if order:
-                logger.info("Order created successfully", {
-                    "client": masked_phone,
-                    "order_id": getattr(order, 'id', 'unknown')
-                })
-            else:
-                logger.error("Order creation failed", {
-                    "client": masked_phone,
-                    "pack": client_data['pack_name']
-                })
-        else:
-            logger.info("Incomplete client information", {
-                "client": masked_phone,
-                "has_name": client_data['client_name'] is not None,
-                "has_email": client_data['client_email'] is not None,
-                "has_pack": client_data['pack_name'] is not None
-            })
+        handle_extracted_client_data(client_data, client_phone, tenant_id, client_id)
 
         return client_data
 
@@ -385,23 +816,64 @@ def extract_client_info_with_ai(message, client_phone=None, tenant_id=None, clie
         return None
 
 
-def classify_intent(message):
-    """ Classify the intent of the message into 'product', 'service', or 'general' """
-    start_time = time.time()
+def handle_extracted_client_data(client_data, client_phone=None, tenant_id=None, client_id=None, dedupe_window=None):
+    """
+    Log extracted lead fields and create an order once name, email and pack are all known. With
+    dedupe_window, an order for the same pack created within that many seconds is updated instead.
+    """
+    from models import Order
 
-    if not OPENAI_API_KEY:
-        logger.error("OpenAI API key missing", {
-            "function": "classify_intent"
+    masked_phone = mask_identifier(client_phone) if client_phone else None
+
+    # Safely log data with PII masked
+    log_info = {}
+    if client_data.get('client_name'):
+        log_info['has_name'] = True
+    if client_data.get('client_email'):
+        log_info['has_email'] = True
+    if client_data.get('pack_name'):
+        log_info['pack_name'] = client_data.get('pack_name')
+
+    logger.info("Client data extracted", log_info)
+
+    # Prepare complete client data
+    client_data['client_phone'] = client_phone
+    client_data['tenant_id'] = tenant_id
+    client_data['client_id'] = client_id or Client.get_client_id_from_phone(client_phone, tenant_id)
+
+    # Process complete information if available
+    if client_data.get('client_name') and client_data.get('client_email') and client_data.get('pack_name'):
+        logger.info("Complete client information received, saving order", {
+            "client": masked_phone,
+            "pack": client_data['pack_name']
         })
-        return None
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}"
-    }
+        order = Order.insert_from_ai_extraction(client_data, dedupe_window=dedupe_window)
 
-    payload = {
-        "model": "gpt-3.5-turbo",
+        if order:
+            logger.info("Order saved successfully", {
+                "client": masked_phone,
+                "order_id": getattr(order, 'id', 'unknown')
+            })
+        else:
+            logger.error("Order creation failed", {
+                "client": masked_phone,
+                "pack": client_data['pack_name']
+            })
+    else:
+        logger.info("Incomplete client information", {
+            "client": masked_phone,
+            "has_name": client_data.get('client_name') is not None,
+            "has_email": client_data.get('client_email') is not None,
+            "has_pack": client_data.get('pack_name') is not None
+        })
+
+    return client_data
+
+
+def intent_payload(message):
+    return {
+        "model": INTENT_MODEL,
         "messages": [
             {
                 "role": "system",
@@ -416,8 +888,33 @@ def classify_intent(message):
         "temperature": 0
     }
 
+
+def classify_intent(message, tenant_id=None, optional=False):
+    """ Classify the intent of the message into 'product', 'service', or 'general' """
+    start_time = time.time()
+
+    cached = embedding_cache.get_intent(INTENT_MODEL, message)
+    if cached is not None:
+        return cached
+
+    if not OPENAI_API_KEY:
+        logger.error("OpenAI API key missing", {
+            "function": "classify_intent"
+        })
+        return None
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {OPENAI_API_KEY}"
+    }
+
+    payload = intent_payload(message)
+
+    if not rate_limit.acquire(tenant_id, rate_limit.estimate_tokens(payload["messages"], payload["max_tokens"]), optional=optional):
+        return None
+
     try:
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+        response = http_client.post("https://api.openai.com/v1/chat/completions", service='openai', headers=headers, json=payload)
         response_time = time.time() - start_time
 
         logger.debug("Intent classification API call completed", {
@@ -434,6 +931,7 @@ def classify_intent(message):
             "tokens": data.get('usage', {}).get('total_tokens', 0)
         })
 
+        embedding_cache.set_intent(INTENT_MODEL, message, intent)
         return intent
 
     except requests.exceptions.HTTPError as e:
@@ -474,7 +972,7 @@ def build_services_context(services):
 def build_products_context(products):
     """Build context info for products"""
     return "Relevant Products: \n" + "\n".join(
-        f"- {p.name}: {p.description} {p.price} {p.periode}" for p in products
+        f"- {p.name}: {p.description} {p.price} {p.unit}" for p in products
     )
 
 
@@ -0,0 +1,398 @@
+"""
+Async request path for the ASGI entry point (asgi.py): OpenAI and Graph calls through httpx,
+conversation state through redis.asyncio and pgvector searches through asyncpg, so a single
+process can wait on thousands of replies at once. Steps that stay synchronous (tenant and
+client lookups, transcription, lead extraction, the structured and streaming pipelines) run
+in worker threads inside the Flask app context.
+"""
+import asyncio
+import time
+
+from sqlalchemy.engine import make_url
+
+from config import (SQLALCHEMY_DATABASE_URI, OPENAI_API_KEY, AI_PIPELINE_MODE, AI_STREAMING, COALESCE_WINDOW_MS,
+                    RATE_LIMIT_BUSY_MESSAGE, INTENT_CLASSIFIER, RETRIEVAL_BACKEND, ASYNC_DB_POOL_SIZE, ASYNC_DB_MAX_OVERFLOW)
+from models.vector_search import asearch_by_embedding
+from .ai import (EMBEDDING_MODEL, INTENT_MODEL, context_source, intent_payload, is_cacheable,
+                 extract_client_info_with_ai, mask_identifier)
+from .intent import classify_local, is_confident, record_decision, record_agreement
+from .prompt import build_messages, get_summary, schedule_summary
+from .redis_client import _async_clients
+from .conversation_store import aget_conversation, aappend_conversation
+from .redis_config import CONVERSATION_MAX_LENGTH
+from .coalesce import aconversation_turn
+from .whatapp import asend_message, amark_read
+from .utils import group_conversations
+from .tenant_directory import resolve_tenant
+from .client_identity import resolve_client_id
+from .log_config import logger
+from . import http_client, embedding_cache, rate_limit, semantic_cache, vector_index
+
+
+CHAT_COMPLETIONS_URL = "https://api.openai.com/v1/chat/completions"
+EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
+
+_flask_app = None
+_engine = None
+_sessionmaker = None
+_background = set()
+
+
+def init_app(app):
+    global _flask_app
+    _flask_app = app
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run a synchronous helper in a worker thread, inside the Flask app context"""
+    def call():
+        with _flask_app.app_context():
+            return func(*args, **kwargs)
+    return await asyncio.to_thread(call)
+
+
+def spawn(coroutine):
+    """Fire-and-forget task that is kept referenced until it finishes"""
+    task = asyncio.create_task(coroutine)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+def get_sessionmaker():
+    global _engine, _sessionmaker
+    if _sessionmaker is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        # No asyncpg codec for vector: pgvector's SQLAlchemy type already binds and reads it as text
+        url = make_url(SQLALCHEMY_DATABASE_URI).set(drivername="postgresql+asyncpg")
+        _engine = create_async_engine(url, pool_size=ASYNC_DB_POOL_SIZE, max_overflow=ASYNC_DB_MAX_OVERFLOW, pool_pre_ping=True)
+        _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+    return _sessionmaker
+
+
+async def close():
+    await http_client.aclose_async_client()
+    for client in list(_async_clients.values()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning("Error closing async Redis client", extra={"error": str(e)})
+    _async_clients.clear()
+    if _engine is not None:
+        await _engine.dispose()
+
+
+def openai_headers():
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {OPENAI_API_KEY}"
+    }
+
+
+async def aget_embedding(text, tenant_id=None):
+    cached = await asyncio.to_thread(embedding_cache.get_embedding, EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
+
+    if not await rate_limit.aacquire(tenant_id, rate_limit.estimate_text_tokens(text)):
+        return None
+
+    try:
+        response = await http_client.arequest("POST", EMBEDDINGS_URL, service='openai', headers=openai_headers(),
+                                              json={"model": EMBEDDING_MODEL, "input": text})
+        response.raise_for_status()
+        embedding = response.json()['data'][0]['embedding']
+    except Exception as e:
+        logger.error("Embedding generation failed", {"error_type": type(e).__name__, "error": str(e)})
+        return None
+
+    await asyncio.to_thread(embedding_cache.set_embedding, EMBEDDING_MODEL, text, embedding)
+    return embedding
+
+
+async def aclassify_intent(message, tenant_id=None):
+    cached = await asyncio.to_thread(embedding_cache.get_intent, INTENT_MODEL, message)
+    if cached is not None:
+        return cached
+
+    payload = intent_payload(message)
+    if not await rate_limit.aacquire(tenant_id, rate_limit.estimate_tokens(payload["messages"], payload["max_tokens"])):
+        return None
+
+    try:
+        response = await http_client.arequest("POST", CHAT_COMPLETIONS_URL, service='openai', headers=openai_headers(), json=payload)
+        response.raise_for_status()
+        intent = response.json()['choices'][0]['message']['content'].strip()
+    except Exception as e:
+        logger.error("Intent classification failed", {"error_type": type(e).__name__, "error": str(e)})
+        return None
+
+    await asyncio.to_thread(embedding_cache.set_intent, INTENT_MODEL, message, intent)
+    return intent
+
+
+async def aresolve_intent(message, embedding, tenant_id):
+    """resolve_intent(): local centroids first, the LLM only when the local margin is too small"""
+    label, margin = None, 0.0
+    if embedding:
+        try:
+            label, margin = await run_sync(classify_local, embedding, tenant_id)
+        except Exception as e:
+            logger.error("Local intent classification failed", extra={"error": str(e), "tenant": tenant_id})
+
+    if label and is_confident(margin):
+        record_decision(fallback=False)
+        return label
+
+    record_decision(fallback=True)
+    llm_label = await aclassify_intent(message, tenant_id)
+    record_agreement(label, llm_label, fallback=True)
+    return llm_label
+
+
+async def aprepare_request(message, client_phone, tenant_id):
+    """prepare_request(): embedding, intent, history and summary reads run concurrently"""
+    embedding_task = asyncio.ensure_future(aget_embedding(message, tenant_id))
+    intent_task = None
+    if INTENT_CLASSIFIER != 'local':
+        intent_task = asyncio.ensure_future(aclassify_intent(message, tenant_id))
+
+    conversation, summary, embedding = await asyncio.gather(
+        aget_conversation(tenant_id, client_phone),
+        asyncio.to_thread(get_summary, tenant_id, client_phone),
+        embedding_task,
+    )
+    question_type = await intent_task if intent_task else await aresolve_intent(message, embedding, tenant_id)
+
+    return {
+        "embedding": embedding,
+        "question_type": question_type,
+        "conversation": conversation,
+        "summary": summary
+    }
+
+
+async def aretrieve(model, embedding, tenant_id, limit):
+    if RETRIEVAL_BACKEND == 'memory':
+        return await run_sync(vector_index.search, model, embedding, tenant_id, limit)
+    async with get_sessionmaker()() as session:
+        return await asearch_by_embedding(session, model, embedding, tenant_id, limit)
+
+
+async def abuild_context_info(question_type, embedding, tenant_id):
+    source = context_source(question_type)
+    if not embedding or not tenant_id or not source:
+        return ""
+
+    model, limit, formatter = source
+    rows = await aretrieve(model, embedding, tenant_id, limit)
+    return formatter(rows) if rows else ""
+
+
+async def acomplete(message_text, client_phone, tenant_id, prepared):
+    """
+    Classic pipeline reply: retrieval context for this turn, the budgeted prompt and one completion.
+
+    Returns:
+        str: The reply, rate_limit.RATE_LIMITED when the quota denied the call, or None on failure
+    """
+    context_info = await abuild_context_info(prepared["question_type"], prepared["embedding"], tenant_id)
+
+    user_message = {"role": "user", "content": message_text}
+    await aappend_conversation(tenant_id, client_phone, user_message)
+    conversation = ((prepared["conversation"] or []) + [user_message])[-CONVERSATION_MAX_LENGTH:]
+
+    messages, uncovered = build_messages(conversation, prepared["summary"], context_info)
+    schedule_summary(tenant_id, client_phone, prepared["summary"], uncovered)
+
+    if not await rate_limit.aacquire(tenant_id, rate_limit.estimate_tokens(messages)):
+        return rate_limit.RATE_LIMITED
+
+    try:
+        response = await http_client.arequest("POST", CHAT_COMPLETIONS_URL, service='openai', headers=openai_headers(),
+                                              json={"model": "gpt-3.5-turbo", "messages": messages})
+        response.raise_for_status()
+        data = response.json()
+    except Exception as e:
+        logger.error("OpenAI API error", {
+            "client": mask_identifier(client_phone),
+            "error_type": type(e).__name__,
+            "error": str(e)
+        })
+        return None
+
+    usage = data.get('usage', {})
+    logger.info("OpenAI request successful", {
+        "model": data.get('model', 'unknown'),
+        "prompt_tokens": usage.get('prompt_tokens', 0),
+        "completion_tokens": usage.get('completion_tokens', 0),
+        "question_type": prepared["question_type"]
+    })
+
+    reply = data['choices'][0]['message']['content']
+    await aappend_conversation(tenant_id, client_phone, {"role": "assistant", "content": reply})
+    return reply
+
+
+def from_flask(response):
+    """(body, status) of a Flask view result"""
+    if isinstance(response, tuple):
+        return response[0].get_json(), response[1]
+    return response.get_json(), response.status_code
+
+
+async def arespond(message_text, tenant, display_phone_number, client_phone, client_id):
+    """
+    Reply to one turn.
+
+    Returns:
+        tuple: (body, status) as returned by routes.respond
+    """
+    if AI_PIPELINE_MODE == 'structured' or AI_STREAMING != 'off':
+        from .routes import respond
+        return from_flask(await run_sync(respond, message_text, display_phone_number, client_phone, tenant.tenant_id, client_id))
+
+    tenant_id = tenant.tenant_id
+    try:
+        return await arespond_classic(message_text, tenant, client_phone, client_id)
+    except Exception as e:
+        logger.error("Error generating and sending response", extra={"error": str(e), "client_phone_number": client_phone[:6] + "******", "tenant_id": tenant_id})
+        return {"status": "error", "message": "Internal server error"}, 500
+
+
+async def arespond_classic(message_text, tenant, client_phone, client_id):
+    tenant_id = tenant.tenant_id
+    prepared = await aprepare_request(message_text, client_phone, tenant_id)
+    logger.info("Question classified", extra={"question_type": prepared["question_type"], "tenant_id": tenant_id})
+
+    cacheable = tenant.semantic_cache_enabled and is_cacheable(prepared["question_type"], prepared)
+    reply = None
+    if cacheable:
+        reply = await asyncio.to_thread(semantic_cache.lookup, tenant_id, prepared["embedding"])
+        if reply is not None:
+            await aappend_conversation(tenant_id, client_phone,
+                                       {"role": "user", "content": message_text}, {"role": "assistant", "content": reply})
+
+    if reply is None:
+        start_time = time.time()
+        reply = await acomplete(message_text, client_phone, tenant_id, prepared)
+        if not reply:
+            logger.error("Failed to get response from AI", extra={"client_phone_number": client_phone[:6] + "******", "tenant_id": tenant_id})
+            return {"status": "error", "message": "Failed to get response from AI"}, 500
+        if reply is rate_limit.RATE_LIMITED:
+            logger.warning("Completion rate limited, sending busy reply", extra={"client_phone_number": client_phone[:6] + "******", "tenant_id": tenant_id})
+            if not await asend_message(tenant, client_phone, RATE_LIMIT_BUSY_MESSAGE):
+                return {"status": "error", "message": "Failed to send response"}, 500
+            # The user message is already stored: answer it with what the client received
+            await aappend_conversation(tenant_id, client_phone, {"role": "assistant", "content": RATE_LIMIT_BUSY_MESSAGE})
+            return {"status": "success", "rate_limited": True}, 200
+        if cacheable:
+            semantic_cache.record_completion(time.time() - start_time)
+            await asyncio.to_thread(semantic_cache.store, tenant_id, message_text, prepared["embedding"], reply)
+
+    if not await asend_message(tenant, client_phone, reply):
+        logger.error("Failed to send response", extra={"client_phone_number": client_phone[:6] + "******", "tenant_id": tenant_id})
+        return {"status": "error", "message": "Failed to send response"}, 500
+
+    # Lead extraction after delivery, off the reply path
+    for text in (message_text, reply):
+        spawn(run_sync(extract_client_info_with_ai, text, client_phone, tenant_id, client_id))
+    return {"status": "success"}, 200
+
+
+async def agenerate_and_send_response(message_text, tenant, display_phone_number, client_phone, client_id):
+    if COALESCE_WINDOW_MS <= 0:
+        return await arespond(message_text, tenant, display_phone_number, client_phone, client_id)
+
+    async with aconversation_turn(tenant.tenant_id, client_phone, message_text) as turn:
+        if turn.text is None:
+            logger.info("Message merged into a later turn", extra={"client_phone_number": client_phone[:6] + "******", "tenant_id": tenant.tenant_id})
+            return {"status": "success"}, 200
+        body, status = await arespond(turn.text, tenant, display_phone_number, client_phone, client_id)
+        turn.failed = status >= 500
+        return body, status
+
+
+async def aprocess_conversation(tenant, display_phone_number, client_phone, events):
+    """routes.process_conversation() for the async entry point"""
+    from .routes import process_audio_message
+
+    if not tenant or not tenant.tenant_id:
+        logger.warning("Tenant ID not found for display phone number", extra={"display_phone_number": display_phone_number})
+        return {"status": "error", "message": "Tenant ID not found for display phone number"}, 404
+
+    if not client_phone:
+        logger.warning("Client phone number not found in data", extra={"message_count": len(events)})
+        return {"status": "error", "message": "Client phone number not found"}, 400
+
+    profile_name = next((webhook_event.profile_name for webhook_event in reversed(events) if webhook_event.profile_name), None) or "Unknown"
+    try:
+        client_id = await run_sync(resolve_client_id, tenant.tenant_id, client_phone, profile_name)
+    except Exception as e:
+        logger.error("Error resolving client", extra={"error": str(e), "client_phone_number": client_phone[:6] + '*****', "tenant_id": tenant.tenant_id})
+        return {"status": "error", "message": "Internal server error"}, 500
+
+    if AI_STREAMING != 'off':
+        for webhook_event in events:
+            if webhook_event.message_id:
+                spawn(amark_read(tenant, webhook_event.message_id))
+
+    texts = []
+    for webhook_event in events:
+        if webhook_event.kind == 'audio':
+            text = await run_sync(process_audio_message, webhook_event, tenant, client_phone)
+        elif webhook_event.kind == 'image':
+            text = webhook_event.text or '[IMAGE]'
+        elif webhook_event.kind == 'document':
+            text = webhook_event.text or '[DOCUMENT]'
+        else:
+            text = webhook_event.text
+        if text:
+            texts.append(text)
+
+    if not texts:
+        if any(webhook_event.kind == 'audio' for webhook_event in events):
+            return {"status": "error", "message": "Failed to transcribe audio"}, 500
+        return {"status": "success"}, 200
+
+    return await agenerate_and_send_response("\n".join(texts), tenant, display_phone_number, client_phone, client_id)
+
+
+async def aprocess_events(events):
+    """
+    Returns:
+        tuple: (body, status) of the first failed conversation, or a success
+    """
+    return merged_result(await aprocess_conversations(events))
+
+
+async def aprocess_conversations(events):
+    """
+    routes.process_conversations() for the async entry point; conversations are handled concurrently.
+
+    Returns:
+        list: (events, (body, status)) for every conversation, in delivery order
+    """
+    conversations = group_conversations(events)
+
+    numbers = list({display_phone_number for display_phone_number, _ in conversations})
+    tenants = dict(zip(numbers, await asyncio.gather(*(run_sync(resolve_tenant, number) for number in numbers))))
+
+    async def handle(display_phone_number, client_phone, group):
+        try:
+            return await aprocess_conversation(tenants[display_phone_number], display_phone_number, client_phone, group)
+        except Exception as e:
+            logger.error("Error processing WhatsApp message", extra={"error": str(e), "message_count": len(group)})
+            return {"status": "error", "message": "Internal server error"}, 500
+
+    results = await asyncio.gather(*(
+        handle(display_phone_number, client_phone, group)
+        for (display_phone_number, client_phone), group in conversations.items()
+    ))
+    return list(zip(conversations.values(), results))
+
+
+def merged_result(results):
+    """(body, status) of the first failed conversation of aprocess_conversations(), or a success"""
+    return next((result for _, result in results if result[1] >= 400), ({"status": "success"}, 200))
@@ -0,0 +1,64 @@
+import json
+import threading
+
+from .redis_client import redis_client
+from .redis_config import CATALOG_CHANNEL
+from .log_config import logger
+
+
+_handlers = []
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def on_catalog_change(handler):
+    """Register handler(tenant_id), called when a tenant's services, products or info change"""
+    if handler not in _handlers:
+        _handlers.append(handler)
+    return handler
+
+
+def _dispatch(tenant_ids):
+    for tenant_id in tenant_ids:
+        for handler in _handlers:
+            try:
+                handler(tenant_id)
+            except Exception as e:
+                logger.error("Catalog change handler failed", extra={"error": str(e), "tenant": tenant_id})
+
+
+def publish_catalog_change(tenant_ids):
+    """Tell every process (this one included) that these tenants' catalogs changed"""
+    tenant_ids = sorted({tenant_id for tenant_id in tenant_ids if tenant_id is not None})
+    if not tenant_ids:
+        return
+
+    _dispatch(tenant_ids)
+    try:
+        redis_client.publish(CATALOG_CHANNEL, json.dumps(tenant_ids))
+    except Exception as e:
+        logger.warning("Error publishing catalog change", extra={"error": str(e)})
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CATALOG_CHANNEL)
+            for message in pubsub.listen():
+                _dispatch(json.loads(message['data']))
+        except Exception as e:
+            logger.warning("Catalog change listener disconnected", extra={"error": str(e)})
+            threading.Event().wait(5)
+
+
+def ensure_listener():
+    """Start the background subscriber once per process"""
+    global _listener
+    if _listener is not None:
+        return
+
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name="catalog-events", daemon=True)
+            _listener.start()
@@ -0,0 +1,27 @@
+from models import Client
+from .redis_client import redis_client
+from .redis_config import get_client_key, CONVERSATION_EXPIRY
+from .log_config import logger
+
+
+def resolve_client_id(tenant_id, client_phone, profile_name):
+    """
+    Return the client id for this (tenant, phone), creating the client on first contact.
+    The id is memoized in Redis for as long as the conversation lives, so an ongoing
+    conversation costs no DB round-trip and a new one costs a single upsert.
+    """
+    key = get_client_key(tenant_id, client_phone)
+    try:
+        cached = redis_client.getex(key, ex=CONVERSATION_EXPIRY)
+        if cached:
+            return int(cached)
+    except Exception as e:
+        logger.warning("Client id cache read failed", extra={"error": str(e)})
+
+    client_id = Client.upsert(tenant_id, client_phone, profile_name)
+
+    try:
+        redis_client.set(key, client_id, ex=CONVERSATION_EXPIRY)
+    except Exception as e:
+        logger.warning("Client id cache write failed", extra={"error": str(e)})
+    return client_id
@@ -0,0 +1,202 @@
+import asyncio
+import time
+import uuid
+from contextlib import contextmanager, asynccontextmanager
+
+from config import COALESCE_WINDOW_MS, COALESCE_LOCK_TTL
+from .redis_client import redis_client, get_async_redis
+from .redis_config import get_turn_key
+from .log_config import logger
+
+
+# Delete the lock only if this handler still owns it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+LOCK_POLL_INTERVAL = 0.1
+
+_release = redis_client.register_script(RELEASE_SCRIPT)
+
+
+def keys(tenant_id, client_phone):
+    base = get_turn_key(tenant_id, client_phone)
+    return f"{base}:pending", f"{base}:latest", f"{base}:lock"
+
+
+class Turn:
+    """
+    The messages answered by one handler. The handler sets failed when its reply could not be
+    delivered, so the messages it took from the burst are buffered again for the retry.
+    """
+
+    def __init__(self, messages=None):
+        self.messages = messages or []
+        self.failed = False
+
+    @property
+    def text(self):
+        return "\n".join(self.messages) if self.messages else None
+
+
+def requeued(turn, message_text):
+    """
+    Messages to buffer again after a failed turn: all but the handler's own message, which
+    comes back with the retry of the failed delivery or job.
+    """
+    if not turn.failed or not turn.messages:
+        return []
+    messages = list(turn.messages)
+    if message_text in messages:
+        del messages[len(messages) - 1 - messages[::-1].index(message_text)]
+    return messages
+
+
+def is_latest(latest_key, token):
+    return redis_client.get(latest_key) in (token, None)
+
+
+@contextmanager
+def conversation_turn(tenant_id, client_phone, message_text, window_ms=COALESCE_WINDOW_MS):
+    """
+    Merge a burst of messages from one client into a single turn.
+
+    Every message is buffered and marks itself as the latest of the burst; its handler then
+    waits out the window. Only the handler of the last message of the burst goes on: it takes
+    the conversation lock (waiting for a reply still being generated) and yields a Turn with
+    all buffered messages. Other handlers get an empty Turn (text None) and should not reply.
+    The earlier messages were already acknowledged, so a failed turn pushes them back.
+    """
+    pending_key, latest_key, lock_key = keys(tenant_id, client_phone)
+    token = uuid.uuid4().hex
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.rpush(pending_key, message_text)
+        pipe.expire(pending_key, COALESCE_LOCK_TTL)
+        pipe.set(latest_key, token, ex=COALESCE_LOCK_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.error("Coalescing unavailable, replying to message alone", extra={"error": str(e)})
+        yield Turn([message_text])
+        return
+
+    time.sleep(window_ms / 1000)
+    if not is_latest(latest_key, token):
+        yield Turn()
+        return
+
+    # At most one generation per conversation; wait for the one in flight
+    deadline = time.time() + COALESCE_LOCK_TTL
+    while not redis_client.set(lock_key, token, nx=True, ex=COALESCE_LOCK_TTL):
+        if time.time() > deadline or not is_latest(latest_key, token):
+            yield Turn()
+            return
+        time.sleep(LOCK_POLL_INTERVAL)
+
+    turn = Turn()
+    try:
+        # A message that arrived while waiting for the lock owns the burst now
+        if not is_latest(latest_key, token):
+            yield turn
+            return
+
+        pipe = redis_client.pipeline()
+        pipe.lrange(pending_key, 0, -1)
+        pipe.delete(pending_key)
+        turn.messages = pipe.execute()[0]
+
+        if len(turn.messages) > 1:
+            logger.info("Messages coalesced into one turn", extra={"tenant": tenant_id, "count": len(turn.messages)})
+        try:
+            yield turn
+        except Exception:
+            turn.failed = True
+            raise
+    finally:
+        try:
+            requeue = requeued(turn, message_text)
+            if requeue:
+                # Ahead of anything buffered since, in their original order
+                pipe = redis_client.pipeline()
+                pipe.lpush(pending_key, *reversed(requeue))
+                pipe.expire(pending_key, COALESCE_LOCK_TTL)
+                pipe.execute()
+                logger.warning("Turn failed, messages buffered again", extra={"tenant": tenant_id, "count": len(requeue)})
+        except Exception as e:
+            logger.error("Error buffering the messages of a failed turn", extra={"error": str(e)})
+        try:
+            _release(keys=[lock_key], args=[token])
+        except Exception as e:
+            logger.warning("Error releasing conversation lock", extra={"error": str(e)})
+
+
+@asynccontextmanager
+async def aconversation_turn(tenant_id, client_phone, message_text, window_ms=COALESCE_WINDOW_MS):
+    """Async conversation_turn(), sharing its keys and lock protocol"""
+    client = get_async_redis()
+    pending_key, latest_key, lock_key = keys(tenant_id, client_phone)
+    token = uuid.uuid4().hex
+
+    async def is_latest_async():
+        return await client.get(latest_key) in (token, None)
+
+    try:
+        pipe = client.pipeline()
+        pipe.rpush(pending_key, message_text)
+        pipe.expire(pending_key, COALESCE_LOCK_TTL)
+        pipe.set(latest_key, token, ex=COALESCE_LOCK_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logger.error("Coalescing unavailable, replying to message alone", extra={"error": str(e)})
+        yield Turn([message_text])
+        return
+
+    await asyncio.sleep(window_ms / 1000)
+    if not await is_latest_async():
+        yield Turn()
+        return
+
+    deadline = time.time() + COALESCE_LOCK_TTL
+    while not await client.set(lock_key, token, nx=True, ex=COALESCE_LOCK_TTL):
+        if time.time() > deadline or not await is_latest_async():
+            yield Turn()
+            return
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+    turn = Turn()
+    try:
+        if not await is_latest_async():
+            yield turn
+            return
+
+        pipe = client.pipeline()
+        pipe.lrange(pending_key, 0, -1)
+        pipe.delete(pending_key)
+        turn.messages = (await pipe.execute())[0]
+
+        if len(turn.messages) > 1:
+            logger.info("Messages coalesced into one turn", extra={"tenant": tenant_id, "count": len(turn.messages)})
+        try:
+            yield turn
+        except Exception:
+            turn.failed = True
+            raise
+    finally:
+        try:
+            requeue = requeued(turn, message_text)
+            if requeue:
+                pipe = client.pipeline()
+                pipe.lpush(pending_key, *reversed(requeue))
+                pipe.expire(pending_key, COALESCE_LOCK_TTL)
+                await pipe.execute()
+                logger.warning("Turn failed, messages buffered again", extra={"tenant": tenant_id, "count": len(requeue)})
+        except Exception as e:
+            logger.error("Error buffering the messages of a failed turn", extra={"error": str(e)})
+        try:
+            await client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            logger.warning("Error releasing conversation lock", extra={"error": str(e)})
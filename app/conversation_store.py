@@ -0,0 +1,275 @@
+"""
+Conversation histories behind one interface, so the pipeline keeps its memory when Redis is
+unavailable. CONVERSATION_STORE picks the backend: "redis", "memory" (this process only, lost on
+restart and not shared between workers) or "auto", which uses Redis when it answers a ping on
+first use and process memory otherwise.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from .redis_client import redis_client, get_async_redis
+from .redis_config import (get_conversation_key, get_conversation_list_key, CONVERSATION_EXPIRY, CONVERSATION_MAX_LENGTH,
+                           CONVERSATION_STORE, CONVERSATION_MEMORY_MAX_ENTRIES, CONVERSATION_MEMORY_MAX_BYTES)
+from .log_config import logger
+
+
+class RedisConversationStore:
+    """One Redis list of JSON messages per conversation"""
+
+    name = 'redis'
+
+    def migrate_legacy(self, tenant_id, client_phone, list_key):
+        """
+        Move a history stored as one JSON string into the list. GETDEL hands it to a single
+        caller, and LPUSH puts it ahead of anything appended meanwhile.
+        """
+        data = redis_client.getdel(get_conversation_key(tenant_id, client_phone))
+        if not data:
+            return []
+
+        conversation = json.loads(data)[-CONVERSATION_MAX_LENGTH:]
+        if conversation:
+            pipe = redis_client.pipeline()
+            pipe.lpush(list_key, *(json.dumps(message) for message in reversed(conversation)))
+            pipe.ltrim(list_key, -CONVERSATION_MAX_LENGTH, -1)
+            pipe.expire(list_key, CONVERSATION_EXPIRY)
+            pipe.lrange(list_key, 0, -1)
+            return [json.loads(item) for item in pipe.execute()[-1]]
+        return conversation
+
+    def get(self, tenant_id, client_phone):
+        key = get_conversation_list_key(tenant_id, client_phone)
+        try:
+            items = redis_client.lrange(key, 0, -1)
+            if not items:
+                return self.migrate_legacy(tenant_id, client_phone, key)
+            return [json.loads(item) for item in items]
+        except Exception as e:
+            logger.error("Error retrieving conversation from Redis", extra={"error": str(e)})
+            return []
+
+    def append(self, tenant_id, client_phone, messages, read=False):
+        """
+        Append messages, trim to CONVERSATION_MAX_LENGTH and refresh the expiry in one
+        MULTI round-trip. Concurrent appends for the same client never overwrite each other.
+        """
+        key = get_conversation_list_key(tenant_id, client_phone)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.rpush(key, *(json.dumps(message) for message in messages))
+            pipe.ltrim(key, -CONVERSATION_MAX_LENGTH, -1)
+            pipe.expire(key, CONVERSATION_EXPIRY)
+            if read:
+                pipe.lrange(key, 0, -1)
+            results = pipe.execute()
+            return [json.loads(item) for item in results[-1]] if read else True
+        except Exception as e:
+            logger.error("Error saving conversation to Redis", extra={"error": str(e)})
+            return [] if read else False
+
+    def save(self, tenant_id, client_phone, conversation):
+        key = get_conversation_list_key(tenant_id, client_phone)
+        try:
+            conversation = conversation[-CONVERSATION_MAX_LENGTH:]
+
+            pipe = redis_client.pipeline()
+            pipe.delete(key)
+            if conversation:
+                pipe.rpush(key, *(json.dumps(message) for message in conversation))
+                pipe.expire(key, CONVERSATION_EXPIRY)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error("Error saving conversation to Redis", extra={"error": str(e)})
+            return False
+
+    async def aget(self, tenant_id, client_phone):
+        """Legacy JSON-string histories are still migrated by the sync code"""
+        key = get_conversation_list_key(tenant_id, client_phone)
+        try:
+            items = await get_async_redis().lrange(key, 0, -1)
+            if not items:
+                return await asyncio.to_thread(self.migrate_legacy, tenant_id, client_phone, key)
+            return [json.loads(item) for item in items]
+        except Exception as e:
+            logger.error("Error retrieving conversation from Redis", extra={"error": str(e)})
+            return []
+
+    async def aappend(self, tenant_id, client_phone, messages):
+        key = get_conversation_list_key(tenant_id, client_phone)
+        try:
+            pipe = get_async_redis().pipeline()
+            pipe.rpush(key, *(json.dumps(message) for message in messages))
+            pipe.ltrim(key, -CONVERSATION_MAX_LENGTH, -1)
+            pipe.expire(key, CONVERSATION_EXPIRY)
+            await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error("Error saving conversation to Redis", extra={"error": str(e)})
+            return False
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class MemoryConversationStore:
+    """
+    In-process LRU bounded by conversation count and stored bytes, with the same expiry as the
+    Redis keys (refreshed on write). Each message is kept as compact UTF-8 JSON bytes, so a
+    history costs about its serialized size instead of a list of dicts.
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_entries=CONVERSATION_MEMORY_MAX_ENTRIES, max_bytes=CONVERSATION_MEMORY_MAX_BYTES,
+                 expiry=CONVERSATION_EXPIRY, max_length=CONVERSATION_MAX_LENGTH, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+        self.max_length = max_length
+        self.clock = clock
+        # key -> (expires_at, size, tuple of encoded messages)
+        self.data = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counts = {"evicted": 0, "expired": 0}
+
+    @staticmethod
+    def key(tenant_id, client_phone):
+        return get_conversation_list_key(tenant_id, client_phone)
+
+    @staticmethod
+    def encode(message):
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def remove(self, key):
+        entry = self.data.pop(key, None)
+        if entry:
+            self.size -= entry[1]
+        return entry
+
+    def lookup(self, key):
+        """Live entry for key, or None; the caller holds the lock"""
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            self.remove(key)
+            self.counts["expired"] += 1
+            return None
+        self.data.move_to_end(key)
+        return entry
+
+    def put(self, key, items):
+        """Store items under key and evict least recently used conversations over the bounds; the caller holds the lock"""
+        self.remove(key)
+        if not items:
+            return
+        size = len(key) + sum(len(item) for item in items)
+        self.data[key] = (self.clock() + self.expiry, size, items)
+        self.size += size
+
+        while self.data and (len(self.data) > self.max_entries or self.size > self.max_bytes):
+            oldest, entry = next(iter(self.data.items()))
+            self.remove(oldest)
+            self.counts["expired" if entry[0] <= self.clock() else "evicted"] += 1
+
+    def get(self, tenant_id, client_phone):
+        with self.lock:
+            entry = self.lookup(self.key(tenant_id, client_phone))
+        return [json.loads(item) for item in entry[2]] if entry else []
+
+    def append(self, tenant_id, client_phone, messages, read=False):
+        key = self.key(tenant_id, client_phone)
+        encoded = tuple(self.encode(message) for message in messages)
+        with self.lock:
+            entry = self.lookup(key)
+            items = ((entry[2] if entry else ()) + encoded)[-self.max_length:]
+            self.put(key, items)
+        if read:
+            return [json.loads(item) for item in items]
+        return True
+
+    def save(self, tenant_id, client_phone, conversation):
+        items = tuple(self.encode(message) for message in conversation[-self.max_length:])
+        with self.lock:
+            self.put(self.key(tenant_id, client_phone), items)
+        return True
+
+    async def aget(self, tenant_id, client_phone):
+        return self.get(tenant_id, client_phone)
+
+    async def aappend(self, tenant_id, client_phone, messages):
+        return self.append(tenant_id, client_phone, messages)
+
+    def stats(self):
+        with self.lock:
+            return {"backend": self.name, "conversations": len(self.data), "bytes": self.size, **self.counts}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_store(backend=CONVERSATION_STORE):
+    if backend == 'memory':
+        return MemoryConversationStore()
+    if backend == 'redis':
+        return RedisConversationStore()
+
+    try:
+        redis_client.ping()
+        return RedisConversationStore()
+    except redis.RedisError as e:
+        logger.warning("Redis unreachable, keeping conversations in process memory", extra={"error": str(e)})
+        return MemoryConversationStore()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+    return _store
+
+
+def set_store(store):
+    """Plug in another backend: any object with the get/append/save/aget/aappend/stats methods above"""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def get_conversation(tenant_id, client_phone):
+    return get_store().get(tenant_id, client_phone)
+
+
+def append_conversation(tenant_id, client_phone, *messages, read=False):
+    """
+    Returns:
+        list or bool: The stored history when read is set, otherwise whether the write succeeded
+    """
+    return get_store().append(tenant_id, client_phone, messages, read=read)
+
+
+def save_conversation(tenant_id, client_phone, conversation):
+    """Replace the whole history"""
+    return get_store().save(tenant_id, client_phone, conversation)
+
+
+async def aget_conversation(tenant_id, client_phone):
+    return await get_store().aget(tenant_id, client_phone)
+
+
+async def aappend_conversation(tenant_id, client_phone, *messages):
+    return await get_store().aappend(tenant_id, client_phone, messages)
+
+
+def conversation_store_stats():
+    return get_store().stats()
@@ -0,0 +1,102 @@
+import hashlib
+import string
+import threading
+
+import numpy as np
+
+from .redis_client import binary_redis_client
+from .redis_config import EMBEDDING_CACHE_KEY_PREFIX, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_LOCAL_SIZE
+from .log_config import logger
+from .lru import LRUCache
+
+
+_local = LRUCache(EMBEDDING_CACHE_LOCAL_SIZE)
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """Case-fold, collapse whitespace and trim surrounding punctuation so trivial variants share an entry"""
+    return " ".join(text.casefold().split()).strip(string.punctuation + " ")
+
+
+def cache_key(kind, model, text):
+    digest = hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+    return f"{EMBEDDING_CACHE_KEY_PREFIX}:{kind}:{digest}"
+
+
+def pack_vector(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def unpack_vector(raw):
+    return np.frombuffer(raw, dtype=np.float32).tolist()
+
+
+def _count(kind, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(kind, {"local_hits": 0, "redis_hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+
+def lookup(kind, model, text, decode):
+    """
+    Look the value up in the local LRU, then in Redis. Returns None on a miss.
+    Both tiers hold the encoded bytes, so a cached embedding costs 6 KB rather than a list of Python floats.
+    """
+    key = cache_key(kind, model, text)
+
+    raw = _local.get(key)
+    if raw is not None:
+        _count(kind, "local_hits")
+        return decode(raw)
+
+    try:
+        raw = binary_redis_client.get(key)
+    except Exception as e:
+        logger.warning("Embedding cache read failed", extra={"error": str(e)})
+        raw = None
+
+    if raw is None:
+        _count(kind, "misses")
+        return None
+
+    _local.set(key, raw)
+    _count(kind, "redis_hits")
+    return decode(raw)
+
+
+def store(kind, model, text, value, encode):
+    key = cache_key(kind, model, text)
+    raw = encode(value)
+    _local.set(key, raw)
+    try:
+        binary_redis_client.set(key, raw, ex=EMBEDDING_CACHE_TTL)
+    except Exception as e:
+        logger.warning("Embedding cache write failed", extra={"error": str(e)})
+
+
+def get_embedding(model, text):
+    return lookup("embedding", model, text, unpack_vector)
+
+
+def set_embedding(model, text, vector):
+    store("embedding", model, text, vector, pack_vector)
+
+
+def get_intent(model, text):
+    return lookup("intent", model, text, lambda raw: raw.decode("utf-8"))
+
+
+def set_intent(model, text, intent):
+    store("intent", model, text, intent, lambda value: value.encode("utf-8"))
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = {kind: dict(counters) for kind, counters in _stats.items()}
+    for counters in stats.values():
+        total = counters["local_hits"] + counters["redis_hits"] + counters["misses"]
+        counters["hit_rate"] = round((total - counters["misses"]) / total, 4) if total else None
+    return stats
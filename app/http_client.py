@@ -0,0 +1,155 @@
+import asyncio
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (OPENAI_API_KEY, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+                    HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES, HTTP_BACKOFF_FACTOR,
+                    HTTP_BACKOFF_JITTER, HTTP2_ENABLED)
+from .log_config import logger
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Services whose POST requests are safe to replay after a 5xx (OpenAI requests have no side effects)
+RETRY_ALL_METHODS = {'openai'}
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_openai_client = None
+_async_client = None
+_clients_lock = threading.Lock()
+
+
+class ThrottleRetry(Retry):
+    """Retry that also replays non-idempotent requests when the server answered 429, since it did not process them."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def build_retry(service):
+    return ThrottleRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None if service in RETRY_ALL_METHODS else Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def get_session(service='default'):
+    """
+    Return the shared keep-alive session for a service ('openai', 'graph', 'telegram', ...).
+    Each session keeps one connection pool per host and is safe to share between threads.
+    """
+    session = _sessions.get(service)
+    if session:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(service)
+        if not session:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=build_retry(service))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[service] = session
+    return session
+
+
+def request(method, url, service='default', timeout=None, **kwargs):
+    return get_session(service).request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+
+def get(url, service='default', **kwargs):
+    return request("GET", url, service=service, **kwargs)
+
+
+def post(url, service='default', **kwargs):
+    return request("POST", url, service=service, **kwargs)
+
+
+def get_openai_client():
+    """Process-wide OpenAI SDK client, so its connection pool is reused across calls"""
+    global _openai_client
+    if _openai_client is None:
+        from openai import OpenAI
+
+        with _clients_lock:
+            if _openai_client is None:
+                _openai_client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    timeout=HTTP_READ_TIMEOUT,
+                    max_retries=HTTP_MAX_RETRIES,
+                )
+    return _openai_client
+
+
+def get_async_client():
+    """
+    Shared httpx.AsyncClient for async callers, HTTP/2 when HTTP2_ENABLED and the h2 package is installed.
+    Must be used from a single event loop.
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx
+
+        http2 = HTTP2_ENABLED
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 package not installed, async HTTP client falls back to HTTP/1.1")
+                http2 = False
+
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            transport=httpx.AsyncHTTPTransport(
+                http2=http2,
+                retries=HTTP_MAX_RETRIES,
+                limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE * 4, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+            ),
+        )
+    return _async_client
+
+
+async def arequest(method, url, service='default', **kwargs):
+    """Async counterpart of request(), with the same jittered backoff on 429/5xx"""
+    client = get_async_client()
+    retry_all = service in RETRY_ALL_METHODS or method.upper() in Retry.DEFAULT_ALLOWED_METHODS
+
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = await client.request(method, url, **kwargs)
+        retryable = response.status_code == 429 or (retry_all and response.status_code in RETRY_STATUSES)
+        if not retryable or attempt == HTTP_MAX_RETRIES:
+            return response
+
+        retry_after = response.headers.get("Retry-After")
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else HTTP_BACKOFF_FACTOR * (2 ** attempt)
+        await asyncio.sleep(delay + random.uniform(0, HTTP_BACKOFF_JITTER))
+    return response
+
+
+
+async def aclose_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
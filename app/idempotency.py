@@ -0,0 +1,78 @@
+import threading
+
+from .redis_client import redis_client, get_async_redis
+from .redis_config import get_message_key, MESSAGE_DEDUP_TTL
+from .log_config import logger
+
+
+_stats = {"claimed": 0, "suppressed": 0, "released": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def claim_message(message_id):
+    """
+    Mark the WhatsApp message id as being handled with a single SET NX.
+
+    Returns:
+        bool: False when the id was already claimed, i.e. the delivery is a retry
+    """
+    try:
+        claimed = redis_client.set(get_message_key(message_id), 1, nx=True, ex=MESSAGE_DEDUP_TTL)
+    except Exception as e:
+        # Better to risk a duplicate reply than to drop the message
+        logger.error("Message deduplication unavailable", extra={"error": str(e)})
+        _count("errors")
+        return True
+
+    if not claimed:
+        _count("suppressed")
+        logger.info("Duplicate webhook delivery suppressed", extra={"message_id": message_id})
+        return False
+
+    _count("claimed")
+    return True
+
+
+def release_message(message_id):
+    """Forget a claim after a failure, so Meta's next retry is processed"""
+    try:
+        redis_client.delete(get_message_key(message_id))
+        _count("released")
+    except Exception as e:
+        logger.warning("Error releasing message claim", extra={"error": str(e), "message_id": message_id})
+
+
+
+async def aclaim_message(message_id):
+    """Async claim_message()"""
+    try:
+        claimed = await get_async_redis().set(get_message_key(message_id), 1, nx=True, ex=MESSAGE_DEDUP_TTL)
+    except Exception as e:
+        logger.error("Message deduplication unavailable", extra={"error": str(e)})
+        _count("errors")
+        return True
+
+    if not claimed:
+        _count("suppressed")
+        logger.info("Duplicate webhook delivery suppressed", extra={"message_id": message_id})
+        return False
+
+    _count("claimed")
+    return True
+
+
+async def arelease_message(message_id):
+    try:
+        await get_async_redis().delete(get_message_key(message_id))
+        _count("released")
+    except Exception as e:
+        logger.warning("Error releasing message claim", extra={"error": str(e), "message_id": message_id})
+
+def idempotency_stats():
+    with _stats_lock:
+        return dict(_stats)
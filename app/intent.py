@@ -0,0 +1,144 @@
+import threading
+import time
+
+import numpy as np
+
+from config import INTENT_CENTROID_TTL, INTENT_MIN_MARGIN
+from .log_config import logger
+from .catalog_events import on_catalog_change, ensure_listener
+
+
+INTENT_LABELS = ('service', 'product', 'general')
+
+_centroids = {}
+_centroids_lock = threading.Lock()
+
+# compared/agreed: shadow samples of confident local decisions, the routing actually used.
+# fallback_compared/fallback_agreed: unconfident local labels the LLM overrode
+_stats = {"local": 0, "fallback": 0, "compared": 0, "agreed": 0, "fallback_compared": 0, "fallback_agreed": 0}
+_stats_lock = threading.Lock()
+
+
+def load_centroids(tenant_id):
+    """
+    Build one unit-length centroid per intent from the tenant's catalog embeddings:
+    services -> 'service', products -> 'product', tenant info -> 'general'.
+
+    Returns:
+        tuple: (labels, matrix) with one matrix row per label that has embeddings
+    """
+    from models import Service, Product, TenantInfo
+    from app import db
+
+    sources = (
+        ('service', Service),
+        ('product', Product),
+        ('general', TenantInfo),
+    )
+
+    labels = []
+    rows = []
+    for label, model in sources:
+        embeddings = [
+            e for (e,) in db.session.query(model.embedding)
+            .filter(model.tenant_id == tenant_id, model.embedding.isnot(None))
+            .all()
+        ]
+        if not embeddings:
+            continue
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        centroid = vectors.mean(axis=0)
+        rows.append(centroid / np.linalg.norm(centroid))
+        labels.append(label)
+
+    matrix = np.vstack(rows) if rows else np.empty((0, 0), dtype=np.float32)
+    return tuple(labels), matrix
+
+
+def get_centroids(tenant_id):
+    ensure_listener()
+    now = time.time()
+    cached = _centroids.get(tenant_id)
+    if cached and cached[0] > now:
+        return cached[1], cached[2]
+
+    labels, matrix = load_centroids(tenant_id)
+    with _centroids_lock:
+        _centroids[tenant_id] = (now + INTENT_CENTROID_TTL, labels, matrix)
+    return labels, matrix
+
+
+@on_catalog_change
+def invalidate_centroids(tenant_id=None):
+    with _centroids_lock:
+        if tenant_id is None:
+            _centroids.clear()
+        else:
+            _centroids.pop(tenant_id, None)
+
+
+def classify_local(embedding, tenant_id):
+    """
+    Score the message embedding against the tenant's intent centroids.
+
+    Returns:
+        tuple: (label, margin) where margin is the cosine gap between the best and the
+               runner-up intent, or (None, 0.0) when the tenant has fewer than two intents
+               with embeddings. A single centroid has no runner-up to measure a margin
+               against, so such tenants always go to the LLM and are left out of the
+               agreement counts.
+    """
+    labels, matrix = get_centroids(tenant_id)
+    if len(labels) < 2:
+        return None, 0.0
+
+    query = np.asarray(embedding, dtype=np.float32)
+    scores = matrix @ (query / np.linalg.norm(query))
+
+    order = np.argsort(scores)[::-1]
+    margin = float(scores[order[0]] - scores[order[1]])
+    return labels[order[0]], margin
+
+
+def is_confident(margin):
+    return margin >= INTENT_MIN_MARGIN
+
+
+def record_decision(fallback):
+    with _stats_lock:
+        _stats["fallback" if fallback else "local"] += 1
+
+
+def record_agreement(local_label, llm_label, fallback=False):
+    """
+    Compare a local label with the LLM label for the same message. Only shadow samples of
+    confident decisions measure the routing quality; fallback comparisons are counted apart.
+    """
+    if not local_label or not llm_label:
+        return
+
+    prefix = "fallback_" if fallback else ""
+    agreed = local_label == llm_label.strip().strip("'\"").lower()
+    with _stats_lock:
+        _stats[prefix + "compared"] += 1
+        if agreed:
+            _stats[prefix + "agreed"] += 1
+        compared = _stats[prefix + "compared"]
+
+    if not agreed and not fallback:
+        logger.info("Local intent disagrees with LLM", extra={"local": local_label, "llm": llm_label})
+    if compared % 100 == 0:
+        logger.info("Intent classifier agreement", extra=intent_stats())
+
+
+def intent_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    decided = stats["local"] + stats["fallback"]
+    stats["local_ratio"] = round(stats["local"] / decided, 4) if decided else None
+    stats["agreement"] = round(stats["agreed"] / stats["compared"], 4) if stats["compared"] else None
+    stats["fallback_agreement"] = (round(stats["fallback_agreed"] / stats["fallback_compared"], 4)
+                                   if stats["fallback_compared"] else None)
+    return stats
@@ -0,0 +1,133 @@
+import json
+import socket
+import time
+import uuid
+
+from .redis_client import redis_client, get_async_redis
+from .redis_config import (JOB_QUEUE_KEY, JOB_DELAYED_KEY, JOB_DEAD_LETTER_KEY, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF,
+                           get_processing_key)
+from .utils import group_conversations
+from .log_config import logger
+
+
+# Move the jobs due by ARGV[1] from the delayed set (KEYS[1]) to the queue (KEYS[2]), at most
+# ARGV[2] of them, so that concurrent workers never promote the same job twice
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+    redis.call('LPUSH', KEYS[2], unpack(due))
+end
+return #due
+"""
+
+_promote = redis_client.register_script(PROMOTE_SCRIPT)
+
+
+def enqueue_events(events):
+    """
+    Push one job per conversation of the delivery on the Redis job queue, in a single round-trip.
+    A job carries all the conversation's events so the worker answers them as one turn.
+
+    Returns:
+        list: The job ids, or None if the queue is unreachable
+    """
+    jobs = build_jobs(events)
+    try:
+        redis_client.lpush(JOB_QUEUE_KEY, *(json.dumps(job) for job in jobs))
+        logger.info("Jobs enqueued", extra={"job_ids": [job["id"] for job in jobs]})
+        return [job["id"] for job in jobs]
+    except Exception as e:
+        logger.error("Error enqueuing jobs", extra={"error": str(e), "count": len(jobs)})
+        return None
+
+
+async def aenqueue_events(events):
+    """Async enqueue_events()"""
+    jobs = build_jobs(events)
+    try:
+        await get_async_redis().lpush(JOB_QUEUE_KEY, *(json.dumps(job) for job in jobs))
+        logger.info("Jobs enqueued", extra={"job_ids": [job["id"] for job in jobs]})
+        return [job["id"] for job in jobs]
+    except Exception as e:
+        logger.error("Error enqueuing jobs", extra={"error": str(e), "count": len(jobs)})
+        return None
+
+
+def build_jobs(events):
+    now = time.time()
+    return [
+        {
+            "id": uuid.uuid4().hex,
+            "enqueued_at": now,
+            "attempts": 0,
+            "events": [event._asdict() for event in group],
+        }
+        for group in group_conversations(events).values()
+    ]
+
+
+def default_worker_name():
+    return socket.gethostname()
+
+
+def recover_jobs(worker_name):
+    """
+    Move jobs left in this worker's processing list (e.g. after a crash) back on the queue.
+    Only call this before the worker threads start.
+    """
+    processing_key = get_processing_key(worker_name)
+    recovered = 0
+    while redis_client.lmove(processing_key, JOB_QUEUE_KEY, "RIGHT", "RIGHT"):
+        recovered += 1
+
+    if recovered:
+        logger.warning("Recovered unfinished jobs", extra={"worker": worker_name, "count": recovered})
+    return recovered
+
+
+def dequeue_job(worker_name, timeout=5):
+    """
+    Block until a job is available and atomically move it to the worker's processing list.
+
+    Returns:
+        tuple: (raw, job) where raw must be passed back to ack_job, or (None, None) on timeout
+    """
+    raw = redis_client.blmove(JOB_QUEUE_KEY, get_processing_key(worker_name), timeout, "RIGHT", "LEFT")
+    if not raw:
+        return None, None
+    return raw, json.loads(raw)
+
+
+def ack_job(worker_name, raw):
+    redis_client.lrem(get_processing_key(worker_name), 1, raw)
+
+
+def retry_job(worker_name, raw, job, error):
+    """
+    Schedule a failed job for another attempt after an exponential backoff, or park it on the
+    dead letter list once it ran out of attempts.
+    """
+    job["attempts"] = job.get("attempts", 0) + 1
+    job["last_error"] = error
+
+    pipe = redis_client.pipeline()
+    pipe.lrem(get_processing_key(worker_name), 1, raw)
+    if job["attempts"] >= JOB_MAX_ATTEMPTS:
+        pipe.lpush(JOB_DEAD_LETTER_KEY, json.dumps(job))
+        logger.error("Job moved to dead letter queue", extra={"job_id": job.get("id"), "attempts": job["attempts"], "error": error})
+    else:
+        delay = JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+        pipe.zadd(JOB_DELAYED_KEY, {json.dumps(job): time.time() + delay})
+        logger.warning("Job scheduled for retry", extra={"job_id": job.get("id"), "attempts": job["attempts"], "delay": delay, "error": error})
+    pipe.execute()
+
+
+def promote_due_jobs(batch_size=100):
+    """Move the delayed jobs whose next attempt is due back on the queue; returns how many moved"""
+    promoted = 0
+    while True:
+        moved = _promote(keys=[JOB_DELAYED_KEY, JOB_QUEUE_KEY], args=[time.time(), batch_size])
+        promoted += moved
+        if moved < batch_size:
+            return promoted
@@ -0,0 +1,20 @@
+"""
+Functions run inside the local transcription process pool. Kept free of app imports
+so spawned workers only load faster-whisper.
+"""
+from io import BytesIO
+
+
+_model = None
+
+
+def load_model(model_name, compute_type, cpu_threads):
+    global _model
+    from faster_whisper import WhisperModel
+
+    _model = WhisperModel(model_name, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+
+
+def transcribe(data):
+    segments, info = _model.transcribe(BytesIO(data), beam_size=1, vad_filter=True)
+    return "".join(segment.text for segment in segments).strip(), info.duration
@@ -1,11 +1,48 @@
 import os
+import threading
 
-from logtail import LogtailHandler
 import logging
 
 env = os.getenv("ENV", "dev")
 
-handler = LogtailHandler(
+
+class LazyLogtailHandler(logging.Handler):
+    """
+    Builds the Logtail handler, and its flush thread, on the first record logged by each process,
+    so importing the app (or preloading it in a gunicorn master) opens no connection and
+    forked workers do not inherit a dead flush thread.
+    """
+
+    def __init__(self, **options):
+        super().__init__()
+        self.options = options
+        self.handler = None
+        self.pid = None
+        self.create_lock = threading.Lock()
+
+    def get_handler(self):
+        if self.pid != os.getpid():
+            with self.create_lock:
+                if self.pid != os.getpid():
+                    from logtail import LogtailHandler
+
+                    self.handler = LogtailHandler(**self.options)
+                    self.handler.setLevel(self.level)
+                    self.pid = os.getpid()
+        return self.handler
+
+    def emit(self, record):
+        try:
+            self.get_handler().handle(record)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.handler is not None and self.pid == os.getpid():
+            self.handler.flush()
+
+
+handler = LazyLogtailHandler(
     source_token=os.getenv("LOGTAIL_SOURCE_TOKEN", "default_source_token"),
     host=os.getenv("LOGTAIL_HOST", "logtail.logtail.com"),
 )
@@ -17,4 +54,4 @@ if env == "prod":
 else:
     logger.setLevel(logging.INFO)
 
-logger.addHandler(handler)
\ No newline at end of file
+logger.addHandler(handler)
@@ -0,0 +1,39 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Small thread-safe in-process LRU"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.data.pop(key, None)
+
+    def remove_if(self, predicate):
+        """Drop every entry for which predicate(key, value) is true"""
+        with self.lock:
+            for key in [key for key, value in self.data.items() if predicate(key, value)]:
+                del self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (OPENAI_API_KEY, PROMPT_TOKEN_BUDGET, PROMPT_SUMMARY_MODEL,
+                    PROMPT_SUMMARY_MIN_MESSAGES, PROMPT_SUMMARY_MAX_TOKENS)
+from .redis_client import redis_client
+from .redis_config import get_summary_key, CONVERSATION_EXPIRY, SUMMARY_LOCK_TTL
+from .log_config import logger
+from . import http_client
+
+
+SYSTEM_PROMPT = "You are an expert marketing consultant representing this business. Your goals are to:\n1. Identify client needs and match them to our products/services\n2. Overcome objections professionally (e.g., if price concerns arise, suggest more affordable alternatives)\n3. Actively sell and recommend our offerings based on client interests\n4. IMPORTANT: Do **not** request the client's personal information (name, email, the offer they like) until they show clear interest in a specific product or service\n5. CRITICAL: Once interest is shown, collect the client's full name, email address and the offer they want\n6. Then identify and confirm which specific pack/service the client wants to purchase\n7. Create detailed lead information including: client name, email, and selected pack/service\n8. Answer only business-related questions and politely redirect other inquiries by saying: 'That's outside my area. I can help you with our services instead.'\n9. Communicate in the same language as the client (French, Arabic, English, or Moroccan Darija)\n10. Analyze sentiment to provide personalized responses\n11. If the conversation stalls or gets off-topic, ask relevant questions to bring focus back\n12. NEVER answer questions unrelated to our business (e.g., AI, politics, programming, personal advice). Politely decline and refocus on business.\n\nMake responses concise, professional and sales-focused. Always guide the conversation toward understanding client needs first, and only collect personal info after they express interest in a product or service."
+
+CONTEXT_MARKER = "\n\nContext information (not visible to user):"
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a sales conversation between a client and a business assistant. "
+    "Update the summary with the new messages. Keep the client's name, email, needs, the products, "
+    "services and prices discussed, objections and anything agreed. Reply with the summary only, "
+    "in at most a few short sentences."
+)
+
+# tokens added by the chat format around every message
+MESSAGE_OVERHEAD = 4
+
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prompt-summary")
+
+# seconds before retrying a tiktoken load that failed (its BPE file is downloaded on first use)
+ENCODING_RETRY_INTERVAL = 60
+
+_encoding = None
+_encoding_retry_at = 0.0
+
+
+def get_encoding():
+    """tiktoken encoding for the chat model, or None while it cannot be loaded"""
+    global _encoding, _encoding_retry_at
+    if _encoding is None and time.time() >= _encoding_retry_at:
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        except Exception as e:
+            _encoding_retry_at = time.time() + ENCODING_RETRY_INTERVAL
+            logger.warning("tiktoken unavailable, estimating tokens from UTF-8 length", extra={"error": str(e)})
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        # Arabic script is two UTF-8 bytes per letter and tokenizes far denser than English, so
+        # counting bytes keeps the estimate from undershooting the budget (it overshoots for Latin text)
+        return len(text.encode("utf-8")) // 3 + 1
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(message):
+    return MESSAGE_OVERHEAD + count_tokens(message.get("content") or "")
+
+
+def raw_message(message):
+    """Stored message without a retrieval block (histories written before context was kept out of them)"""
+    content = message.get("content") or ""
+    if message.get("role") != "user" or CONTEXT_MARKER not in content:
+        return message
+    question = content.split(CONTEXT_MARKER, 1)[0]
+    if question.startswith("User question: "):
+        question = question[len("User question: "):]
+    return {"role": "user", "content": question}
+
+
+def with_context(message, context_info):
+    if not context_info:
+        return message
+    return {"role": message["role"], "content": f"User question: {message['content']}{CONTEXT_MARKER}{context_info}"}
+
+
+def message_hash(message):
+    return hashlib.sha1(f"{message.get('role')}:{message.get('content')}".encode()).hexdigest()
+
+
+def get_summary(tenant_id, client_phone):
+    """
+    Returns:
+        dict or None: {"text", "last"} where last is the hash of the newest message folded into the summary
+    """
+    try:
+        data = redis_client.get(get_summary_key(tenant_id, client_phone))
+        return json.loads(data) if data else None
+    except Exception as e:
+        logger.error("Error reading conversation summary", extra={"error": str(e)})
+        return None
+
+
+def uncovered_messages(history, kept_from, summary):
+    """Messages left out of the prompt that the summary does not cover yet"""
+    if summary:
+        last = summary.get("last")
+        for i in range(len(history) - 1, -1, -1):
+            if message_hash(history[i]) == last:
+                return history[i + 1:kept_from]
+    return history[:kept_from]
+
+
+def build_messages(conversation, summary=None, context_info=None, budget=None):
+    """
+    Fit the conversation into the token budget: system prompt, rolling summary, as many
+    recent turns as fit, and the current (last) message with this turn's retrieval context.
+
+    Returns:
+        tuple: (messages, uncovered) where uncovered are the left-out messages still to be summarized
+    """
+    if budget is None:
+        budget = PROMPT_TOKEN_BUDGET
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if summary and summary.get("text"):
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary['text']}"})
+
+    history = [raw_message(message) for message in conversation]
+    if not history:
+        return messages, []
+
+    current = with_context(history[-1], context_info)
+    used = sum(count_message_tokens(message) for message in messages) + count_message_tokens(current)
+
+    kept_from = len(history) - 1
+    while kept_from > 0:
+        tokens = count_message_tokens(history[kept_from - 1])
+        if used + tokens > budget:
+            break
+        used += tokens
+        kept_from -= 1
+
+    messages.extend(history[kept_from:-1])
+    messages.append(current)
+
+    logger.debug("Prompt assembled", extra={
+        "prompt_tokens": used,
+        "history_kept": len(history) - kept_from,
+        "history_total": len(history)
+    })
+    return messages, uncovered_messages(history, kept_from, summary)
+
+
+def summarize(tenant_id, client_phone, summary, messages):
+    """Fold messages into the stored summary. Runs in the background, one per conversation at a time."""
+    from .rate_limit import acquire, estimate_tokens
+
+    key = get_summary_key(tenant_id, client_phone)
+    lock_key = f"{key}:lock"
+    if not redis_client.set(lock_key, 1, nx=True, ex=SUMMARY_LOCK_TTL):
+        return
+
+    try:
+        start_time = time.time()
+        transcript = "\n".join(
+            f"{'Client' if message['role'] == 'user' else 'Assistant'}: {message['content']}"
+            for message in messages
+        )
+        previous = summary.get("text") if summary else None
+
+        payload = {
+            "model": PROMPT_SUMMARY_MODEL,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Current summary: {previous or '(none)'}\n\nNew messages:\n{transcript}"}
+            ],
+            "max_tokens": PROMPT_SUMMARY_MAX_TOKENS,
+            "temperature": 0
+        }
+        if not acquire(tenant_id, estimate_tokens(payload["messages"], PROMPT_SUMMARY_MAX_TOKENS), optional=True):
+            return
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {OPENAI_API_KEY}"
+        }
+        response = http_client.post("https://api.openai.com/v1/chat/completions", service='openai', headers=headers, json=payload)
+        response.raise_for_status()
+        text = response.json()['choices'][0]['message']['content'].strip()
+
+        redis_client.set(key, json.dumps({"text": text, "last": message_hash(messages[-1])}), ex=CONVERSATION_EXPIRY)
+        logger.debug("Conversation summary updated", extra={
+            "messages": len(messages),
+            "duration_ms": round((time.time() - start_time) * 1000)
+        })
+    except Exception as e:
+        logger.error("Conversation summary failed", extra={"error_type": type(e).__name__, "error": str(e)})
+    finally:
+        redis_client.delete(lock_key)
+
+
+def schedule_summary(tenant_id, client_phone, summary, uncovered):
+    """Summarize left-out messages once enough of them have piled up"""
+    if len(uncovered) >= PROMPT_SUMMARY_MIN_MESSAGES:
+        summary_executor.submit(summarize, tenant_id, client_phone, summary, uncovered)
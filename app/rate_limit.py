@@ -0,0 +1,233 @@
+import asyncio
+import threading
+import time
+
+from config import (RATE_LIMIT_GLOBAL_RPM, RATE_LIMIT_GLOBAL_TPM, RATE_LIMIT_TENANT_RPM, RATE_LIMIT_TENANT_TPM,
+                    RATE_LIMIT_MAX_WAIT, RATE_LIMIT_MAX_WAITERS, RATE_LIMIT_COMPLETION_TOKENS)
+from .redis_client import redis_client, get_async_redis
+from .redis_config import get_rate_limit_key
+from .prompt import count_tokens, count_message_tokens
+from .log_config import logger
+
+
+# Token buckets refilled continuously from the server clock. Either every bucket has room
+# for its cost and all are charged, or nothing is charged and the script returns how long
+# to wait for the scarcest bucket. KEYS: buckets; ARGV: capacity, rate per second, cost per bucket.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local cost = math.min(tonumber(ARGV[i * 3]), capacity)
+    local bucket = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    levels[i] = level
+    if level < cost then
+        wait = math.max(wait, (cost - level) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local cost = math.min(tonumber(ARGV[i * 3]), capacity)
+    redis.call('HSET', key, 'level', tostring(levels[i] - cost), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / tonumber(ARGV[i * 3 - 1])) + 1)
+end
+return '0'
+"""
+
+# Returned by the reply completions instead of None when the quota denied the call
+RATE_LIMITED = {"rate_limited": True}
+
+_script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+_async_script = None
+
+_waiters = 0
+_waiters_lock = threading.Lock()
+
+_stats = {"allowed": 0, "waited": 0, "denied": 0, "skipped": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Prompt tokens counted locally plus the completion tokens the call may produce"""
+    return sum(count_message_tokens(message) for message in messages) + (max_tokens or RATE_LIMIT_COMPLETION_TOKENS)
+
+
+def estimate_text_tokens(text):
+    return count_tokens(text)
+
+
+def buckets(tenant_id, tokens):
+    """(key, capacity, rate per second, cost) for every enabled bucket; capacities are one minute of quota"""
+    limits = [('global', 'requests', RATE_LIMIT_GLOBAL_RPM, 1), ('global', 'tokens', RATE_LIMIT_GLOBAL_TPM, tokens)]
+    if tenant_id is not None:
+        limits += [(tenant_id, 'requests', RATE_LIMIT_TENANT_RPM, 1), (tenant_id, 'tokens', RATE_LIMIT_TENANT_TPM, tokens)]
+    return [
+        (get_rate_limit_key(scope, kind), per_minute, per_minute / 60.0, cost)
+        for scope, kind, per_minute, cost in limits if per_minute > 0
+    ]
+
+
+def try_acquire(tenant_id, tokens):
+    """
+    Returns:
+        float: 0 when the call may proceed, otherwise the seconds to wait before retrying
+    """
+    selected = buckets(tenant_id, tokens)
+    if not selected:
+        return 0.0
+    return float(_script(keys=[key for key, *_ in selected], args=script_args(selected)))
+
+
+async def atry_acquire(tenant_id, tokens):
+    global _async_script
+    selected = buckets(tenant_id, tokens)
+    if not selected:
+        return 0.0
+    if _async_script is None:
+        _async_script = get_async_redis().register_script(TOKEN_BUCKET_SCRIPT)
+    return float(await _async_script(keys=[key for key, *_ in selected], args=script_args(selected)))
+
+
+def script_args(selected):
+    args = []
+    for _, capacity, rate, cost in selected:
+        args += [capacity, rate, cost]
+    return args
+
+
+def acquire(tenant_id, tokens, optional=False, max_wait=RATE_LIMIT_MAX_WAIT):
+    """
+    Reserve one request and the estimated tokens against the global and tenant quotas.
+    Optional calls never wait. Fails open when Redis is unavailable.
+
+    Returns:
+        bool: Whether the call may be made
+    """
+    global _waiters
+
+    try:
+        wait = try_acquire(tenant_id, tokens)
+    except Exception as e:
+        logger.error("Rate limiter unavailable, allowing call", extra={"error": str(e)})
+        record("errors")
+        return True
+
+    if not wait:
+        record("allowed")
+        return True
+
+    if optional:
+        record("skipped")
+        logger.info("Optional OpenAI call skipped, over quota", extra={"tenant": tenant_id, "tokens": tokens})
+        return False
+
+    with _waiters_lock:
+        if _waiters >= RATE_LIMIT_MAX_WAITERS:
+            queue_full = True
+        else:
+            queue_full = False
+            _waiters += 1
+
+    if queue_full:
+        record("denied")
+        logger.warning("OpenAI call denied, rate limit wait queue full", extra={"tenant": tenant_id})
+        return False
+
+    deadline = time.time() + max_wait
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if wait > remaining:
+                record("denied")
+                logger.warning("OpenAI call denied, over quota", extra={"tenant": tenant_id, "tokens": tokens, "wait": round(wait, 3)})
+                return False
+
+            time.sleep(wait)
+            try:
+                wait = try_acquire(tenant_id, tokens)
+            except Exception as e:
+                logger.error("Rate limiter unavailable, allowing call", extra={"error": str(e)})
+                record("errors")
+                return True
+
+            if not wait:
+                record("waited")
+                return True
+    finally:
+        with _waiters_lock:
+            _waiters -= 1
+
+
+
+async def aacquire(tenant_id, tokens, optional=False, max_wait=RATE_LIMIT_MAX_WAIT):
+    """Async acquire(): waits with asyncio.sleep, sharing the waiter bound and stats"""
+    global _waiters
+
+    try:
+        wait = await atry_acquire(tenant_id, tokens)
+    except Exception as e:
+        logger.error("Rate limiter unavailable, allowing call", extra={"error": str(e)})
+        record("errors")
+        return True
+
+    if not wait:
+        record("allowed")
+        return True
+
+    if optional:
+        record("skipped")
+        return False
+
+    with _waiters_lock:
+        queue_full = _waiters >= RATE_LIMIT_MAX_WAITERS
+        if not queue_full:
+            _waiters += 1
+
+    if queue_full:
+        record("denied")
+        logger.warning("OpenAI call denied, rate limit wait queue full", extra={"tenant": tenant_id})
+        return False
+
+    deadline = time.time() + max_wait
+    try:
+        while True:
+            if wait > deadline - time.time():
+                record("denied")
+                logger.warning("OpenAI call denied, over quota", extra={"tenant": tenant_id, "tokens": tokens, "wait": round(wait, 3)})
+                return False
+
+            await asyncio.sleep(wait)
+            try:
+                wait = await atry_acquire(tenant_id, tokens)
+            except Exception as e:
+                logger.error("Rate limiter unavailable, allowing call", extra={"error": str(e)})
+                record("errors")
+                return True
+
+            if not wait:
+                record("waited")
+                return True
+    finally:
+        with _waiters_lock:
+            _waiters -= 1
+
+def record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def rate_limit_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    with _waiters_lock:
+        stats["waiting"] = _waiters
+    return stats
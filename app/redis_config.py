@@ -11,12 +11,111 @@ REDIS_SSL = os.getenv("REDIS_SSL", "false").lower() == "true"
 
 REDIS_KEY_PREFIX = os.getenv('REDIS_KEY_PREFIX', 'app')
 CONVERSATION_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:conversation"
+# Conversations are Redis lists of JSON messages; the unversioned keys hold legacy JSON strings
+CONVERSATION_LIST_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:conversation:v2"
 
 
 CONVERSATION_EXPIRY = int(os.getenv('CONVERSATION_EXPIRY', 86400))
 CONVERSATION_MAX_LENGTH = int(os.getenv('CONVERSATION_MAX_LENGTH', 50))
 
+# "redis", "memory" (per process) or "auto": Redis when reachable at startup, process memory otherwise
+CONVERSATION_STORE = os.getenv('CONVERSATION_STORE', 'auto')
+CONVERSATION_MEMORY_MAX_ENTRIES = int(os.getenv('CONVERSATION_MEMORY_MAX_ENTRIES', 10000))
+CONVERSATION_MEMORY_MAX_BYTES = int(os.getenv('CONVERSATION_MEMORY_MAX_BYTES', 64 * 1024 * 1024))
+
 
 def get_conversation_key(tenant_id, client_phone):
     clean_phone = client_phone.replace("+", "").replace(" ", "")
     return f"{CONVERSATION_KEY_PREFIX}:{tenant_id}:{clean_phone}"
+
+
+def get_conversation_list_key(tenant_id, client_phone):
+    clean_phone = client_phone.replace("+", "").replace(" ", "")
+    return f"{CONVERSATION_LIST_KEY_PREFIX}:{tenant_id}:{clean_phone}"
+
+
+JOB_QUEUE_KEY = f"{REDIS_KEY_PREFIX}:jobs"
+JOB_PROCESSING_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:jobs:processing"
+JOB_DEAD_LETTER_KEY = f"{REDIS_KEY_PREFIX}:jobs:dead"
+# Failed jobs wait in a sorted set scored by their next attempt time until a worker promotes them
+JOB_DELAYED_KEY = f"{REDIS_KEY_PREFIX}:jobs:delayed"
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# Seconds before the first retry, doubled on every further attempt
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', 5))
+
+
+def get_processing_key(worker_name):
+    return f"{JOB_PROCESSING_KEY_PREFIX}:{worker_name}"
+
+
+EMBEDDING_CACHE_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:embcache"
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 604800))
+EMBEDDING_CACHE_LOCAL_SIZE = int(os.getenv('EMBEDDING_CACHE_LOCAL_SIZE', 2048))
+
+
+REEMBED_KEY = f"{REDIS_KEY_PREFIX}:reembed"
+REEMBED_BATCH_SIZE = int(os.getenv('REEMBED_BATCH_SIZE', 256))
+REEMBED_POLL_INTERVAL = float(os.getenv('REEMBED_POLL_INTERVAL', 1))
+
+
+CATALOG_CHANNEL = f"{REDIS_KEY_PREFIX}:catalog:changed"
+
+
+TENANT_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:tenant"
+TENANT_CACHE_TTL = int(os.getenv('TENANT_CACHE_TTL', 3600))
+TENANT_LOCAL_TTL = int(os.getenv('TENANT_LOCAL_TTL', 60))
+TENANT_NEGATIVE_TTL = int(os.getenv('TENANT_NEGATIVE_TTL', 60))
+
+
+def get_tenant_key(display_phone_number):
+    return f"{TENANT_KEY_PREFIX}:{display_phone_number}"
+
+
+MESSAGE_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:msg"
+# Meta keeps redelivering unacknowledged webhooks for up to 7 days
+MESSAGE_DEDUP_TTL = int(os.getenv('MESSAGE_DEDUP_TTL', 604800))
+
+
+def get_message_key(message_id):
+    return f"{MESSAGE_KEY_PREFIX}:{message_id}"
+
+
+TURN_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:turn"
+
+
+def get_turn_key(tenant_id, client_phone):
+    clean_phone = client_phone.replace("+", "").replace(" ", "")
+    return f"{TURN_KEY_PREFIX}:{tenant_id}:{clean_phone}"
+
+
+SEMANTIC_CACHE_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:semcache"
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', 86400))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 500))
+
+
+def get_semantic_cache_key(tenant_id):
+    return f"{SEMANTIC_CACHE_KEY_PREFIX}:{tenant_id}"
+
+
+RATE_LIMIT_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:ratelimit"
+
+
+def get_rate_limit_key(scope, kind):
+    return f"{RATE_LIMIT_KEY_PREFIX}:{scope}:{kind}"
+
+
+SUMMARY_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:summary"
+SUMMARY_LOCK_TTL = int(os.getenv('SUMMARY_LOCK_TTL', 60))
+
+
+def get_summary_key(tenant_id, client_phone):
+    clean_phone = client_phone.replace("+", "").replace(" ", "")
+    return f"{SUMMARY_KEY_PREFIX}:{tenant_id}:{clean_phone}"
+
+
+CLIENT_KEY_PREFIX = f"{REDIS_KEY_PREFIX}:client"
+
+
+def get_client_key(tenant_id, client_phone):
+    clean_phone = client_phone.replace("+", "").replace(" ", "")
+    return f"{CLIENT_KEY_PREFIX}:{tenant_id}:{clean_phone}"
@@ -0,0 +1,167 @@
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam, event, update
+from sqlalchemy.orm import Session, defer, object_session
+
+from app import db
+from models import Service, Product, TenantInfo
+from .http_client import get_openai_client
+from .redis_client import redis_client
+from .redis_config import REEMBED_KEY, REEMBED_BATCH_SIZE, REEMBED_POLL_INTERVAL
+from .log_config import logger
+from .catalog_events import publish_catalog_change
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+EMBEDDED_MODELS = {
+    'service': Service,
+    'product': Product,
+    'tenant_info': TenantInfo,
+}
+
+_model_names = {model: name for name, model in EMBEDDED_MODELS.items()}
+
+_drain = None
+_drain_lock = threading.Lock()
+
+
+def embed_texts(texts, client=None):
+    """Embed many texts with a single embeddings request, keeping the input order"""
+    client = client or get_openai_client()
+    response = client.embeddings.create(input=texts, model=EMBEDDING_MODEL)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def write_embeddings(model, rows, embeddings):
+    """Bulk-update embedding and embedding_hash with one executemany, bypassing ORM events"""
+    table = model.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam('row_id'))
+        .values(embedding=bindparam('row_embedding'), embedding_hash=bindparam('row_hash'))
+    )
+    db.session.execute(statement, [
+        {'row_id': row.id, 'row_embedding': embedding, 'row_hash': row.content_hash()}
+        for row, embedding in zip(rows, embeddings)
+    ])
+
+
+def request_reembed(items):
+    """Queue (model name, id) pairs for re-embedding. The Redis set collapses repeated edits of a row."""
+    if not items:
+        return
+    try:
+        redis_client.sadd(REEMBED_KEY, *(f"{name}:{row_id}" for name, row_id in items))
+    except Exception as e:
+        logger.error("Error queuing rows for re-embedding", extra={"error": str(e), "count": len(items)})
+
+
+def reembed_pending(batch_size=REEMBED_BATCH_SIZE):
+    """
+    Re-embed up to batch_size queued rows whose source text changed since they were embedded.
+    Needs an app context.
+
+    Returns:
+        int: Number of rows re-embedded
+    """
+    members = redis_client.spop(REEMBED_KEY, batch_size)
+    if not members:
+        return 0
+
+    ids_by_model = defaultdict(set)
+    for member in members:
+        name, _, row_id = member.partition(':')
+        if name in EMBEDDED_MODELS and row_id.isdigit():
+            ids_by_model[name].add(int(row_id))
+
+    total = 0
+    for name, ids in ids_by_model.items():
+        model = EMBEDDED_MODELS[name]
+        rows = model.query.options(defer(model.embedding)).filter(model.id.in_(ids)).all()
+        stale = [row for row in rows if row.embedding_hash != row.content_hash()]
+        if not stale:
+            continue
+
+        try:
+            embeddings = embed_texts([row.embedding_text() for row in stale])
+            write_embeddings(model, stale, embeddings)
+            tenant_ids = {row.tenant_id for row in stale}
+            db.session.commit()
+            publish_catalog_change(tenant_ids)
+        except Exception as e:
+            db.session.rollback()
+            request_reembed([(name, row.id) for row in stale])
+            logger.error("Re-embedding failed, rows requeued", extra={"model": name, "count": len(stale), "error": str(e)})
+            continue
+
+        total += len(stale)
+        logger.info("Rows re-embedded", extra={"model": name, "count": len(stale)})
+
+    return total
+
+
+def drain(app, stop_event):
+    """Re-embed queued rows until stop_event is set, polling every REEMBED_POLL_INTERVAL when idle"""
+    while not stop_event.is_set():
+        try:
+            with app.app_context():
+                count = reembed_pending()
+        except Exception as e:
+            logger.error("Error re-embedding changed rows", extra={"error": str(e)})
+            count = 0
+
+        if not count:
+            stop_event.wait(REEMBED_POLL_INTERVAL)
+
+
+def ensure_drain(app):
+    """
+    Start the background re-embedding thread once per process. worker.py drains the queue in
+    queue mode; in inline mode the web processes do it (SPOP hands each row to one of them).
+    """
+    global _drain
+    if _drain is not None:
+        return
+
+    with _drain_lock:
+        if _drain is None:
+            _drain = threading.Thread(target=drain, args=(app, threading.Event()), name="reembed", daemon=True)
+            _drain.start()
+
+
+def _track_change(mapper, connection, target):
+    if target.embedding_hash == target.content_hash():
+        return
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('reembed', set()).add((_model_names[type(target)], target.id))
+
+
+def _track_delete(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('catalog_changed', set()).add(target.tenant_id)
+
+
+def _flush_tracked(session):
+    request_reembed(session.info.pop('reembed', None))
+    publish_catalog_change(session.info.pop('catalog_changed', ()))
+
+
+def _discard_tracked(session, previous_transaction):
+    session.info.pop('reembed', None)
+    session.info.pop('catalog_changed', None)
+
+
+def register_listeners():
+    """Queue rows whose embedded text changed, once the transaction that changed them commits"""
+    if event.contains(Session, 'after_commit', _flush_tracked):
+        return
+    for model in EMBEDDED_MODELS.values():
+        event.listen(model, 'after_insert', _track_change)
+        event.listen(model, 'after_update', _track_change)
+        event.listen(model, 'after_delete', _track_delete)
+    event.listen(Session, 'after_commit', _flush_tracked)
+    event.listen(Session, 'after_soft_rollback', _discard_tracked)
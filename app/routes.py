@@ -1,12 +1,24 @@
 import os
 
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, current_app
 from time import time
-from .whatapp import send_message
-from models import Client, Tenant
-from .ai import open_ai_gpt, classify_intent
-from .utils import extract_whatsapp_message, extract_client_phone, is_audio_message, extract_audio_data, download_whatsapp_media, transcribe_audio
+from .whatapp import send_message, mark_read
+from .ai import open_ai_gpt, open_ai_gpt_stream, open_ai_structured, prepare_request, prefetch_executor, stream_stats, save_reply
+from .utils import parse_webhook, group_conversations, download_whatsapp_media, transcribe_audio, transcription_stats
 from .log_config import logger
+from .intent import intent_stats
+from .tenant_directory import resolve_tenant
+from .client_identity import resolve_client_id
+from .embedding_cache import cache_stats
+from .rate_limit import rate_limit_stats, RATE_LIMITED
+from .semantic_cache import semantic_cache_stats
+from .job_queue import enqueue_events
+from .coalesce import conversation_turn
+from .idempotency import claim_message, release_message, idempotency_stats
+from .warmup import is_ready, warmup_stats
+from .conversation_store import conversation_store_stats
+from .reembed import ensure_drain
+from config import WEBHOOK_MODE, AI_PIPELINE_MODE, AI_STREAMING, COALESCE_WINDOW_MS, RATE_LIMIT_BUSY_MESSAGE
 
 
 main = Blueprint('main', __name__)
@@ -15,6 +27,8 @@ main = Blueprint('main', __name__)
 @main.before_request
 def start_timer():
     g.start = time()
+    if WEBHOOK_MODE != 'queue':
+        ensure_drain(current_app._get_current_object())
     logger.info(f"Request started", extra={"path": request.path, "method": request.method, "remote_addr": request.remote_addr})
 
 
@@ -30,37 +44,89 @@ def log_response(response):
     })
     return response
 
+def status_code(response):
+    if isinstance(response, tuple):
+        return response[1]
+    return getattr(response, 'status_code', 200)
+
+
 @main.route('/webhook', methods=['GET', 'POST'])
 def webhook():
     if request.method == 'GET':
         return handle_verification()
+    claimed = []
     try:
         data = request.get_json()
         if not data or 'entry' not in data or not data['entry']:
             logger.warning("Invalid data received", extra={"data": data})
             return jsonify({"status": "error", "message": "Invalid data"}), 400
 
-        entry = data['entry'][0]
-        if 'changes' not in entry or not entry['changes']:
-            logger.warning("No changes found in data", extra={"data": data})
+        events = parse_webhook(data)
+        messages = [event for event in events if event.kind != 'status']
+        if len(events) > len(messages):
+            logger.debug("Status updates received", extra={"count": len(events) - len(messages)})
+        if not messages:
             return jsonify({"status": "success"})
 
-        value = entry['changes'][0]['value']
-        if 'metadata' not in value or 'display_phone_number' not in value['metadata']:
-            logger.warning("Display phone number not found in data", extra={"data": data})
-            return jsonify({"status": "error", "message": "Display phone number not found"}), 400
-
-        display_phone_number = data['entry'][0]['changes'][0]['value']['metadata']['display_phone_number']
-
-        if 'contacts' not in value:
+        # Meta retries slow deliveries; acknowledge a retry without doing the work twice
+        fresh = []
+        for event in messages:
+            if not event.message_id:
+                fresh.append(event)
+            elif claim_message(event.message_id):
+                fresh.append(event)
+                claimed.append(event.message_id)
+        if not fresh:
             return jsonify({"status": "success"})
 
-        return process_whatsapp_message(data, display_phone_number)
+        if WEBHOOK_MODE == 'queue':
+            if enqueue_events(fresh):
+                return jsonify({"status": "success"})
+            logger.warning("Job queue unavailable, processing messages inline", extra={"count": len(fresh)})
+
+        results = process_conversations(fresh)
+        # Only the failed conversations are redone on Meta's retry; the others stay claimed
+        for group, response in results:
+            if status_code(response) >= 500:
+                for event in group:
+                    if event.message_id in claimed:
+                        release_message(event.message_id)
+        return merged_response(results)
     except Exception as e:
         logger.error("Error processing webhook", extra={"error": str(e), "data": request.get_json()})
+        for message_id in claimed:
+            release_message(message_id)
         return jsonify({"status": "error", "message": "Internal server error"}), 500
 
 
+@main.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify(metrics_snapshot())
+
+
+@main.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once this process has warmed its DB, Redis and HTTP pools"""
+    stats = warmup_stats()
+    if is_ready():
+        return jsonify({"status": "ready", **stats})
+    return jsonify({"status": "starting" if not stats["steps_ms"] else "degraded", **stats}), 503
+
+
+def metrics_snapshot():
+    return {
+        "warmup": warmup_stats(),
+        "intent": intent_stats(),
+        "cache": cache_stats(),
+        "transcription": transcription_stats(),
+        "streaming": stream_stats(),
+        "rate_limit": rate_limit_stats(),
+        "semantic_cache": semantic_cache_stats(),
+        "deduplication": idempotency_stats(),
+        "conversation_store": conversation_store_stats()
+    }
+
+
 def handle_verification():
     mode = request.args.get('hub.mode')
     token = request.args.get('hub.verify_token')
@@ -68,7 +134,7 @@ def handle_verification():
 
     logger.info("Verification request received", extra={"mode": mode, "token": bool(token), "challenge": bool(challenge)})
 
-    if mode == 'subscribe' and token == os.getenv("WHATSAPP_VERIFY_TOKEN", "default_verify_token"):
+    if verify_subscription(mode, token):
         logger.info("Webhook Verification successful")
         return challenge
     else:
@@ -79,95 +145,163 @@ def handle_verification():
         return jsonify({"status": "error", "message": "Verification failed"}), 403
 
 
-def process_whatsapp_message(data, display_phone_number):
+def verify_subscription(mode, token):
+    return mode == 'subscribe' and token == os.getenv("WHATSAPP_VERIFY_TOKEN", "default_verify_token")
 
-    try:
-        if 'entry' in data and data['entry'] and 'changes' in data['entry'][0] and data['entry'][0]['changes'] and 'value' in data['entry'][0]['changes'][0] and 'contacts' in data['entry'][0]['changes'][0]['value'] and data['entry'][0]['changes'][0]['value']['contacts']:
 
-            profile_name = data['entry'][0]['changes'][0]['value']['contacts'][0]['profile']['name']
-        else:
-            logger.warning("No profile name found in data", extra={"data": data})
-            profile_name = "Unknown"
+def process_whatsapp_message(data, display_phone_number=None):
+    """Process every message of a raw webhook payload (jobs queued before payloads were split into events)"""
+    return process_events([event for event in parse_webhook(data) if event.kind != 'status'])
 
-        tenant_id = Tenant.get_tenant_id(display_phone_number)
-        if not tenant_id:
-            logger.warning("Tenant ID not found for display phone number", extra={"display_phone_number": display_phone_number})
-            return jsonify({"status": "error", "message": "Tenant ID not found for display phone number"}), 404
 
-        client_phone_number = extract_client_phone(data)
-        if not client_phone_number:
-            logger.warning("Client phone number not found in data", extra={"data": data})
-            return jsonify({"status": "error", "message": "Client phone number not found"}), 400
+def process_events(events):
+    """
+    Returns:
+        The first error response, or a success response when every conversation was handled
+    """
+    return merged_response(process_conversations(events))
 
+
+def process_conversations(events):
+    """
+    Process message events, grouped by conversation: the tenant is resolved once per business
+    number, the client once per conversation, and all messages of a conversation are answered
+    as one turn.
+
+    Returns:
+        list: (events, response) for every conversation, in delivery order
+    """
+    tenants = {}
+    results = []
+    for (display_phone_number, client_phone_number), group in group_conversations(events).items():
+        if display_phone_number not in tenants:
+            tenants[display_phone_number] = resolve_tenant(display_phone_number)
         try:
-            Client.insert_client_data(client_phone_number, profile_name, tenant_id)
-            logger.info("Client data inserted successfully", extra={"client_phone_number": client_phone_number[:6] + '*****', "profile_name": profile_name, "tenant_id": tenant_id})
+            response = process_conversation(tenants[display_phone_number], display_phone_number, client_phone_number, group)
         except Exception as e:
-            logger.error("Error inserting client data", extra={"error": str(e), "client_phone_number": client_phone_number[:6] + '*****', "profile_name": profile_name, "tenant_id": tenant_id})
-            return jsonify({"status": "error", "message": "Internal server error"}), 500
+            logger.error("Error processing WhatsApp message", extra={"error": str(e), "message_count": len(group)})
+            response = jsonify({"status": "error", "message": "Internal server error"}), 500
+        results.append((group, response))
+    return results
 
-        if is_audio_message(data):
-            logger.info("Audio message received", extra={"data": data})
-            return process_audio_message(data, display_phone_number, client_phone_number, tenant_id)
-        else:
-            logger.info("Text message received", extra={"data": data})
-            return process_text_message(data, display_phone_number, client_phone_number, tenant_id)
 
+def merged_response(results):
+    """The first error response of process_conversations(), or a success response"""
+    for _, response in results:
+        if status_code(response) >= 400:
+            return response
+    return jsonify({"status": "success"})
+
+
+def process_conversation(tenant, display_phone_number, client_phone_number, events):
+    tenant_id = tenant.tenant_id if tenant else None
+    if not tenant_id:
+        logger.warning("Tenant ID not found for display phone number", extra={"display_phone_number": display_phone_number})
+        return jsonify({"status": "error", "message": "Tenant ID not found for display phone number"}), 404
+
+    if not client_phone_number:
+        logger.warning("Client phone number not found in data", extra={"message_count": len(events)})
+        return jsonify({"status": "error", "message": "Client phone number not found"}), 400
+
+    profile_name = next((event.profile_name for event in reversed(events) if event.profile_name), None)
+    if not profile_name:
+        logger.warning("No profile name found in data", extra={"client_phone_number": client_phone_number[:6] + '*****'})
+        profile_name = "Unknown"
+
+    try:
+        client_id = resolve_client_id(tenant_id, client_phone_number, profile_name)
+        logger.info("Client resolved successfully", extra={"client_phone_number": client_phone_number[:6] + '*****', "profile_name": profile_name, "tenant_id": tenant_id})
     except Exception as e:
-        logger.error("Error processing WhatsApp message", extra={"error": str(e), "data": data})
+        logger.error("Error resolving client", extra={"error": str(e), "client_phone_number": client_phone_number[:6] + '*****', "profile_name": profile_name, "tenant_id": tenant_id})
         return jsonify({"status": "error", "message": "Internal server error"}), 500
 
+    if AI_STREAMING != 'off':
+        # Read receipts and typing indicator right away, off the reply path
+        for event in events:
+            if event.message_id:
+                prefetch_executor.submit(mark_read, tenant, event.message_id)
+
+    texts = []
+    for event in events:
+        if event.kind == 'audio':
+            logger.info("Audio message received", extra={"message_id": event.message_id})
+            text = process_audio_message(event, tenant, client_phone_number)
+        elif event.kind == 'image':
+            text = event.text or '[IMAGE]'
+        elif event.kind == 'document':
+            text = event.text or '[DOCUMENT]'
+        else:
+            text = event.text
+        if text:
+            texts.append(text)
+        else:
+            logger.warning("Message text not found in data", extra={"kind": event.kind, "message_id": event.message_id})
 
+    if not texts:
+        if any(event.kind == 'audio' for event in events):
+            return jsonify({"status": "error", "message": "Failed to transcribe audio"}), 500
+        return jsonify({"status": "success"})
 
-def process_audio_message(data, display_phone_number, client_phone_number, tenant_id):
-    try:
-        audio_data = extract_audio_data(data)
-        if not audio_data:
-            logger.warning("Audio data not found in data", extra={"data": data})
-            return jsonify({"status": "success"})
+    message_text = "\n".join(texts)
+    logger.info("Message text extracted successfully", extra={"message_length": len(message_text), "message_count": len(events), "client_phone": client_phone_number[:6] + '*****'})
+    return generate_and_send_response(message_text, display_phone_number, client_phone_number, tenant_id, client_id)
 
-        logger.info("Audio data extracted successfully", extra={"audio_data": audio_data})
 
-        bytesAudio = download_whatsapp_media(audio_data['id'])
+def process_audio_message(event, tenant, client_phone_number):
+    """
+    Returns:
+        str: The transcription of the voice note, or None when it could not be downloaded or transcribed
+    """
+    media_id = (event.media or {}).get('id')
+    if not media_id:
+        logger.warning("Audio data not found in data", extra={"message_id": event.message_id})
+        return None
+
+    try:
+        bytesAudio = download_whatsapp_media(media_id, tenant.whatsapp_token)
         if not bytesAudio:
-            logger.error("Failed to download audio", extra={"media_id": audio_data['id']})
-            return jsonify({"status": "error", "message": "Failed to download audio"}), 500
+            logger.error("Failed to download audio", extra={"media_id": media_id})
+            return None
 
-        dataText = transcribe_audio(bytesAudio)
+        dataText = transcribe_audio(bytesAudio, tenant.transcription_backend)
         if not dataText:
-            logger.error("Failed to transcribe audio", extra={"media_id": audio_data['id']})
-            return jsonify({"status": "error", "message": "Failed to transcribe audio"}), 500
+            logger.error("Failed to transcribe audio", extra={"media_id": media_id})
+            return None
 
         logger.info("Audio transcribed successfully", extra={"transcribed_text_length": len(dataText), "client_phone": client_phone_number[:6] + '*****'})
+        return dataText
     except Exception as e:
-        logger.error("Error processing audio message", extra={"error": str(e), "data": data})
-        return jsonify({"status": "error", "message": "Internal server error"}), 500
-
+        logger.error("Error processing audio message", extra={"error": str(e), "media_id": media_id})
+        return None
 
-    return generate_and_send_response(dataText, display_phone_number, client_phone_number, tenant_id)
 
+def generate_and_send_response(message_text, display_phone_number, client_phone_number, tenant_id, client_id=None):
+    """Reply to the message, merged with the rest of its burst when COALESCE_WINDOW_MS is set"""
+    if COALESCE_WINDOW_MS <= 0:
+        return respond(message_text, display_phone_number, client_phone_number, tenant_id, client_id)
 
-def process_text_message(data, display_phone_number, client_phone_number, tenant_id):
-    try:
-        msg = extract_whatsapp_message(data)
-        if not msg:
-            logger.warning("Message text not found in data", extra={"data": data})
+    with conversation_turn(tenant_id, client_phone_number, message_text) as turn:
+        if turn.text is None:
+            logger.info("Message merged into a later turn", extra={"client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
             return jsonify({"status": "success"})
-        logger.info("Message text extracted successfully", extra={"message_length": len(msg), "client_phone": client_phone_number[:6] + '*****'})
-
-        return generate_and_send_response(msg, display_phone_number, client_phone_number, tenant_id)
-    except Exception as e:
-        logger.error("Error processing text message", extra={"error": str(e), "data": data})
-        return jsonify({"status": "error", "message": "Internal server error"}), 500
+        response = respond(turn.text, display_phone_number, client_phone_number, tenant_id, client_id)
+        turn.failed = isinstance(response, tuple) and response[1] >= 500
+        return response
 
 
-
-def generate_and_send_response(message_text, display_phone_number, client_phone_number, tenant_id):
+def respond(message_text, display_phone_number, client_phone_number, tenant_id, client_id=None):
 
     try:
         logger.info("Generating and sending response", extra={"message_text": message_text, "display_phone_number": display_phone_number[:6] + "******", "client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
 
-        question_type = classify_intent(message_text)
+        if AI_PIPELINE_MODE == 'structured':
+            return generate_and_send_structured_response(message_text, display_phone_number, client_phone_number, tenant_id, client_id)
+
+        if AI_STREAMING != 'off':
+            return generate_and_send_streamed_response(message_text, display_phone_number, client_phone_number, tenant_id, client_id)
+
+        prepared = prepare_request(message_text, client_phone_number, tenant_id)
+        question_type = prepared["question_type"]
 
         logger.info("Question classified", extra={
             "question_type": question_type,
@@ -177,10 +311,14 @@ def generate_and_send_response(message_text, display_phone_number, client_phone_
             "tenant_id": tenant_id
         })
 
-        response_data = open_ai_gpt(message_text, client_phone_number, question_type, tenant_id)
+        tenant = resolve_tenant(display_phone_number)
+        response_data = open_ai_gpt(message_text, client_phone_number, question_type, tenant_id, prepared=prepared,
+                                    use_semantic_cache=bool(tenant and tenant.semantic_cache_enabled))
         if not response_data:
             logger.error("Failed to get response from AI", extra={"client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
             return jsonify({"status": "error", "message": "Failed to get response from AI"}), 500
+        if response_data is RATE_LIMITED:
+            return send_busy_reply(display_phone_number, client_phone_number, tenant_id)
 
         if 'choices' in response_data and response_data['choices']:
             response_text = response_data['choices'][0]['message']['content']
@@ -188,8 +326,8 @@ def generate_and_send_response(message_text, display_phone_number, client_phone_
 
             from .ai import extract_client_info_with_ai
             try:
-                extract_client_info_with_ai(message_text, client_phone_number, tenant_id)
-                extract_client_info_with_ai(response_text, client_phone_number, tenant_id)
+                extract_client_info_with_ai(message_text, client_phone_number, tenant_id, client_id)
+                extract_client_info_with_ai(response_text, client_phone_number, tenant_id, client_id)
                 logger.info("Client info extracted successfully")
             except Exception as e:
                 logger.warning("Error extracting client info", extra={"error": str(e)})
@@ -207,3 +345,93 @@ def generate_and_send_response(message_text, display_phone_number, client_phone_
     except Exception as e:
         logger.error("Error generating and sending response", extra={"error": str(e), "message_text": message_text, "display_phone_number": display_phone_number[:6] + "******", "client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
         return jsonify({"status": "error", "message": "Internal server error"}), 500
+
+
+
+def send_busy_reply(display_phone_number, client_phone_number, tenant_id):
+    """
+    The quota denied the completion: ask the client to try again shortly. A 5xx would only
+    make Meta redeliver the message into the same saturated quota. The user message is already
+    in the stored history, so the busy reply is saved as its answer.
+    """
+    logger.warning("Completion rate limited, sending busy reply", extra={"client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
+    if not send_message(display_phone_number, client_phone_number, RATE_LIMIT_BUSY_MESSAGE):
+        logger.error("Failed to send response", extra={"display_phone_number": display_phone_number[:6] + "******", "client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
+        return jsonify({"status": "error", "message": "Failed to send response"}), 500
+    save_reply(client_phone_number, RATE_LIMIT_BUSY_MESSAGE, tenant_id)
+    return jsonify({"status": "success", "rate_limited": True})
+
+
+def generate_and_send_structured_response(message_text, display_phone_number, client_phone_number, tenant_id, client_id=None):
+    """Reply, intent and lead extraction from a single completion (AI_PIPELINE_MODE=structured)"""
+    prepared = prepare_request(message_text, client_phone_number, tenant_id, llm_intent=False)
+
+    result = open_ai_structured(message_text, client_phone_number, tenant_id, prepared=prepared, client_id=client_id)
+    if not result:
+        logger.error("Failed to get response from AI", extra={"client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
+        return jsonify({"status": "error", "message": "Failed to get response from AI"}), 500
+    if result is RATE_LIMITED:
+        return send_busy_reply(display_phone_number, client_phone_number, tenant_id)
+
+    logger.info("Response generated successfully", extra={"response_text_length": len(result['reply']), "question_type": result.get('intent'), "display_phone_number": display_phone_number[:6] + "******", "client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
+
+    if not send_message(display_phone_number, client_phone_number, result['reply']):
+        logger.error("Failed to send response", extra={"display_phone_number": display_phone_number[:6] + "******", "client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
+        return jsonify({"status": "error", "message": "Failed to send response"}), 500
+
+    return jsonify({"status": "success"})
+
+
+def generate_and_send_streamed_response(message_text, display_phone_number, client_phone_number, tenant_id, client_id=None):
+    """
+    Stream the completion (AI_STREAMING=chunks|single). In chunks mode every run of complete
+    sentences is sent while the rest is still being generated; in single mode the whole reply
+    is sent as soon as the stream ends. Lead extraction runs after the reply is delivered.
+
+    Once part of the reply reached the client, failures are logged and answered with 200: a
+    5xx would release the message for Meta's retry, which would send a second partial reply.
+    """
+    prepared = prepare_request(message_text, client_phone_number, tenant_id)
+
+    sent_chunks, failed_chunks = [], []
+
+    def send_chunk(text):
+        if send_message(display_phone_number, client_phone_number, text):
+            sent_chunks.append(text)
+        else:
+            failed_chunks.append(text)
+
+    tenant = resolve_tenant(display_phone_number)
+    response_data = open_ai_gpt_stream(message_text, client_phone_number, None, tenant_id, prepared=prepared,
+                                       on_chunk=send_chunk if AI_STREAMING == 'chunks' else None,
+                                       use_semantic_cache=bool(tenant and tenant.semantic_cache_enabled))
+    if not response_data:
+        if sent_chunks:
+            # Keep the history in line with what the client actually received
+            save_reply(client_phone_number, " ".join(sent_chunks), tenant_id)
+            logger.error("Stream failed after part of the reply was sent", extra={"client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id, "chunks_sent": len(sent_chunks)})
+            return jsonify({"status": "success", "partial": True})
+        logger.error("Failed to get response from AI", extra={"client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id})
+        return jsonify({"status": "error", "message": "Failed to get response from AI"}), 500
+    if response_data is RATE_LIMITED:
+        return send_busy_reply(display_phone_number, client_phone_number, tenant_id)
+
+    response_text = response_data['choices'][0]['message']['content']
+    if AI_STREAMING != 'chunks':
+        send_chunk(response_text)
+
+    if failed_chunks:
+        logger.error("Failed to send response", extra={"display_phone_number": display_phone_number[:6] + "******", "client_phone_number": client_phone_number[:6] + "******", "tenant_id": tenant_id, "failed_chunks": len(failed_chunks), "chunks_sent": len(sent_chunks)})
+        if not sent_chunks:
+            return jsonify({"status": "error", "message": "Failed to send response"}), 500
+    else:
+        logger.info("Response streamed successfully", extra={"response_text_length": len(response_text), "chunks_sent": response_data.get('chunks_sent'), "tenant_id": tenant_id})
+
+    from .ai import extract_client_info_with_ai
+    try:
+        extract_client_info_with_ai(message_text, client_phone_number, tenant_id, client_id)
+        extract_client_info_with_ai(response_text, client_phone_number, tenant_id, client_id)
+    except Exception as e:
+        logger.warning("Error extracting client info", extra={"error": str(e)})
+
+    return jsonify({"status": "success"})
@@ -0,0 +1,162 @@
+import hashlib
+import struct
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+
+from config import SEMANTIC_CACHE_MIN_SIMILARITY, SEMANTIC_CACHE_MAX_HISTORY
+from .redis_client import binary_redis_client
+from .redis_config import get_semantic_cache_key, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES
+from .embedding_cache import normalize_text
+from .catalog_events import on_catalog_change, ensure_listener
+from .lru import LRUCache
+from .log_config import logger
+
+
+# Store one entry and evict the oldest past the bound, atomically so concurrent writers cannot
+# overshoot it. KEYS: entries hash, insertion-time zset, version; ARGV: field, entry, max entries,
+# TTL, new version.
+STORE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[2], now, ARGV[1])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[3])
+if excess > 0 then
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+    redis.call('HDEL', KEYS[1], unpack(oldest))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('SET', KEYS[3], ARGV[5], 'EX', ARGV[4])
+"""
+
+_store = binary_redis_client.register_script(STORE_SCRIPT)
+
+# tenant_id -> snapshot of the tenant's entries, rebuilt when the Redis version changes
+_snapshots = LRUCache(1000)
+
+_stats = {"lookups": 0, "hits": 0, "stores": 0, "completions": 0, "completion_seconds": 0.0, "seconds_saved": 0.0}
+_stats_lock = threading.Lock()
+
+
+def is_eligible(question_type, conversation):
+    """Only stand-alone 'general' questions: the answer must not depend on the conversation"""
+    intent = (question_type or "").strip().strip("'\"").lower()
+    return intent == 'general' and len(conversation or ()) <= SEMANTIC_CACHE_MAX_HISTORY
+
+
+def pack_entry(embedding, answer):
+    vector = np.asarray(embedding, dtype=np.float32)
+    return struct.pack("<I", vector.size) + vector.tobytes() + answer.encode("utf-8")
+
+
+def unpack_entry(raw):
+    (size,) = struct.unpack_from("<I", raw)
+    end = 4 + size * 4
+    return np.frombuffer(raw, dtype=np.float32, count=size, offset=4), raw[end:].decode("utf-8")
+
+
+def load_snapshot(tenant_id, version):
+    entries = binary_redis_client.hvals(get_semantic_cache_key(tenant_id))
+    vectors, answers = [], []
+    for raw in entries:
+        vector, answer = unpack_entry(raw)
+        vectors.append(vector)
+        answers.append(answer)
+
+    if vectors:
+        matrix = np.vstack(vectors)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+
+    snapshot = SimpleNamespace(version=version, matrix=matrix, answers=answers)
+    _snapshots.set(tenant_id, snapshot)
+    return snapshot
+
+
+def lookup(tenant_id, embedding):
+    """
+    Cached answer to a question whose embedding is close enough to this one, or None.
+    Costs one GET while the tenant's entries are unchanged.
+    """
+    ensure_listener()
+    start = time.perf_counter()
+    answer = None
+    try:
+        version = binary_redis_client.get(f"{get_semantic_cache_key(tenant_id)}:version")
+        if version is not None:
+            snapshot = _snapshots.get(tenant_id)
+            if snapshot is None or snapshot.version != version:
+                snapshot = load_snapshot(tenant_id, version)
+
+            if snapshot.answers:
+                query = np.array(embedding, dtype=np.float32)
+                scores = snapshot.matrix @ (query / np.linalg.norm(query))
+                best = int(np.argmax(scores))
+                if scores[best] >= SEMANTIC_CACHE_MIN_SIMILARITY:
+                    answer = snapshot.answers[best]
+    except Exception as e:
+        logger.warning("Semantic cache lookup failed", extra={"error": str(e), "tenant": tenant_id})
+
+    record_lookup(answer is not None, time.perf_counter() - start)
+    return answer
+
+
+def store(tenant_id, question, embedding, answer):
+    key = get_semantic_cache_key(tenant_id)
+    field = hashlib.sha1(normalize_text(question).encode("utf-8")).hexdigest()
+    try:
+        # a fresh random version, so a reader never mistakes a rebuilt cache for the one it loaded
+        _store(
+            keys=[key, f"{key}:order", f"{key}:version"],
+            args=[field, pack_entry(embedding, answer), SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL, uuid.uuid4().hex]
+        )
+        with _stats_lock:
+            _stats["stores"] += 1
+    except Exception as e:
+        logger.warning("Semantic cache write failed", extra={"error": str(e), "tenant": tenant_id})
+
+
+@on_catalog_change
+def invalidate(tenant_id):
+    """Answers may quote prices, hours or addresses, so any catalog edit drops the tenant's entries"""
+    _snapshots.pop(tenant_id)
+    key = get_semantic_cache_key(tenant_id)
+    try:
+        binary_redis_client.delete(key, f"{key}:order", f"{key}:version")
+    except Exception as e:
+        logger.warning("Semantic cache invalidation failed", extra={"error": str(e), "tenant": tenant_id})
+
+
+def record_lookup(hit, seconds):
+    with _stats_lock:
+        _stats["lookups"] += 1
+        if hit:
+            _stats["hits"] += 1
+            if _stats["completions"]:
+                average = _stats["completion_seconds"] / _stats["completions"]
+                _stats["seconds_saved"] += max(0.0, average - seconds)
+
+
+def record_completion(seconds):
+    """Duration of a completion made for an eligible question that missed the cache"""
+    with _stats_lock:
+        _stats["completions"] += 1
+        _stats["completion_seconds"] += seconds
+
+
+def semantic_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    completions = stats.pop("completions")
+    completion_seconds = stats.pop("completion_seconds")
+    stats["hit_ratio"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else None
+    stats["avg_completion_ms"] = round(completion_seconds / completions * 1000) if completions else None
+    stats["latency_saved_ms"] = round(stats.pop("seconds_saved") * 1000)
+    return stats
@@ -1,6 +1,4 @@
-import os
-
-import requests
+from . import http_client
 from config import TELEGRAM_TOKEN, TELEGRAM_CHAT_ID
 
 
@@ -15,5 +13,5 @@ def send_message(chat_id, message):
     headers = {
         "Content-Type": "application/json"
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, service='telegram', json=payload, headers=headers)
     print(response)
@@ -0,0 +1,132 @@
+import json
+import time
+from collections import namedtuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import Tenant
+from .redis_client import redis_client
+from .redis_config import get_tenant_key, TENANT_CACHE_TTL, TENANT_LOCAL_TTL, TENANT_NEGATIVE_TTL
+from .catalog_events import on_catalog_change, publish_catalog_change, ensure_listener
+from .lru import LRUCache
+from .log_config import logger
+
+
+TenantRecord = namedtuple('TenantRecord', ['tenant_id', 'whatsapp_token', 'phone_number_id', 'transcription_backend',
+                                           'semantic_cache_enabled'],
+                          defaults=(None, False))
+
+# display phone number -> (expires_at, TenantRecord or None for unknown numbers)
+_local = LRUCache(10000)
+# tenant id -> WhatsApp token. Tokens never go to Redis: the shared tier only holds routing fields
+_tokens = LRUCache(10000)
+
+
+def _load(display_phone_number):
+    tenant = Tenant.query.filter_by(phone_number=display_phone_number).first()
+    if not tenant:
+        return None
+    _tokens.set(tenant.id, tenant.whatsapp_token or '')
+    return TenantRecord(tenant.id, tenant.whatsapp_token, tenant.phone_number_id, tenant.transcription_backend,
+                        bool(tenant.semantic_cache_enabled))
+
+
+def _load_token(tenant_id):
+    token = _tokens.get(tenant_id)
+    if token is None:
+        token = Tenant.query.with_entities(Tenant.whatsapp_token).filter_by(id=tenant_id).scalar() or ''
+        _tokens.set(tenant_id, token)
+    return token or None
+
+
+def resolve_tenant(display_phone_number):
+    """
+    Resolve the business display phone number to its TenantRecord, or None if no tenant owns it.
+    Lookups go in-process cache -> Redis -> Postgres, and unknown numbers are cached too.
+    Redis holds every field but the WhatsApp token, which is kept in process memory per tenant.
+    """
+    if not display_phone_number:
+        return None
+
+    ensure_listener()
+    now = time.time()
+    cached = _local.get(display_phone_number)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    key = get_tenant_key(display_phone_number)
+    raw = None
+    try:
+        raw = redis_client.get(key)
+    except Exception as e:
+        logger.warning("Tenant cache read failed", extra={"error": str(e)})
+
+    if raw is not None:
+        data = json.loads(raw)
+        record = None
+        if data:
+            data['whatsapp_token'] = _load_token(data.get('tenant_id'))
+            record = TenantRecord(**{field: data.get(field) for field in TenantRecord._fields})
+    else:
+        record = _load(display_phone_number)
+        try:
+            routing = {field: value for field, value in record._asdict().items() if field != 'whatsapp_token'} if record else None
+            redis_client.set(key, json.dumps(routing), ex=TENANT_CACHE_TTL if record else TENANT_NEGATIVE_TTL)
+        except Exception as e:
+            logger.warning("Tenant cache write failed", extra={"error": str(e)})
+
+    ttl = TENANT_LOCAL_TTL if record else min(TENANT_LOCAL_TTL, TENANT_NEGATIVE_TTL)
+    _local.set(display_phone_number, (now + ttl, record))
+    return record
+
+
+def invalidate_tenant(*display_phone_numbers):
+    keys = [get_tenant_key(phone) for phone in display_phone_numbers if phone]
+    for phone in display_phone_numbers:
+        _local.pop(phone)
+    if keys:
+        try:
+            redis_client.delete(*keys)
+        except Exception as e:
+            logger.warning("Tenant cache invalidation failed", extra={"error": str(e)})
+
+
+@on_catalog_change
+def _drop_local_entries(tenant_id):
+    # Negative entries go too, in case the change gave the tenant a number cached as unknown
+    _local.remove_if(lambda phone, entry: entry[1] is None or entry[1].tenant_id == tenant_id)
+    _tokens.pop(tenant_id)
+
+
+def _track_tenant(mapper, connection, target):
+    phones = {target.phone_number}
+    history = inspect(target).attrs.phone_number.history
+    phones.update(history.deleted or ())
+
+    session = object_session(target)
+    if session is not None:
+        changed = session.info.setdefault('tenants_changed', {})
+        changed.setdefault(target.id, set()).update(phones)
+
+
+def _flush_tenants(session):
+    changed = session.info.pop('tenants_changed', None)
+    if not changed:
+        return
+    invalidate_tenant(*{phone for phones in changed.values() for phone in phones})
+    publish_catalog_change(changed.keys())
+
+
+def _discard_tenants(session, previous_transaction):
+    session.info.pop('tenants_changed', None)
+
+
+def register_listeners():
+    """Invalidate cached tenant records once a transaction touching tenants commits"""
+    if event.contains(Session, 'after_commit', _flush_tenants):
+        return
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(Tenant, name, _track_tenant)
+    event.listen(Session, 'after_commit', _flush_tenants)
+    event.listen(Session, 'after_soft_rollback', _discard_tenants)
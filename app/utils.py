@@ -1,59 +1,203 @@
-import requests
-import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 import logging
-from openai import OpenAI
-from models.tenant import Tenant
+from abc import ABC, abstractmethod
+from collections import namedtuple, OrderedDict
 
-from config import WHATSAPP_TOKEN, OPENAI_API_KEY
+from config import (WHATSAPP_TOKEN, OPENAI_API_KEY, MEDIA_MAX_BYTES, MEDIA_MAX_DURATION, MEDIA_CHUNK_SIZE,
+                    TRANSCRIPTION_BACKEND, LOCAL_WHISPER_MODEL, LOCAL_WHISPER_COMPUTE_TYPE,
+                    LOCAL_WHISPER_CPU_THREADS, LOCAL_WHISPER_WORKERS, LOCAL_WHISPER_TIMEOUT)
+from . import http_client, local_whisper
 
-def transcribe_audio(bytesAudio):
 
-    if not bytesAudio:
-        logging.error("No audio data provided for transcription")
-        return None
+AUDIO_EXTENSIONS = {
+    'audio/ogg': 'ogg',
+    'audio/opus': 'ogg',
+    'audio/mpeg': 'mp3',
+    'audio/mp4': 'm4a',
+    'audio/aac': 'aac',
+    'audio/amr': 'amr',
+    'audio/wav': 'wav',
+    'audio/webm': 'webm',
+}
+
+
+def audio_filename(mime_type):
+    base_type = (mime_type or '').split(';')[0].strip()
+    return f"voice.{AUDIO_EXTENSIONS.get(base_type, 'ogg')}"
 
+
+def ogg_duration(buffer):
+    """
+    Duration in seconds of an Ogg Opus stream, read from the granule position of its last page
+    (Opus always counts 48 kHz samples). Returns None for anything else.
+    """
+    view = buffer.getbuffer()
     try:
-        if not OPENAI_API_KEY:
-            logging.error("OpenAI API key not found in environment variables")
+        if bytes(view[:4]) != b'OggS':
             return None
+        # An Ogg page is at most ~64 KB, so the last page header is in the tail
+        tail = bytes(view[-65536:])
+    finally:
+        view.release()
+
+    last_page = tail.rfind(b'OggS')
+    # The granule position is bytes 6-13 of the page header
+    if last_page < 0 or last_page + 14 > len(tail):
+        return None
+    granule = int.from_bytes(tail[last_page + 6:last_page + 14], 'little')
+    if granule <= 0 or granule == 0xFFFFFFFFFFFFFFFF:
+        return None
+    return granule / 48000
+
+
+class TranscriptionBackend(ABC):
+    """Speech-to-text engine used for voice notes"""
+
+    name = None
+
+    @abstractmethod
+    def transcribe(self, audio):
+        """
+        Args:
+            audio (BytesIO): The audio buffer, as returned by download_whatsapp_media
+
+        Returns:
+            tuple: (text, audio duration in seconds or None)
+        """
+
+
+class OpenAITranscriptionBackend(TranscriptionBackend):
+    """The hosted whisper-1 API"""
+
+    name = 'openai'
+
+    def transcribe(self, audio):
+        if not OPENAI_API_KEY:
+            raise RuntimeError("OpenAI API key not found in environment variables")
+
+        client = http_client.get_openai_client()
+        audio.seek(0)
+
+        # Hand the in-memory buffer straight to the client; Whisper picks the format from the file name
+        transcript = client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(audio_filename(getattr(audio, 'mime_type', None)), audio),
+        )
+        return transcript.text, getattr(audio, 'duration', None)
+
+
+class LocalWhisperTranscriptionBackend(TranscriptionBackend):
+    """
+    CPU-only Whisper through faster-whisper (CTranslate2, int8 by default), one model per
+    process in a pool so transcriptions do not hold the GIL of the web workers.
+    Needs the faster-whisper package; LOCAL_WHISPER_MODEL can point to a local model
+    directory so no network access is needed.
+    """
+
+    name = 'local'
+
+    def __init__(self):
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ProcessPoolExecutor(
+                        max_workers=LOCAL_WHISPER_WORKERS,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=local_whisper.load_model,
+                        initargs=(LOCAL_WHISPER_MODEL, LOCAL_WHISPER_COMPUTE_TYPE, LOCAL_WHISPER_CPU_THREADS),
+                    )
+        return self.pool
+
+    def transcribe(self, audio):
+        return self.get_pool().submit(local_whisper.transcribe, audio.getvalue()).result(timeout=LOCAL_WHISPER_TIMEOUT)
+
+
+TRANSCRIPTION_BACKENDS = {
+    backend.name: backend for backend in (OpenAITranscriptionBackend, LocalWhisperTranscriptionBackend)
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+_transcription_stats = {}
 
-        client  = OpenAI(api_key=OPENAI_API_KEY)
 
-        bytesAudio.seek(0)
+def get_transcription_backend(name=None):
+    """Backend instance by name (a tenant's transcription_backend), defaulting to TRANSCRIPTION_BACKEND"""
+    name = name if name in TRANSCRIPTION_BACKENDS else TRANSCRIPTION_BACKEND
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = TRANSCRIPTION_BACKENDS[name]()
+        return _backends[name]
 
-        temp_file_path = "/tmp/temp_audio_file.mp3"
-        with open(temp_file_path, "wb") as temp_file:
-            temp_file.write(bytesAudio.getvalue())
 
-        with open(temp_file_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-            )
+def record_transcription(name, processing_seconds, audio_seconds):
+    with _backends_lock:
+        stats = _transcription_stats.setdefault(name, {"count": 0, "processing_seconds": 0.0, "audio_seconds": 0.0})
+        stats["count"] += 1
+        stats["processing_seconds"] += processing_seconds
+        if audio_seconds:
+            stats["audio_seconds"] += audio_seconds
 
-        os.remove(temp_file_path)
 
-        return transcript.text
+def transcription_stats():
+    """Per-backend totals and real-time factor (processing time / audio time, lower is faster)"""
+    with _backends_lock:
+        stats = {name: dict(values) for name, values in _transcription_stats.items()}
+    for values in stats.values():
+        values["real_time_factor"] = round(values["processing_seconds"] / values["audio_seconds"], 4) if values["audio_seconds"] else None
+    return stats
+
+
+def transcribe_audio(bytesAudio, backend=None):
+
+    if not bytesAudio:
+        logging.error("No audio data provided for transcription")
+        return None
+
+    try:
+        engine = get_transcription_backend(backend)
+
+        start_time = time.time()
+        text, duration = engine.transcribe(bytesAudio)
+        elapsed = time.time() - start_time
+
+        record_transcription(engine.name, elapsed, duration)
+        logging.info(f"Audio transcribed with {engine.name}: {elapsed:.2f}s for {duration or 0:.1f}s of audio"
+                     + (f" (RTF {elapsed / duration:.2f})" if duration else ""))
+
+        return text
 
     except Exception as e:
         logging.error(f"Error transcribing audio: {str(e)}")
         return None
 
 
-def download_whatsapp_media(media_id):
+def download_whatsapp_media(media_id, access_token=None, max_bytes=MEDIA_MAX_BYTES, max_duration=MEDIA_MAX_DURATION):
     """
     Download media from WhatsApp using the WhatsApp Business API
 
     Args:
         media_id (str): The ID of the media to download
+        access_token (str): The tenant's WhatsApp token, defaults to WHATSAPP_TOKEN
+        max_bytes (int): Abort the download past this size
+        max_duration (float): Reject Ogg audio longer than this many seconds
 
     Returns:
-        BytesIO: The binary content of the media file as a file-like object
-                or None if download failed
+        BytesIO: The binary content of the media file as a file-like object, with a
+                mime_type attribute, or None if download failed or the media is too large
     """
 
-    if not WHATSAPP_TOKEN:
+    access_token = access_token or WHATSAPP_TOKEN
+    if not access_token:
         logging.error("WhatsApp access token not found in environment variables")
         return None
 
@@ -61,11 +205,11 @@ def download_whatsapp_media(media_id):
     url = f"https://graph.facebook.com/v18.0/{media_id}"
 
     headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}"
+        "Authorization": f"Bearer {access_token}"
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, service='graph', headers=headers)
 
         if response.status_code != 200:
             logging.error(f"Failed to get media URL. Status: {response.status_code}, Response: {response.text}")
@@ -77,16 +221,38 @@ def download_whatsapp_media(media_id):
             logging.error(f"Media URL not found in response: {media_data}")
             return None
 
-        media_url = media_data['url']
+        if int(media_data.get('file_size') or 0) > max_bytes:
+            logging.error(f"Media too large: {media_data.get('file_size')} bytes")
+            return None
 
-        media_response = requests.get(media_url, headers=headers)
+        media_url = media_data['url']
 
-        if media_response.status_code != 200:
-            logging.error(f"Failed to download media. Status: {media_response.status_code}")
+        # Step 2: Stream the content in chunks, stopping as soon as it exceeds max_bytes
+        buffer = BytesIO()
+        with http_client.get(media_url, service='graph', headers=headers, stream=True) as media_response:
+            if media_response.status_code != 200:
+                logging.error(f"Failed to download media. Status: {media_response.status_code}")
+                return None
+
+            if int(media_response.headers.get('Content-Length') or 0) > max_bytes:
+                logging.error(f"Media too large: {media_response.headers.get('Content-Length')} bytes")
+                return None
+
+            for chunk in media_response.iter_content(chunk_size=MEDIA_CHUNK_SIZE):
+                buffer.write(chunk)
+                if buffer.tell() > max_bytes:
+                    logging.error(f"Media download exceeded {max_bytes} bytes")
+                    return None
+
+        duration = ogg_duration(buffer)
+        if duration is not None and duration > max_duration:
+            logging.error(f"Audio too long: {duration:.1f}s")
             return None
 
-        # Return the media content as a file-like object
-        return BytesIO(media_response.content)
+        buffer.seek(0)
+        buffer.mime_type = media_data.get('mime_type') or media_response.headers.get('Content-Type')
+        buffer.duration = duration
+        return buffer
 
     except Exception as e:
         logging.error(f"Error downloading media: {str(e)}")
@@ -101,109 +267,87 @@ def validate_message(msg):
         return False
     return True
 
-def is_audio_message(data):
-    try:
-        if 'entry' in data and data['entry']:
-            for entry in data['entry']:
-                if 'changes' in entry and entry['changes']:
-                    for change in entry['changes']:
-                        if 'value' in change and 'messages' in change['value']:
-                            for message in change['value']['messages']:
-                                if message.get('type') == 'audio':
-                                    return True
-        return False
-    except Exception:
-        # If any error occurs during extraction, assume it's not an audio message
-        return False
+# One normalized item of a webhook delivery. kind is 'text', 'audio', 'image', 'document',
+# 'unsupported' (any other message type) or 'status' (delivery/read receipts of our messages)
+WebhookEvent = namedtuple('WebhookEvent', ['kind', 'display_phone_number', 'phone_number_id', 'client_phone',
+                                           'profile_name', 'message_id', 'timestamp', 'text', 'media', 'status'],
+                          defaults=(None,) * 10)
 
+MEDIA_MESSAGE_KINDS = ('audio', 'image', 'document')
 
-def extract_audio_data(data):
+
+def parse_webhook(data):
     """
-    Extract the audio data from a WhatsApp audio message.
+    Normalize a WhatsApp webhook body into WebhookEvents, walking every entry, change,
+    message and status in a single pass, in delivery order.
 
     Args:
         data (dict): The webhook payload from WhatsApp
 
     Returns:
-        dict: Dictionary containing audio information or None if not found
+        list: WebhookEvent for every message and status update in the payload
     """
-    try:
-        for entry in data['entry']:
-            for change in entry['changes']:
-                if 'value' in change and 'messages' in change['value']:
-                    for message in change['value']['messages']:
-                        if message.get('type') == 'audio':
-                            return {
-                                'id': message['audio'].get('id'),
-                                'mime_type': message['audio'].get('mime_type'),
-                                'is_voice': message['audio'].get('voice', False),
-                                'message_id': message.get('id'),
-                                'from': message.get('from')
-                            }
-        return None
-    except Exception:
-        return None
-
-
-
-def extract_client_phone(data):
-    """Extract the client's phone number from WhatsApp webhook data"""
-    try:
-        # Check if the necessary elements exist in the data
-        if (data.get('object') == 'whatsapp_business_account' and
-                data.get('entry') and
-                len(data['entry']) > 0 and
-                data['entry'][0].get('changes') and
-                len(data['entry'][0]['changes']) > 0):
-
-            # Navigate to the contacts array
-            value = data['entry'][0]['changes'][0].get('value', {})
-            contacts = value.get('contacts', [])
-
-            # Check if there are any contacts
-            if contacts and len(contacts) > 0:
-                # Get the wa_id (WhatsApp ID/phone number)
-                return contacts[0].get('wa_id')
-
-        return None  # Return None if no phone number found
-    except Exception as e:
-        print(f"Error extracting client phone: {e}")
-        return None
-
-
-def extract_whatsapp_message(data):
-    """Extract the message text from WhatsApp webhook data"""
-    try:
-        # Check if the necessary elements exist in the data
-        if (data.get('object') == 'whatsapp_business_account' and
-                data.get('entry') and
-                len(data['entry']) > 0 and
-                data['entry'][0].get('changes') and
-                len(data['entry'][0]['changes']) > 0):
-
-            # Navigate to the messages array
-            value = data['entry'][0]['changes'][0].get('value', {})
-            messages = value.get('messages', [])
-
-            # Check if there are any messages
-            if messages and len(messages) > 0:
-                # Get the message type
-                message_type = messages[0].get('type')
-
-                # Handle different message types
-                if message_type == 'text' and 'text' in messages[0]:
-                    # Extract the text message
-                    return messages[0]['text'].get('body', '')
-                elif message_type == 'image':
-                    return '[IMAGE]'  # Or handle image message differently
-                elif message_type == 'document':
-                    return '[DOCUMENT]'  # Or handle document message differently
-                # Add more message types as needed
-
-        return None  # Return None if no message found
-    except Exception as e:
-        print(f"Error extracting message: {e}")
-        return None
+    events = []
+    if not isinstance(data, dict) or data.get('object') not in (None, 'whatsapp_business_account'):
+        return events
+
+    for entry in data.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            metadata = value.get('metadata') or {}
+            display_phone_number = metadata.get('display_phone_number')
+            phone_number_id = metadata.get('phone_number_id')
+            profiles = {
+                contact.get('wa_id'): (contact.get('profile') or {}).get('name')
+                for contact in value.get('contacts') or []
+            }
+
+            for message in value.get('messages') or []:
+                kind = message.get('type')
+                text = media = None
+                if kind == 'text':
+                    text = (message.get('text') or {}).get('body', '')
+                elif kind in MEDIA_MESSAGE_KINDS:
+                    media = message.get(kind) or {}
+                    text = media.get('caption')
+                else:
+                    kind = 'unsupported'
+
+                events.append(WebhookEvent(
+                    kind=kind,
+                    display_phone_number=display_phone_number,
+                    phone_number_id=phone_number_id,
+                    client_phone=message.get('from'),
+                    profile_name=profiles.get(message.get('from')),
+                    message_id=message.get('id'),
+                    timestamp=message.get('timestamp'),
+                    text=text,
+                    media=media,
+                ))
+
+            for status in value.get('statuses') or []:
+                events.append(WebhookEvent(
+                    kind='status',
+                    display_phone_number=display_phone_number,
+                    phone_number_id=phone_number_id,
+                    client_phone=status.get('recipient_id'),
+                    message_id=status.get('id'),
+                    timestamp=status.get('timestamp'),
+                    status=status,
+                ))
+
+    return events
+
+
+def group_conversations(events):
+    """
+    Message events by conversation, keyed (display_phone_number, client_phone), in delivery order.
+    The display number and phone_number_id of a delivery name the same business number.
+    """
+    conversations = OrderedDict()
+    for event in events:
+        conversations.setdefault((event.display_phone_number, event.client_phone), []).append(event)
+    return conversations
 
 
 def format_response(products):
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import numpy as np
+from sqlalchemy import func
+
+from app import db
+from config import VECTOR_INDEX_CHECK_INTERVAL, VECTOR_INDEX_MAX_TENANTS, VECTOR_SEARCH_MAX_DISTANCE
+from .catalog_events import on_catalog_change, ensure_listener
+from .log_config import logger
+
+
+class TenantIndex:
+    """One tenant's rows of one model: plain row snapshots plus a contiguous unit-normalized float32 matrix"""
+
+    def __init__(self, rows, matrix, version):
+        self.rows = rows
+        self.matrix = matrix
+        self.version = version
+        self.checked_at = time.time()
+
+    def search(self, query, limit, max_distance):
+        if not self.rows:
+            return []
+
+        scores = self.matrix @ query
+        k = min(limit, len(self.rows))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(self.rows) else np.arange(len(self.rows))
+        top = top[np.argsort(-scores[top])]
+
+        return [self.rows[i] for i in top if max_distance is None or 1.0 - scores[i] <= max_distance]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def catalog_version(model, tenant_id):
+    """Cheap fingerprint of a tenant's rows: any edit bumps updated_at, deletes change the count"""
+    return tuple(
+        db.session.query(func.max(model.updated_at), func.count(model.id))
+        .filter(model.tenant_id == tenant_id)
+        .one()
+    )
+
+
+def load_index(model, tenant_id, version):
+    columns = [c for c in model.__table__.columns if c.name != 'embedding']
+    result = (
+        db.session.query(*columns, model.embedding)
+        .filter(model.tenant_id == tenant_id, model.embedding.isnot(None))
+        .all()
+    )
+
+    rows = [SimpleNamespace(**{c.name: row[i] for i, c in enumerate(columns)}) for row in result]
+    if result:
+        matrix = np.ascontiguousarray([row[-1] for row in result], dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+
+    logger.debug("Vector index loaded", extra={"table": model.__tablename__, "tenant": tenant_id, "rows": len(rows)})
+    return TenantIndex(rows, matrix, version)
+
+
+def get_index(model, tenant_id):
+    ensure_listener()
+    key = (model.__tablename__, tenant_id)
+
+    index = _indexes.get(key)
+    if index is not None and time.time() - index.checked_at < VECTOR_INDEX_CHECK_INTERVAL:
+        return index
+
+    version = catalog_version(model, tenant_id)
+    if index is not None and index.version == version:
+        index.checked_at = time.time()
+        return index
+
+    index = load_index(model, tenant_id, version)
+    with _indexes_lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > VECTOR_INDEX_MAX_TENANTS:
+            _indexes.popitem(last=False)
+    return index
+
+
+@on_catalog_change
+def invalidate(tenant_id):
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[1] == tenant_id]:
+            del _indexes[key]
+
+
+def search(model, query_embedding, tenant_id, limit=3, max_distance=None):
+    """
+    In-memory counterpart of the pgvector searches: cosine top-k with one matrix-vector
+    product. Returns row snapshots exposing the same attributes as the model rows.
+    """
+    if max_distance is None:
+        max_distance = VECTOR_SEARCH_MAX_DISTANCE
+
+    query = np.array(query_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query)
+    return get_index(model, tenant_id).search(query, limit, max_distance)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+from .log_config import logger
+
+
+# Process start, as close to it as the app package gets: app/__init__ imports this module first
+BOOT_TIME = time.time()
+
+_state = {"ready": False, "started_at": None, "ready_at": None, "steps": {}, "failed": []}
+_state_lock = threading.Lock()
+
+
+def warm_database(app):
+    from sqlalchemy import text
+    from app import db
+
+    with app.app_context():
+        # dispose() first: connections opened by a preloading parent must not be shared with forks
+        db.engine.dispose(close=False)
+        with db.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+
+def warm_redis(app):
+    from .redis_client import redis_client, binary_redis_client
+
+    redis_client.ping()
+    binary_redis_client.ping()
+
+
+def warm_conversation_store(app):
+    from .conversation_store import get_store
+
+    get_store()
+
+
+def warm_http(app):
+    from . import http_client
+
+    for service in ('openai', 'graph'):
+        http_client.get_session(service)
+    http_client.get_openai_client()
+
+
+def warm_tokenizer(app):
+    from .prompt import get_encoding
+
+    get_encoding()
+
+
+STEPS = (
+    ('database', warm_database),
+    ('redis', warm_redis),
+    ('conversation_store', warm_conversation_store),
+    ('http', warm_http),
+    ('tokenizer', warm_tokenizer),
+)
+
+
+def warm_up(app):
+    """
+    Open the DB and Redis pools and the HTTP sessions before the process takes traffic.
+    A failed step is logged and reported by /ready but does not stop the server.
+    """
+    start = time.time()
+    steps, failed = {}, []
+    for name, step in STEPS:
+        step_start = time.time()
+        try:
+            step(app)
+        except Exception as e:
+            failed.append(name)
+            logger.error("Warm-up step failed", extra={"step": name, "error": str(e)})
+        steps[name] = round((time.time() - step_start) * 1000)
+
+    ready_at = time.time()
+    with _state_lock:
+        _state.update(ready=not failed, started_at=start, ready_at=ready_at, steps=steps, failed=failed)
+
+    logger.info("Warm-up finished", extra=warmup_stats())
+    return not failed
+
+
+def is_ready():
+    return _state["ready"]
+
+
+def warmup_stats():
+    with _state_lock:
+        state = dict(_state)
+    stats = {"ready": state["ready"], "steps_ms": state["steps"], "failed": state["failed"]}
+    if state["ready_at"] is not None:
+        stats["warmup_ms"] = round((state["ready_at"] - state["started_at"]) * 1000)
+        stats["cold_start_ms"] = round((state["ready_at"] - BOOT_TIME) * 1000)
+    return stats
@@ -1,6 +1,7 @@
 import requests
-from models.tenant import Tenant
 from .log_config import logger
+from .tenant_directory import resolve_tenant
+from . import http_client
 
 
 
@@ -18,14 +19,14 @@ def extract_client_access_token(phone):
         "phone": mask_identifier(phone)
     })
 
-    tenantObj = Tenant.query.filter_by(phone_number=phone).first()
-    if tenantObj:
+    tenant = resolve_tenant(phone)
+    if tenant:
         logger.info("Tenant found for phone: ", extra={
-            "tenant_id": tenantObj.id,
+            "tenant_id": tenant.tenant_id,
         })
-        whatsapp_token = tenantObj.whatsapp_token
-        phone_number_id = tenantObj.phone_number_id
-        tenant_id = tenantObj.id
+        whatsapp_token = tenant.whatsapp_token
+        phone_number_id = tenant.phone_number_id
+        tenant_id = tenant.tenant_id
     else:
         logger.warning("Tenant not found for phone: ", extra={
             "phone": phone[:6] + "******"
@@ -58,7 +59,7 @@ def send_message(sender, to, message):
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = http_client.post(url, service='graph', json=payload, headers=headers)
         response.raise_for_status()
         logger.info("Message sent successfully", extra={
             "to": to[:6] + "******",
@@ -69,3 +70,91 @@ def send_message(sender, to, message):
             "error": str(e)
         })
         return False
+
+
+def mark_read(tenant, message_id, typing=True):
+    """
+    Mark the inbound message as read and show the typing indicator until the reply is sent.
+    Takes the resolved TenantRecord: it runs on a pool thread, outside the app context.
+    """
+    url = f"https://graph.facebook.com/v17.0/{tenant.phone_number_id}/messages"
+
+    payload = {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id
+    }
+    if typing:
+        payload["typing_indicator"] = {"type": "text"}
+
+    headers = {
+        "Authorization": f"Bearer {tenant.whatsapp_token}",
+        "content-type": "application/json"
+    }
+
+    try:
+        response = http_client.post(url, service='graph', json=payload, headers=headers)
+        response.raise_for_status()
+        return True
+    except requests.exceptions.RequestException as e:
+        logger.warning("Error marking message as read", extra={
+            "error": str(e)
+        })
+        return False
+
+
+async def asend_message(tenant, to, message):
+    """Async send_message() for a resolved TenantRecord"""
+    url = f"https://graph.facebook.com/v17.0/{tenant.phone_number_id}/messages"
+
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "text": {"body": message}
+    }
+
+    headers = {
+        "Authorization": f"Bearer {tenant.whatsapp_token}",
+        "content-type": "application/json"
+    }
+
+    try:
+        response = await http_client.arequest("POST", url, service='graph', json=payload, headers=headers)
+        response.raise_for_status()
+        logger.info("Message sent successfully", extra={
+            "to": to[:6] + "******",
+        })
+        return True
+    except Exception as e:
+        logger.error("Error sending message", extra={
+            "error": str(e)
+        })
+        return False
+
+
+async def amark_read(tenant, message_id, typing=True):
+    """Async mark_read() for a resolved TenantRecord"""
+    url = f"https://graph.facebook.com/v17.0/{tenant.phone_number_id}/messages"
+
+    payload = {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id
+    }
+    if typing:
+        payload["typing_indicator"] = {"type": "text"}
+
+    headers = {
+        "Authorization": f"Bearer {tenant.whatsapp_token}",
+        "content-type": "application/json"
+    }
+
+    try:
+        response = await http_client.arequest("POST", url, service='graph', json=payload, headers=headers)
+        response.raise_for_status()
+        return True
+    except Exception as e:
+        logger.warning("Error marking message as read", extra={
+            "error": str(e)
+        })
+        return False
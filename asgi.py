@@ -0,0 +1,113 @@
+"""
+Async entry point for the webhook: uvicorn asgi:app --workers 2
+
+Mirrors the Flask /webhook and /metrics routes; replies are generated by app.aio so one
+process keeps many conversations in flight while waiting on OpenAI and the Graph API.
+"""
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from app import create_app, aio
+from app.routes import metrics_snapshot, verify_subscription
+from app.utils import parse_webhook
+from app.job_queue import aenqueue_events
+from app.idempotency import aclaim_message, arelease_message
+from app.log_config import logger
+from app.warmup import warm_up, is_ready, warmup_stats
+from app.reembed import ensure_drain
+from config import WEBHOOK_MODE
+
+
+flask_app = create_app()
+aio.init_app(flask_app)
+
+
+async def webhook(request):
+    if request.method == 'GET':
+        return handle_verification(request)
+
+    claimed = []
+    try:
+        data = await request.json()
+        if not data or 'entry' not in data or not data['entry']:
+            logger.warning("Invalid data received", extra={"data": data})
+            return JSONResponse({"status": "error", "message": "Invalid data"}, status_code=400)
+
+        messages = [event for event in parse_webhook(data) if event.kind != 'status']
+        if not messages:
+            return JSONResponse({"status": "success"})
+
+        # Meta retries slow deliveries; acknowledge a retry without doing the work twice
+        fresh = []
+        for event in messages:
+            if not event.message_id:
+                fresh.append(event)
+            elif await aclaim_message(event.message_id):
+                fresh.append(event)
+                claimed.append(event.message_id)
+        if not fresh:
+            return JSONResponse({"status": "success"})
+
+        if WEBHOOK_MODE == 'queue':
+            if await aenqueue_events(fresh):
+                return JSONResponse({"status": "success"})
+            logger.warning("Job queue unavailable, processing messages inline", extra={"count": len(fresh)})
+
+        results = await aio.aprocess_conversations(fresh)
+        # Only the failed conversations are redone on Meta's retry; the others stay claimed
+        for group, (_, status) in results:
+            if status >= 500:
+                for event in group:
+                    if event.message_id in claimed:
+                        await arelease_message(event.message_id)
+        body, status = aio.merged_result(results)
+        return JSONResponse(body, status_code=status)
+    except Exception as e:
+        logger.error("Error processing webhook", extra={"error": str(e)})
+        for message_id in claimed:
+            await arelease_message(message_id)
+        return JSONResponse({"status": "error", "message": "Internal server error"}, status_code=500)
+
+
+def handle_verification(request):
+    mode = request.query_params.get('hub.mode')
+    token = request.query_params.get('hub.verify_token')
+    challenge = request.query_params.get('hub.challenge')
+
+    if verify_subscription(mode, token):
+        logger.info("Webhook Verification successful")
+        return PlainTextResponse(challenge or "")
+    logger.warning("Webhook Verification failed", extra={"mode": mode})
+    return JSONResponse({"status": "error", "message": "Verification failed"}, status_code=403)
+
+
+async def metrics(request):
+    return JSONResponse(metrics_snapshot())
+
+
+async def ready(request):
+    stats = warmup_stats()
+    if is_ready():
+        return JSONResponse({"status": "ready", **stats})
+    return JSONResponse({"status": "starting" if not stats["steps_ms"] else "degraded", **stats}, status_code=503)
+
+
+async def startup():
+    # uvicorn only starts accepting connections once startup handlers return
+    await asyncio.to_thread(warm_up, flask_app)
+    if WEBHOOK_MODE != 'queue':
+        ensure_drain(flask_app)
+
+
+app = Starlette(
+    routes=[
+        Route('/webhook', webhook, methods=['GET', 'POST']),
+        Route('/metrics', metrics, methods=['GET']),
+        Route('/ready', ready, methods=['GET']),
+    ],
+    on_startup=[startup],
+    on_shutdown=[aio.close],
+)
@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import time
+
+from openai import RateLimitError
+from sqlalchemy.orm import defer
+
+from app import create_app, db
+from app.http_client import get_openai_client
+from app.reembed import EMBEDDED_MODELS as MODELS, embed_texts, write_embeddings
+from app.catalog_events import publish_catalog_change
+
+
+class RateController:
+    """Additive-increase / multiplicative-decrease pacing driven by 429 responses"""
+
+    def __init__(self, max_delay=60.0):
+        self.delay = 0.0
+        self.max_delay = max_delay
+
+    def wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def success(self):
+        self.delay = max(0.0, self.delay - 0.1)
+
+    def throttled(self, retry_after=None):
+        self.delay = min(self.max_delay, max(self.delay * 2, 1.0, retry_after or 0.0))
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def iter_chunks(model, after_id, chunk_size, only_missing):
+    """Yield rows in id order, one keyset page at a time, without loading the stored vectors"""
+    while True:
+        query = model.query.options(defer(model.embedding)).filter(model.id > after_id)
+        if only_missing:
+            query = query.filter(model.embedding.is_(None))
+
+        rows = query.order_by(model.id).limit(chunk_size).all()
+        if not rows:
+            return
+
+        yield rows
+        after_id = rows[-1].id
+
+
+def embed_batch(client, texts, rate):
+    while True:
+        rate.wait()
+        try:
+            embeddings = embed_texts(texts, client)
+            rate.success()
+            return embeddings
+        except RateLimitError as e:
+            retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+            rate.throttled(float(retry_after) if retry_after else None)
+            print(f"Rate limited, backing off {rate.delay:.1f}s")
+
+
+def backfill(name, batch_size, checkpoint, checkpoint_path, only_missing, changed_only):
+    model = MODELS[name]
+    client = get_openai_client().with_options(max_retries=0)
+    rate = RateController()
+
+    total = 0
+    start = time.time()
+    for rows in iter_chunks(model, checkpoint.get(name, 0), batch_size, only_missing):
+        last_id = rows[-1].id
+        if changed_only:
+            rows = [row for row in rows if row.embedding_hash != row.content_hash()]
+
+        if rows:
+            embeddings = embed_batch(client, [row.embedding_text() for row in rows], rate)
+            write_embeddings(model, rows, embeddings)
+        # read before the commit expires the rows, or each tenant_id costs a SELECT
+        tenant_ids = {row.tenant_id for row in rows}
+        db.session.commit()
+        publish_catalog_change(tenant_ids)
+        db.session.expunge_all()
+
+        checkpoint[name] = last_id
+        save_checkpoint(checkpoint_path, checkpoint)
+
+        total += len(rows)
+        print(f"{name}: {total} rows embedded ({total / (time.time() - start):.1f} rows/s), last id {last_id}")
+
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed Service, Product and TenantInfo rows in batches")
+    parser.add_argument('--model', dest='models', action='append', choices=sorted(MODELS), help="model to backfill, repeatable (default: all)")
+    parser.add_argument('--batch-size', type=int, default=256, help="rows per embeddings request and per bulk update")
+    parser.add_argument('--checkpoint', default='.embedding_backfill.json', help="file recording the last embedded id per model")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start from the first row")
+    parser.add_argument('--only-missing', action='store_true', help="only embed rows without an embedding")
+    parser.add_argument('--changed-only', action='store_true', help="only embed rows whose text changed since they were embedded")
+    args = parser.parse_args()
+
+    checkpoint = {} if args.restart else load_checkpoint(args.checkpoint)
+
+    app = create_app()
+    with app.app_context():
+        for name in args.models or sorted(MODELS):
+            total = backfill(name, args.batch_size, checkpoint, args.checkpoint, args.only_missing, args.changed_only)
+            print(f"{name}: done, {total} rows embedded")
+
+    # A completed run starts over next time
+    checkpoint.clear()
+    save_checkpoint(args.checkpoint, checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from app import create_app, db
+from models.vector_search import parse_version
+
+
+def synthetic_dataset(tenants, items_per_tenant, dim, seed, small_tenant_items=0):
+    """
+    Clustered unit vectors: every tenant has its own topic, items are noisy variations of it.
+    With small_tenant_items, one extra tenant (the last id) gets only that many items.
+    """
+    rng = np.random.default_rng(seed)
+    total = tenants + (1 if small_tenant_items else 0)
+    centers = rng.normal(size=(total, dim)).astype(np.float32)
+    rows = []
+    for tenant_id in range(1, total + 1):
+        count = items_per_tenant if tenant_id <= tenants else small_tenant_items
+        vectors = centers[tenant_id - 1] + 0.6 * rng.normal(size=(count, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        rows.extend((tenant_id, vector) for vector in vectors)
+    return centers, rows
+
+
+def make_queries(centers, tenant_ids, count, dim, rng):
+    queries = []
+    for _ in range(count):
+        tenant_id = int(rng.choice(tenant_ids))
+        query = centers[tenant_id - 1] + 0.8 * rng.normal(size=dim).astype(np.float32)
+        queries.append((tenant_id, to_literal(query / np.linalg.norm(query))))
+    return queries
+
+
+def to_literal(vector):
+    return "[" + ",".join(f"{x:.6f}" for x in vector) + "]"
+
+
+def run_queries(conn, queries, limit, max_distance):
+    distance_filter = "AND embedding <=> CAST(:q AS vector) <= :max_distance" if max_distance is not None else ""
+    statement = text(f"""
+        SELECT id FROM bench_items
+        WHERE tenant_id = :tenant_id {distance_filter}
+        ORDER BY embedding <=> CAST(:q AS vector)
+        LIMIT :limit
+    """)
+
+    results, latencies = [], []
+    for tenant_id, literal in queries:
+        start = time.perf_counter()
+        ids = conn.execute(statement, {"tenant_id": tenant_id, "q": literal, "limit": limit, "max_distance": max_distance}).scalars().all()
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(set(ids))
+    return results, latencies
+
+
+def report(label, results, exact, latencies):
+    recall = np.mean([len(r & e) / len(e) if e else 1.0 for r, e in zip(results, exact)])
+    empty = sum(1 for r, e in zip(results, exact) if e and not r)
+    print(f"{label:<44} recall={recall:.3f}  empty={empty:<4} p50={np.percentile(latencies, 50):7.2f} ms  p95={np.percentile(latencies, 95):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare HNSW retrieval against the exact scan on synthetic multi-tenant data")
+    parser.add_argument('--tenants', type=int, default=200)
+    parser.add_argument('--items-per-tenant', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=3)
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[40, 100, 200])
+    parser.add_argument('--small-tenant-items', type=int, default=5,
+                        help="items of one extra tenant, to measure recall when the tenant filter is very selective")
+    parser.add_argument('--max-distance', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    centers, rows = synthetic_dataset(args.tenants, args.items_per_tenant, args.dim, args.seed, args.small_tenant_items)
+
+    rng = np.random.default_rng(args.seed + 1)
+    workloads = [("", make_queries(centers, np.arange(1, args.tenants + 1), args.queries, args.dim, rng))]
+    if args.small_tenant_items:
+        workloads.append((" small tenant", make_queries(centers, [args.tenants + 1], args.queries, args.dim, rng)))
+
+    app = create_app()
+    with app.app_context(), db.engine.connect() as conn:
+        conn.execute(text(f"CREATE TEMP TABLE bench_items (id serial PRIMARY KEY, tenant_id integer NOT NULL, embedding vector({args.dim}))"))
+
+        start = time.perf_counter()
+        conn.execute(
+            text("INSERT INTO bench_items (tenant_id, embedding) VALUES (:tenant_id, CAST(:embedding AS vector))"),
+            [{"tenant_id": tenant_id, "embedding": to_literal(vector)} for tenant_id, vector in rows]
+        )
+        conn.execute(text("CREATE INDEX bench_items_tenant_idx ON bench_items (tenant_id)"))
+        conn.execute(text("ANALYZE bench_items"))
+        print(f"Loaded {len(rows)} rows for {args.tenants} tenants in {time.perf_counter() - start:.1f}s")
+
+        # Exact: tenant_id btree + sort, no vector index exists yet
+        exact = {}
+        for name, queries in workloads:
+            exact[name], latencies = run_queries(conn, queries, args.limit, args.max_distance)
+            report(f"exact scan{name}", exact[name], exact[name], latencies)
+
+        start = time.perf_counter()
+        conn.execute(text("CREATE INDEX ON bench_items USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"))
+        conn.execute(text("ANALYZE bench_items"))
+        print(f"Built HNSW index in {time.perf_counter() - start:.1f}s")
+
+        # Force the vector index so the comparison does not depend on the planner's choice
+        conn.execute(text("DROP INDEX bench_items_tenant_idx"))
+        conn.execute(text("SET enable_seqscan = off"))
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        scans = ['off', 'relaxed_order'] if parse_version(version) >= (0, 8) else [None]
+        for scan in scans:
+            if scan:
+                conn.execute(text(f"SET hnsw.iterative_scan = {scan}"))
+            for ef_search in args.ef_search:
+                conn.execute(text(f"SET hnsw.ef_search = {int(ef_search)}"))
+                for name, queries in workloads:
+                    results, latencies = run_queries(conn, queries, args.limit, args.max_distance)
+                    label = f"hnsw ef_search={ef_search}" + (f" iterative={scan}" if scan else "") + name
+                    report(label, results, exact[name], latencies)
+
+        conn.rollback()
+
+
+if __name__ == '__main__':
+    main()
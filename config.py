@@ -15,4 +15,105 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
 GEMENI_AI = os.getenv("GEMENI_AI_API_KEY")
-OPENAI_API_KEY = os.getenv("OPEN_AI_API_KEY")
\ No newline at end of file
+OPENAI_API_KEY = os.getenv("OPEN_AI_API_KEY")
+
+
+# "inline" runs the AI pipeline inside the webhook request, "queue" hands it to worker.py
+# (which then also re-embeds edited catalog rows; in inline mode the web processes do)
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 4))
+
+# threads used to fan out classification, embedding and history reads per message
+AI_PREFETCH_WORKERS = int(os.getenv("AI_PREFETCH_WORKERS", 16))
+
+# "local" scores the message embedding against per-tenant catalog centroids and only
+# calls the LLM classifier when the margin between the two best intents is too small
+INTENT_CLASSIFIER = os.getenv("INTENT_CLASSIFIER", "local")
+INTENT_MIN_MARGIN = float(os.getenv("INTENT_MIN_MARGIN", 0.02))
+INTENT_CENTROID_TTL = int(os.getenv("INTENT_CENTROID_TTL", 300))
+INTENT_SHADOW_SAMPLE_RATE = float(os.getenv("INTENT_SHADOW_SAMPLE_RATE", 0.05))
+
+# "classic" makes separate classify/reply/extract completions, "structured" makes one tool-call completion
+AI_PIPELINE_MODE = os.getenv("AI_PIPELINE_MODE", "classic")
+# Structured turns report the lead from the whole conversation: within this many seconds (the
+# conversation lifetime by default) they update the client's order for the pack instead of adding one
+ORDER_DEDUPE_WINDOW = int(os.getenv("ORDER_DEDUPE_WINDOW", 86400))
+
+# Reply streaming: "off" sends the reply once the completion is done, "chunks" sends it in
+# sentence-boundary pieces of at least STREAM_CHUNK_MIN_CHARS as it streams, "single" streams
+# the completion and sends the whole reply the moment the stream ends
+AI_STREAMING = os.getenv("AI_STREAMING", "off")
+STREAM_CHUNK_MIN_CHARS = int(os.getenv("STREAM_CHUNK_MIN_CHARS", 160))
+
+# OpenAI quotas shared by all tenants (0 disables a bucket). Calls wait at most RATE_LIMIT_MAX_WAIT
+# seconds for capacity, with at most RATE_LIMIT_MAX_WAITERS waiting per process; optional calls
+# such as lead extraction are skipped instead of waiting
+RATE_LIMIT_GLOBAL_RPM = int(os.getenv("RATE_LIMIT_GLOBAL_RPM", 3500))
+RATE_LIMIT_GLOBAL_TPM = int(os.getenv("RATE_LIMIT_GLOBAL_TPM", 90000))
+RATE_LIMIT_TENANT_RPM = int(os.getenv("RATE_LIMIT_TENANT_RPM", 300))
+RATE_LIMIT_TENANT_TPM = int(os.getenv("RATE_LIMIT_TENANT_TPM", 20000))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 10))
+RATE_LIMIT_MAX_WAITERS = int(os.getenv("RATE_LIMIT_MAX_WAITERS", 32))
+# completion tokens assumed when a call sets no max_tokens
+RATE_LIMIT_COMPLETION_TOKENS = int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", 300))
+# sent instead of a reply when the quota denies the completion, so the webhook still answers 200
+RATE_LIMIT_BUSY_MESSAGE = os.getenv("RATE_LIMIT_BUSY_MESSAGE", "We are receiving a lot of messages right now, please try again in a moment.")
+
+# Opt-in: messages a client sends within COALESCE_WINDOW_MS of each other are answered as one
+# turn, at most one reply per conversation being generated at a time. Every reply then waits
+# out the window, so it stays off (0) unless set
+COALESCE_WINDOW_MS = int(os.getenv("COALESCE_WINDOW_MS", 0))
+COALESCE_LOCK_TTL = int(os.getenv("COALESCE_LOCK_TTL", 120))
+
+# Semantic reply cache for tenants that enable it: 'general' questions asked with at most
+# SEMANTIC_CACHE_MAX_HISTORY earlier messages reuse a stored answer when the question
+# embeddings have a cosine similarity of at least SEMANTIC_CACHE_MIN_SIMILARITY
+SEMANTIC_CACHE_MIN_SIMILARITY = float(os.getenv("SEMANTIC_CACHE_MIN_SIMILARITY", 0.95))
+SEMANTIC_CACHE_MAX_HISTORY = int(os.getenv("SEMANTIC_CACHE_MAX_HISTORY", 2))
+
+# ASGI entry point (asgi.py): SQLAlchemy asyncpg pool for pgvector searches
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", 20))
+ASYNC_DB_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", 20))
+
+# Prompt assembly: history is fitted newest-first into the token budget, older turns are
+# folded into a rolling summary once at least PROMPT_SUMMARY_MIN_MESSAGES have been left out
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 2500))
+PROMPT_SUMMARY_MODEL = os.getenv("PROMPT_SUMMARY_MODEL", "gpt-3.5-turbo")
+PROMPT_SUMMARY_MIN_MESSAGES = int(os.getenv("PROMPT_SUMMARY_MIN_MESSAGES", 6))
+PROMPT_SUMMARY_MAX_TOKENS = int(os.getenv("PROMPT_SUMMARY_MAX_TOKENS", 300))
+
+# Outbound HTTP (OpenAI, WhatsApp Graph, Telegram)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 32))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", 0.5))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+# pgvector retrieval; unset scan parameters keep the server defaults
+VECTOR_SEARCH_EF_SEARCH = int(os.getenv("VECTOR_SEARCH_EF_SEARCH", 0)) or None
+VECTOR_SEARCH_PROBES = int(os.getenv("VECTOR_SEARCH_PROBES", 0)) or None
+# "relaxed_order" or "strict_order" use pgvector >= 0.8 iterative index scans so small tenants still get
+# their nearest rows; on older servers a short result is re-run as an exact per-tenant scan. "off" disables both
+VECTOR_SEARCH_ITERATIVE_SCAN = os.getenv("VECTOR_SEARCH_ITERATIVE_SCAN", "relaxed_order")
+# rows further than this cosine distance are not retrieved; off (2) unless set
+VECTOR_SEARCH_MAX_DISTANCE = float(os.getenv("VECTOR_SEARCH_MAX_DISTANCE", 2.0))
+
+# "pgvector" searches in Postgres, "memory" keeps each tenant's embeddings in a NumPy matrix
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pgvector")
+VECTOR_INDEX_CHECK_INTERVAL = int(os.getenv("VECTOR_INDEX_CHECK_INTERVAL", 30))
+VECTOR_INDEX_MAX_TENANTS = int(os.getenv("VECTOR_INDEX_MAX_TENANTS", 1000))
+
+# Voice notes / media downloads
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", 16 * 1024 * 1024))
+MEDIA_MAX_DURATION = float(os.getenv("MEDIA_MAX_DURATION", 300))
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", 64 * 1024))
+
+# Speech-to-text: "openai" (whisper-1 API) or "local" (faster-whisper on CPU); tenants can override
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "openai")
+LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+LOCAL_WHISPER_CPU_THREADS = int(os.getenv("LOCAL_WHISPER_CPU_THREADS", 2))
+LOCAL_WHISPER_WORKERS = int(os.getenv("LOCAL_WHISPER_WORKERS", 2))
+LOCAL_WHISPER_TIMEOUT = float(os.getenv("LOCAL_WHISPER_TIMEOUT", 120))
@@ -0,0 +1,42 @@
+"""
+Production server: gunicorn run:app (this file is picked up automatically)
+
+The webhook spends nearly all of its time waiting on OpenAI, the Graph API, Redis and Postgres,
+so each worker runs a pool of threads (gthread) instead of one request at a time. The app,
+models and the AI pipeline are imported once in the master (preload_app) and shared with the
+workers copy-on-write; each worker then opens its own pools before accepting traffic.
+"""
+import multiprocessing
+import os
+import time
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", min(multiprocessing.cpu_count() * 2, 8)))
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+preload_app = True
+
+# a reply can wait on several completions; Meta retries after ~20s anyway
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# recycle workers now and then to cap memory growth, staggered so they do not all restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 500))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+
+
+def post_worker_init(worker):
+    """Runs in each worker before it accepts connections"""
+    from app.warmup import warm_up
+
+    warm_up(worker.wsgi)
+
+
+def when_ready(server):
+    from app.warmup import BOOT_TIME
+
+    server.log.info("Master ready in %d ms (app preloaded)", round((time.time() - BOOT_TIME) * 1000))
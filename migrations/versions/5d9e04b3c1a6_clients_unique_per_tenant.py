@@ -0,0 +1,27 @@
+"""scope client phone numbers to their tenant
+
+Revision ID: 5d9e04b3c1a6
+Revises: c7e2f91a5d38
+Create Date: 2026-10-18 11:02:18.447120
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5d9e04b3c1a6'
+down_revision = 'c7e2f91a5d38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('clients', schema=None) as batch_op:
+        batch_op.drop_constraint('clients_phone_number_key', type_='unique')
+        batch_op.create_unique_constraint('uq_clients_tenant_phone', ['tenant_id', 'phone_number'])
+
+
+def downgrade():
+    with op.batch_alter_table('clients', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_clients_tenant_phone', type_='unique')
+        batch_op.create_unique_constraint('clients_phone_number_key', ['phone_number'])
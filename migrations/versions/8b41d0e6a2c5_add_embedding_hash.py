@@ -0,0 +1,28 @@
+"""add embedding_hash to embedded catalog tables
+
+Revision ID: 8b41d0e6a2c5
+Revises: 3f2a9c1d4b70
+Create Date: 2026-10-18 09:40:03.582914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d0e6a2c5'
+down_revision = '3f2a9c1d4b70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('services', 'product', 'tenant_info'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('embedding_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    for table in ('services', 'product', 'tenant_info'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('embedding_hash')
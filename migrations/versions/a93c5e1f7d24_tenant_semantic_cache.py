@@ -0,0 +1,26 @@
+"""per-tenant semantic reply cache opt-in
+
+Revision ID: a93c5e1f7d24
+Revises: e14b7a2f9c03
+Create Date: 2026-10-18 13:05:41.508812
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93c5e1f7d24'
+down_revision = 'e14b7a2f9c03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('semantic_cache_enabled', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.drop_column('semantic_cache_enabled')
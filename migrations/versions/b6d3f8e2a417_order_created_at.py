@@ -0,0 +1,26 @@
+"""order creation time
+
+Revision ID: b6d3f8e2a417
+Revises: a93c5e1f7d24
+Create Date: 2026-10-18 16:12:08.734215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d3f8e2a417'
+down_revision = 'a93c5e1f7d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
@@ -0,0 +1,44 @@
+"""hnsw vector indexes and tenant_id indexes for retrieval
+
+tenant_info is not given a vector index: tenant_id is unique there, so the
+existing unique index already narrows a search to a single row.
+
+Revision ID: c7e2f91a5d38
+Revises: 8b41d0e6a2c5
+Create Date: 2026-10-18 10:21:37.904466
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2f91a5d38'
+down_revision = '8b41d0e6a2c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('services', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_services_tenant_id'), ['tenant_id'], unique=False)
+        batch_op.create_index('ix_services_embedding_hnsw', ['embedding'], unique=False,
+                              postgresql_using='hnsw',
+                              postgresql_with={'m': 16, 'ef_construction': 64},
+                              postgresql_ops={'embedding': 'vector_cosine_ops'})
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_tenant_id'), ['tenant_id'], unique=False)
+        batch_op.create_index('ix_product_embedding_hnsw', ['embedding'], unique=False,
+                              postgresql_using='hnsw',
+                              postgresql_with={'m': 16, 'ef_construction': 64},
+                              postgresql_ops={'embedding': 'vector_cosine_ops'})
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_embedding_hnsw', postgresql_using='hnsw')
+        batch_op.drop_index(batch_op.f('ix_product_tenant_id'))
+
+    with op.batch_alter_table('services', schema=None) as batch_op:
+        batch_op.drop_index('ix_services_embedding_hnsw', postgresql_using='hnsw')
+        batch_op.drop_index(batch_op.f('ix_services_tenant_id'))
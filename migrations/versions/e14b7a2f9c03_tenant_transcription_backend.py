@@ -0,0 +1,26 @@
+"""per-tenant speech-to-text backend
+
+Revision ID: e14b7a2f9c03
+Revises: 5d9e04b3c1a6
+Create Date: 2026-10-18 11:47:55.120384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e14b7a2f9c03'
+down_revision = '5d9e04b3c1a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('transcription_backend', sa.String(length=20), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.drop_column('transcription_backend')
@@ -2,11 +2,12 @@ from enum import unique
 
 from app import db
 from pgvector.sqlalchemy import VECTOR
-from config import OPENAI_API_KEY
-from openai import OpenAI
+from app.http_client import get_openai_client
+from .embedded import EmbeddedContentMixin
+from .vector_search import search_by_embedding
 
 
-class TenantInfo(db.Model):
+class TenantInfo(EmbeddedContentMixin, db.Model):
     __tablename__ = 'tenant_info'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -22,9 +23,12 @@ class TenantInfo(db.Model):
     embedding = db.Column(VECTOR(1536), nullable=True)
 
 
+    def embedding_text(self):
+        return f"Tenant Information: {self.name} {self.email} {self.phone_number} {self.address} {self.city}"
+
     def generate_embedding(self):
-        text = f"Tenant Information: {self.name} {self.email} {self.phone_number} {self.address} {self.city}"
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        text = self.embedding_text()
+        client = get_openai_client()
 
         try:
             response = client.embeddings.create(
@@ -32,19 +36,13 @@ class TenantInfo(db.Model):
                 model="text-embedding-ada-002",
             )
             self.embedding = response.data[0].embedding
+            self.embedding_hash = self.content_hash()
         except Exception as e:
             # LOGGING
             raise e
         return self.embedding
 
     @classmethod
-    def get_tenant_information(cls, query_embedding, tenant_id):
+    def get_tenant_information(cls, query_embedding, tenant_id, limit=1):
         """Get tenant information."""
-        from models import TenantInfo
-
-        return (
-            db.session.query(TenantInfo)
-            .filter(TenantInfo.tenant_id == tenant_id)
-            .order_by(TenantInfo.embedding.op('<=>')(query_embedding))
-            .all()
-        )
\ No newline at end of file
+        return search_by_embedding(cls, query_embedding, tenant_id, limit)
\ No newline at end of file
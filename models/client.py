@@ -1,13 +1,18 @@
 from enum import unique
 
+from sqlalchemy import text
+
 from app import db
 
 
 class Client(db.Model):
     __tablename__ = 'clients'
+    __table_args__ = (
+        db.UniqueConstraint('tenant_id', 'phone_number', name='uq_clients_tenant_phone'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     fullname = db.Column(db.String(100), nullable=False)
-    phone_number = db.Column(db.String(20), nullable=False, unique=True)
+    phone_number = db.Column(db.String(20), nullable=False)
 
     tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
 
@@ -17,18 +22,32 @@ class Client(db.Model):
     orders = db.relationship('Order', backref='orders', lazy=True)
 
     @classmethod
-    def get_client_id_from_phone(cls, phone_number):
-        client = cls.query.filter_by(phone_number=phone_number).first()
+    def get_client_id_from_phone(cls, phone_number, tenant_id=None):
+        query = cls.query.filter_by(phone_number=phone_number)
+        if tenant_id is not None:
+            query = query.filter_by(tenant_id=tenant_id)
+        client = query.first()
         return client.id if client else None
 
     @classmethod
-    def insert_client_data(cls, phone_number, client_name, tenant_id):
-        existing_client = Client.query.filter_by(phone_number=phone_number).first()
-        if not existing_client:
-            new_client = Client(phone_number=phone_number, fullname=client_name, tenant_id=tenant_id)
-
-            db.session.add(new_client)
-            db.session.commit()
-
-            return new_client
-        return None
\ No newline at end of file
+    def upsert(cls, tenant_id, phone_number, client_name):
+        """
+        Insert the client if it is new for this tenant and return its id, in a single statement.
+        Runs on its own connection so it never commits the caller's session.
+
+        The no-op DO UPDATE (rather than DO NOTHING) makes RETURNING yield the existing row too,
+        including one committed by a concurrent insert after this statement's snapshot was taken.
+        """
+        statement = text("""
+            INSERT INTO clients (fullname, phone_number, tenant_id, created_at, updated_at)
+            VALUES (:fullname, :phone_number, :tenant_id, now(), now())
+            ON CONFLICT (tenant_id, phone_number) DO UPDATE SET updated_at = clients.updated_at
+            RETURNING id
+        """)
+
+        with db.engine.begin() as connection:
+            return connection.execute(statement, {
+                "fullname": client_name,
+                "phone_number": phone_number,
+                "tenant_id": tenant_id,
+            }).scalar_one()
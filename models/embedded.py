@@ -0,0 +1,15 @@
+import hashlib
+
+from app import db
+
+
+class EmbeddedContentMixin:
+    """Tracks which text the stored embedding was computed from, so unchanged rows are never re-embedded."""
+
+    embedding_hash = db.Column(db.String(64), nullable=True)
+
+    def content_hash(self):
+        return hashlib.sha256(self.embedding_text().encode("utf-8")).hexdigest()
+
+    def embedding_is_stale(self):
+        return self.embedding is None or self.embedding_hash != self.content_hash()
@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from app import db
 
 
@@ -10,23 +12,49 @@ class Order(db.Model):
     email = db.Column(db.String(100), nullable=True)
 
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
 
     @classmethod
-    def insert_from_ai_extraction(cls, data):
+    def insert_from_ai_extraction(cls, data, dedupe_window=None):
+        """
+        Create the client's order for the pack. With dedupe_window (seconds), update the name and
+        email of an order for the same pack created within the window instead: structured
+        extraction sees the whole conversation, so every later turn reports the same lead.
+        """
+        from .client import Client
+
         try:
-            new_order = cls(
-                offre_requested=data.get('pack_name'),
-                fullname=data.get('client_name'),
-                phone_number=data.get('client_phone'),
-                email=data.get('client_email'),
-                client_id=data.get('client_id')
-            )
-
-            db.session.add(new_order)
+            pack_name = (data.get('pack_name') or '').strip()
+            order = None
+
+            if dedupe_window:
+                # Lock the client row so concurrent extractions for the same client cannot both insert
+                db.session.query(Client.id).filter(Client.id == data.get('client_id')).with_for_update().first()
+
+                since = db.func.current_timestamp() - timedelta(seconds=dedupe_window)
+                order = cls.query.filter(
+                    cls.client_id == data.get('client_id'),
+                    db.func.lower(db.func.trim(cls.offre_requested)) == pack_name.lower(),
+                    cls.created_at >= since
+                ).order_by(cls.created_at.desc()).first()
+
+            if order is None:
+                order = cls(
+                    offre_requested=pack_name,
+                    fullname=data.get('client_name'),
+                    phone_number=data.get('client_phone'),
+                    email=data.get('client_email'),
+                    client_id=data.get('client_id')
+                )
+                db.session.add(order)
+            else:
+                order.fullname = data.get('client_name') or order.fullname
+                order.email = data.get('client_email') or order.email
+
             db.session.commit()
-            return new_order
+            return order
         except Exception as e:
             print(f"Error creating order: {e}")
             db.session.rollback()
-            return None
\ No newline at end of file
+            return None
@@ -1,6 +1,14 @@
 from app import db
 from pgvector.sqlalchemy import VECTOR
-class Product(db.Model):
+from app.http_client import get_openai_client
+from .embedded import EmbeddedContentMixin
+from .vector_search import search_by_embedding
+class Product(EmbeddedContentMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_product_embedding_hnsw', 'embedding', postgresql_using='hnsw',
+                 postgresql_with={'m': 16, 'ef_construction': 64},
+                 postgresql_ops={'embedding': 'vector_cosine_ops'}),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -10,17 +18,23 @@ class Product(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
 
-    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False, index=True)
 
     embedding = db.Column(VECTOR(1536), nullable=True)
 
+    def embedding_text(self):
+        return f"Product: {self.name} {self.description} {self.price} {self.unit}"
+
+    def generate_embedding(self):
+        client = get_openai_client()
+        response = client.embeddings.create(
+            input=self.embedding_text(),
+            model="text-embedding-ada-002",
+        )
+        self.embedding = response.data[0].embedding
+        self.embedding_hash = self.content_hash()
+        return self.embedding
 
     @classmethod
     def search_products_by_embedding(cls, query_embedding, tenant_id, limit=3):
-        return (
-            db.session.query(Product)
-            .filter(Product.tenant_id == tenant_id)
-            .order_by(Product.embedding.op('<=>')(query_embedding))
-            .limit(limit)
-            .all()
-        )
\ No newline at end of file
+        return search_by_embedding(cls, query_embedding, tenant_id, limit)
\ No newline at end of file
@@ -1,10 +1,16 @@
-from openai import OpenAI
+from app.http_client import get_openai_client
 
 from app import db
 from pgvector.sqlalchemy import VECTOR
-from config import OPENAI_API_KEY
-class Service(db.Model):
+from .embedded import EmbeddedContentMixin
+from .vector_search import search_by_embedding
+class Service(EmbeddedContentMixin, db.Model):
     __tablename__ = 'services'
+    __table_args__ = (
+        db.Index('ix_services_embedding_hnsw', 'embedding', postgresql_using='hnsw',
+                 postgresql_with={'m': 16, 'ef_construction': 64},
+                 postgresql_ops={'embedding': 'vector_cosine_ops'}),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -15,17 +21,21 @@ class Service(db.Model):
 
     embedding = db.Column(VECTOR(1536), nullable=True)
 
-    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False, index=True)
+
+    def embedding_text(self):
+        return f"Offer: {self.name} {self.description} {self.price} {self.periode}"
 
     def generate_embedding(self):
-        text = f"Offer: {self.name} {self.description} {self.price} {self.periode}"
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        text = self.embedding_text()
+        client = get_openai_client()
         try:
             response = client.embeddings.create(
                 input=text,
                 model="text-embedding-ada-002",
             )
             self.embedding = response.data[0].embedding
+            self.embedding_hash = self.content_hash()
         except Exception as e:
             # LOGGING
             raise e
@@ -34,13 +44,5 @@ class Service(db.Model):
 
     @classmethod
     def search_services_by_embedding(cls, query_embedding, tenant_id, limit=3):
-        """Search for products similar to the query embedding."""
-        from models import Service
-
-        return (
-            db.session.query(Service)
-            .filter(Service.tenant_id == tenant_id)
-            .order_by(Service.embedding.op('<=>')(query_embedding))
-            .limit(limit)
-            .all()
-        )
\ No newline at end of file
+        """Search for services similar to the query embedding."""
+        return search_by_embedding(cls, query_embedding, tenant_id, limit)
\ No newline at end of file
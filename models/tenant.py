@@ -8,6 +8,8 @@ class Tenant(db.Model):
     phone_number = db.Column(db.String(20), index=True, unique=True)
     phone_number_id = db.Column(db.String(20))
     whatsapp_token = db.Column(db.String(255))
+    transcription_backend = db.Column(db.String(20), nullable=True)
+    semantic_cache_enabled = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
 
@@ -19,4 +21,5 @@ class Tenant(db.Model):
 
     @classmethod
     def get_tenant_id(cls, phone):
-        return Tenant.query.filter_by(phone_number=phone).first().id
+        tenant = Tenant.query.filter_by(phone_number=phone).first()
+        return tenant.id if tenant else None
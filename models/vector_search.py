@@ -0,0 +1,133 @@
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.orm import aliased
+
+from app import db
+from config import (VECTOR_SEARCH_EF_SEARCH, VECTOR_SEARCH_PROBES,
+                    VECTOR_SEARCH_ITERATIVE_SCAN, VECTOR_SEARCH_MAX_DISTANCE)
+
+
+# Cosine distances lie in [0, 2]: a cutoff at 2 drops nothing
+MAX_COSINE_DISTANCE = 2.0
+
+PGVECTOR_VERSION_QUERY = text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+
+# (major, minor) of the server's pgvector, read once per process
+_pgvector_version = None
+
+
+def parse_version(version):
+    return tuple(int(part) for part in (version or "0.0").split(".")[:2])
+
+
+def iterative_scan_supported():
+    """hnsw.iterative_scan exists from pgvector 0.8; older servers reject the setting"""
+    return _pgvector_version is not None and _pgvector_version >= (0, 8)
+
+
+def search_settings(ef_search=None, probes=None):
+    """SET LOCAL statements for the configured pgvector index scan parameters"""
+    ef_search = ef_search or VECTOR_SEARCH_EF_SEARCH
+    probes = probes or VECTOR_SEARCH_PROBES
+
+    settings = []
+    if ef_search:
+        settings.append(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+    if probes:
+        settings.append(f"SET LOCAL ivfflat.probes = {int(probes)}")
+    if VECTOR_SEARCH_ITERATIVE_SCAN in ('strict_order', 'relaxed_order') and iterative_scan_supported():
+        # HNSW filters its ef_search candidates by tenant afterwards, so a small tenant's rows are
+        # rarely among them; iterative scans keep walking the graph until enough rows pass the filter
+        settings.append(f"SET LOCAL hnsw.iterative_scan = {VECTOR_SEARCH_ITERATIVE_SCAN}")
+
+    return settings
+
+
+def apply_search_settings(ef_search=None, probes=None):
+    """
+    Set the pgvector index scan parameters for the current transaction.
+    The server's pgvector version is read on the first call of the process.
+    """
+    global _pgvector_version
+    if _pgvector_version is None:
+        _pgvector_version = parse_version(db.session.execute(PGVECTOR_VERSION_QUERY).scalar())
+
+    settings = search_settings(ef_search, probes)
+    if settings:
+        db.session.execute(text("; ".join(settings)))
+
+
+def search_statement(model, query_embedding, tenant_id, limit, max_distance=None, exact=False):
+    """
+    exact=True orders by an expression the vector index cannot serve, so Postgres reads the
+    tenant's rows through the tenant_id index and sorts them: exact, and cheap for a small tenant.
+    """
+    if max_distance is None:
+        max_distance = VECTOR_SEARCH_MAX_DISTANCE
+
+    distance = model.embedding.cosine_distance(query_embedding)
+    statement = select(model).where(model.tenant_id == tenant_id, model.embedding.isnot(None))
+    if max_distance < MAX_COSINE_DISTANCE:
+        statement = statement.where(distance <= max_distance)
+
+    if exact:
+        return statement.order_by(distance + 0).limit(limit)
+
+    statement = statement.order_by(distance).limit(limit)
+    if VECTOR_SEARCH_ITERATIVE_SCAN == 'relaxed_order' and iterative_scan_supported():
+        # relaxed_order may return the rows slightly out of order: sort them again
+        nearest = aliased(model, statement.cte("nearest").prefix_with("MATERIALIZED"))
+        statement = select(nearest).order_by(nearest.embedding.cosine_distance(query_embedding))
+    return statement
+
+
+def needs_exact_search(rows, limit):
+    """
+    Without iterative scans a short result may just mean the tenant's rows missed the HNSW
+    candidates. rows must come from a query without the distance cutoff, so rows dropped by
+    max_distance do not count as missed.
+    """
+    return len(rows) < limit and VECTOR_SEARCH_ITERATIVE_SCAN != 'off' and not iterative_scan_supported()
+
+
+def within_distance(rows, query_embedding, max_distance):
+    """The max_distance cutoff, applied to the rows of an index scan run without it"""
+    if max_distance is None:
+        max_distance = VECTOR_SEARCH_MAX_DISTANCE
+    if max_distance >= MAX_COSINE_DISTANCE or not rows:
+        return rows
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    embeddings = np.asarray([row.embedding for row in rows], dtype=np.float32)
+    similarities = embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query))
+    return [row for row, similarity in zip(rows, similarities) if 1.0 - similarity <= max_distance]
+
+
+def search_by_embedding(model, query_embedding, tenant_id, limit, max_distance=None, ef_search=None, probes=None):
+    """
+    Nearest rows of one tenant by cosine distance, dropping rows further than max_distance
+    so unrelated catalog entries are not injected into the prompt.
+    """
+    apply_search_settings(ef_search, probes)
+    rows = db.session.execute(search_statement(model, query_embedding, tenant_id, limit, MAX_COSINE_DISTANCE)).scalars().all()
+    if needs_exact_search(rows, limit):
+        return db.session.execute(search_statement(model, query_embedding, tenant_id, limit, max_distance, exact=True)).scalars().all()
+    return within_distance(rows, query_embedding, max_distance)
+
+
+async def asearch_by_embedding(session, model, query_embedding, tenant_id, limit, max_distance=None, ef_search=None, probes=None):
+    """search_by_embedding() on an AsyncSession (asyncpg), inside its own transaction"""
+    global _pgvector_version
+    async with session.begin():
+        if _pgvector_version is None:
+            _pgvector_version = parse_version((await session.execute(PGVECTOR_VERSION_QUERY)).scalar())
+
+        # asyncpg prepares every statement, which allows a single command each
+        for setting in search_settings(ef_search, probes):
+            await session.execute(text(setting))
+        result = await session.execute(search_statement(model, query_embedding, tenant_id, limit, MAX_COSINE_DISTANCE))
+        rows = result.scalars().all()
+        if needs_exact_search(rows, limit):
+            result = await session.execute(search_statement(model, query_embedding, tenant_id, limit, max_distance, exact=True))
+            return result.scalars().all()
+        return within_distance(rows, query_embedding, max_distance)
@@ -1,7 +1,11 @@
+import os
+
 from app import create_app
+from app.warmup import warm_up
 
 app = create_app()
 
 if __name__ == '__main__':
-    # TODO: turn this into False when deploying to production
-    app.run(debug=True)
\ No newline at end of file
+    # Development server only; production runs gunicorn run:app (see gunicorn.conf.py)
+    warm_up(app)
+    app.run(debug=os.getenv("ENV", "dev") != "prod")
\ No newline at end of file
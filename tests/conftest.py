@@ -0,0 +1,10 @@
+import os
+import sys
+
+# app.redis_config and config read these at import time
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("REDIS_DB", "0")
+os.environ.setdefault("POSTGRES_DATABASE_URI", "postgresql://localhost/chatbot_test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
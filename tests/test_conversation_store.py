@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+
+import fakeredis
+import fakeredis.aioredis
+import pytest
+import redis
+
+from app import conversation_store
+from app.conversation_store import MemoryConversationStore, RedisConversationStore
+from app.redis_config import get_conversation_key, get_conversation_list_key
+
+
+MAX_LENGTH = 4
+# Redis expiries are whole seconds, so the Redis store is tested against the real clock
+EXPIRY = 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    async_client = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(conversation_store, "redis_client", client)
+    monkeypatch.setattr(conversation_store, "get_async_redis", lambda: async_client)
+    monkeypatch.setattr(conversation_store, "CONVERSATION_MAX_LENGTH", MAX_LENGTH)
+    monkeypatch.setattr(conversation_store, "CONVERSATION_EXPIRY", EXPIRY)
+    return client
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def store_and_wait(request):
+    """A store and a function letting the given number of seconds pass for it"""
+    if request.param == 'memory':
+        clock = FakeClock()
+
+        def wait(seconds):
+            clock.now += seconds
+
+        return MemoryConversationStore(expiry=EXPIRY, max_length=MAX_LENGTH, clock=clock), wait
+
+    request.getfixturevalue("fake_redis")
+    return RedisConversationStore(), time.sleep
+
+
+@pytest.fixture
+def store(store_and_wait):
+    return store_and_wait[0]
+
+
+def message(n, role="user"):
+    return {"role": role, "content": f"message {n} é"}
+
+
+def test_append_then_get(store):
+    assert store.get(1, "+33 600") == []
+    assert store.append(1, "+33 600", [message(1), message(2, "assistant")]) is True
+    assert store.get(1, "+33 600") == [message(1), message(2, "assistant")]
+
+
+def test_append_can_read_back_the_history(store):
+    store.append(1, "33600", [message(1)])
+    assert store.append(1, "33600", [message(2)], read=True) == [message(1), message(2)]
+
+
+def test_append_trims_to_max_length(store):
+    store.append(1, "33600", [message(n) for n in range(3)])
+    store.append(1, "33600", [message(n) for n in range(3, 6)])
+    assert store.get(1, "33600") == [message(n) for n in range(2, 6)]
+
+
+def test_save_replaces_and_trims_history(store):
+    store.append(1, "33600", [message(0)])
+    assert store.save(1, "33600", [message(n) for n in range(1, 7)]) is True
+    assert store.get(1, "33600") == [message(n) for n in range(3, 7)]
+
+    store.save(1, "33600", [])
+    assert store.get(1, "33600") == []
+
+
+def test_conversations_are_kept_apart(store):
+    store.append(1, "33600", [message(1)])
+    store.append(2, "33600", [message(2)])
+    store.append(1, "33611", [message(3)])
+    assert store.get(1, "33600") == [message(1)]
+    assert store.get(2, "33600") == [message(2)]
+    assert store.get(1, "33611") == [message(3)]
+
+
+def test_history_expires(store_and_wait):
+    store, wait = store_and_wait
+    store.append(1, "33600", [message(1)])
+    wait(EXPIRY + 0.2)
+    assert store.get(1, "33600") == []
+
+
+def test_append_refreshes_expiry(store_and_wait):
+    store, wait = store_and_wait
+    store.append(1, "33600", [message(1)])
+    wait(EXPIRY * 0.6)
+    store.append(1, "33600", [message(2)])
+    wait(EXPIRY * 0.6)
+    assert store.get(1, "33600") == [message(1), message(2)]
+
+
+def test_async_append_then_get(store):
+    async def roundtrip():
+        await store.aappend(1, "33600", [message(1)])
+        await store.aappend(1, "33600", [message(n) for n in range(2, 6)])
+        return await store.aget(1, "33600")
+
+    assert asyncio.run(roundtrip()) == [message(n) for n in range(2, 6)]
+
+
+def test_memory_store_evicts_least_recently_used_by_count():
+    store = MemoryConversationStore(max_entries=2, max_bytes=10 ** 6, clock=FakeClock())
+    store.append(1, "a", [message(1)])
+    store.append(1, "b", [message(2)])
+    store.get(1, "a")
+    store.append(1, "c", [message(3)])
+
+    assert store.get(1, "b") == []
+    assert store.get(1, "a") == [message(1)]
+    assert store.get(1, "c") == [message(3)]
+    assert store.stats()["evicted"] == 1
+
+
+def test_memory_store_evicts_least_recently_used_by_bytes():
+    entry_size = len(MemoryConversationStore.key(1, "a")) + len(MemoryConversationStore.encode(message(1)))
+    store = MemoryConversationStore(max_entries=100, max_bytes=entry_size * 2, clock=FakeClock())
+    store.append(1, "a", [message(1)])
+    store.append(1, "b", [message(2)])
+    assert store.stats()["bytes"] == entry_size * 2
+
+    # A second message on "b" makes it the most recent entry and pushes the total past the bound
+    store.append(1, "b", [message(3)])
+    assert store.get(1, "a") == []
+    assert store.get(1, "b") == [message(2), message(3)]
+    assert store.stats()["evicted"] == 1
+    assert store.stats()["bytes"] <= entry_size * 2
+
+
+def test_memory_store_counts_expired_entries():
+    clock = FakeClock()
+    store = MemoryConversationStore(expiry=10, clock=clock)
+    store.append(1, "a", [message(1)])
+    clock.now += 11
+    assert store.get(1, "a") == []
+    assert store.stats() == {"backend": "memory", "conversations": 0, "bytes": 0, "evicted": 0, "expired": 1}
+
+
+def test_redis_store_migrates_legacy_json_history(fake_redis):
+    fake_redis.set(get_conversation_key(1, "33600"), json.dumps([message(n) for n in range(6)]))
+    store = RedisConversationStore()
+
+    assert store.get(1, "33600") == [message(n) for n in range(2, 6)]
+    assert fake_redis.exists(get_conversation_key(1, "33600")) == 0
+    assert fake_redis.ttl(get_conversation_list_key(1, "33600")) > 0
+
+
+def test_auto_backend_falls_back_to_memory_without_redis(monkeypatch):
+    class Unreachable:
+        def ping(self):
+            raise redis.ConnectionError("connection refused")
+
+    monkeypatch.setattr(conversation_store, "redis_client", Unreachable())
+    assert isinstance(conversation_store.create_store('auto'), MemoryConversationStore)
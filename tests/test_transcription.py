@@ -0,0 +1,88 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from app import utils
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture_audio(name="voice.ogg"):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return BytesIO(f.read())
+
+
+class StubBackend(utils.TranscriptionBackend):
+    """Returns a fixed text and the real duration of the Ogg buffer"""
+
+    name = 'stub'
+
+    def transcribe(self, audio):
+        return "bonjour", utils.ogg_duration(audio)
+
+
+@pytest.fixture
+def stub_backend(monkeypatch):
+    monkeypatch.setitem(utils.TRANSCRIPTION_BACKENDS, 'stub', StubBackend)
+    monkeypatch.setattr(utils, "_backends", {})
+    monkeypatch.setattr(utils, "_transcription_stats", {})
+    return StubBackend
+
+
+def test_ogg_duration_of_opus_fixture():
+    # 2 s of audio plus the encoder's 312-sample pre-skip
+    assert utils.ogg_duration(fixture_audio()) == pytest.approx(2.0, abs=0.01)
+
+
+def test_ogg_duration_rejects_other_formats():
+    assert utils.ogg_duration(BytesIO(b"RIFF\x00\x00\x00\x00WAVEfmt ")) is None
+    assert utils.ogg_duration(BytesIO(b"")) is None
+    # A truncated page header has no granule position to read
+    assert utils.ogg_duration(BytesIO(b"OggS\x00\x02\x10\x00")) is None
+
+
+def test_backend_selection_by_name(monkeypatch):
+    monkeypatch.setattr(utils, "_backends", {})
+    assert isinstance(utils.get_transcription_backend('local'), utils.LocalWhisperTranscriptionBackend)
+    assert isinstance(utils.get_transcription_backend('openai'), utils.OpenAITranscriptionBackend)
+    assert utils.get_transcription_backend('local') is utils.get_transcription_backend('local')
+
+
+def test_unknown_or_missing_backend_falls_back_to_default(monkeypatch):
+    monkeypatch.setattr(utils, "_backends", {})
+    monkeypatch.setattr(utils, "TRANSCRIPTION_BACKEND", 'openai')
+    assert isinstance(utils.get_transcription_backend('nope'), utils.OpenAITranscriptionBackend)
+    assert isinstance(utils.get_transcription_backend(None), utils.OpenAITranscriptionBackend)
+
+
+def test_real_time_factor_accounting(stub_backend, monkeypatch):
+    clock = iter([10.0, 10.5, 20.0, 20.5])
+    monkeypatch.setattr(utils.time, "time", lambda: next(clock))
+
+    assert utils.transcribe_audio(fixture_audio(), 'stub') == "bonjour"
+    assert utils.transcribe_audio(fixture_audio(), 'stub') == "bonjour"
+
+    stats = utils.transcription_stats()['stub']
+    assert stats["count"] == 2
+    assert stats["processing_seconds"] == pytest.approx(1.0)
+    assert stats["audio_seconds"] == pytest.approx(4.0, abs=0.02)
+    assert stats["real_time_factor"] == pytest.approx(0.25, abs=0.01)
+
+
+def test_failed_transcription_returns_none(stub_backend, monkeypatch):
+    def fail(self, audio):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(StubBackend, "transcribe", fail)
+    assert utils.transcribe_audio(fixture_audio(), 'stub') is None
+    assert utils.transcription_stats() == {}
+
+
+@pytest.mark.skipif(not os.getenv("LOCAL_WHISPER_TEST"), reason="set LOCAL_WHISPER_TEST=1 with faster-whisper installed")
+def test_local_whisper_transcribes_fixture():
+    pytest.importorskip("faster_whisper")
+    text, duration = utils.get_transcription_backend('local').transcribe(fixture_audio())
+    assert isinstance(text, str)
+    assert duration == pytest.approx(2.0, abs=0.1)
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, delete, insert, text
+
+
+# A Postgres database with the pgvector extension available, e.g.
+# TEST_DATABASE_URL=postgresql://postgres@localhost/chatbot_test
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+requires_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a Postgres database with pgvector")
+
+DIMENSIONS = 1536
+
+
+def unit_vector(*weights):
+    return list(weights) + [0.0] * (DIMENSIONS - len(weights))
+
+
+@pytest.fixture(scope="module")
+def tenant_products():
+    from app import db
+    from models.tenant import Tenant
+    from models.product import Product
+
+    engine = create_engine(TEST_DATABASE_URL)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    db.metadata.create_all(engine, tables=[Tenant.__table__, Product.__table__])
+
+    with engine.begin() as connection:
+        tenant_id = connection.execute(
+            insert(Tenant).values(name="vector search test", phone_number=uuid.uuid4().hex[:20]).returning(Tenant.id)
+        ).scalar()
+        other_tenant_id = connection.execute(
+            insert(Tenant).values(name="vector search test", phone_number=uuid.uuid4().hex[:20]).returning(Tenant.id)
+        ).scalar()
+        rows = [
+            {"name": "near", "embedding": unit_vector(1.0, 0.1), "tenant_id": tenant_id},
+            {"name": "far", "embedding": unit_vector(0.1, 1.0), "tenant_id": tenant_id},
+            {"name": "unembedded", "embedding": None, "tenant_id": tenant_id},
+            {"name": "other tenant", "embedding": unit_vector(1.0, 0.0), "tenant_id": other_tenant_id},
+        ]
+        connection.execute(insert(Product), [dict(row, price=1.0, unit="unit") for row in rows])
+
+    yield tenant_id
+
+    with engine.begin() as connection:
+        connection.execute(delete(Product).where(Product.tenant_id.in_([tenant_id, other_tenant_id])))
+        connection.execute(delete(Tenant).where(Tenant.id.in_([tenant_id, other_tenant_id])))
+    engine.dispose()
+
+
+@pytest.fixture
+def aio_sessionmaker(monkeypatch):
+    from app import aio
+
+    monkeypatch.setattr(aio, "SQLALCHEMY_DATABASE_URI", TEST_DATABASE_URL)
+    monkeypatch.setattr(aio, "_engine", None)
+    monkeypatch.setattr(aio, "_sessionmaker", None)
+    return aio.get_sessionmaker()
+
+
+def run(sessionmaker, query):
+    """Run query(session) on a fresh event loop; pooled asyncpg connections cannot outlive their loop"""
+    from app import aio
+
+    async def main():
+        try:
+            async with sessionmaker() as session:
+                return await query(session)
+        finally:
+            await aio._engine.dispose()
+
+    return asyncio.run(main())
+
+
+def asearch(sessionmaker, tenant_id, query_embedding, limit, max_distance=None):
+    from models.product import Product
+    from models.vector_search import asearch_by_embedding
+
+    async def search(session):
+        rows = await asearch_by_embedding(session, Product, query_embedding, tenant_id, limit, max_distance=max_distance)
+        return [row.name for row in rows]
+
+    return run(sessionmaker, search)
+
+
+@requires_db
+def test_async_search_orders_tenant_rows_by_distance(tenant_products, aio_sessionmaker):
+    # cosine distances lie in [0, 2]: nothing is dropped
+    assert asearch(aio_sessionmaker, tenant_products, unit_vector(1.0, 0.0), 5, max_distance=2.0) == ["near", "far"]
+    assert asearch(aio_sessionmaker, tenant_products, unit_vector(0.0, 1.0), 1, max_distance=2.0) == ["far"]
+
+
+@requires_db
+def test_async_search_drops_rows_past_max_distance(tenant_products, aio_sessionmaker):
+    # Short index scan, re-run as an exact search with the cutoff
+    assert asearch(aio_sessionmaker, tenant_products, unit_vector(1.0, 0.0), 5, max_distance=0.5) == ["near"]
+    # Full index scan, cutoff applied to its rows
+    assert asearch(aio_sessionmaker, tenant_products, unit_vector(1.0, 0.0), 2, max_distance=0.5) == ["near"]
+
+
+@requires_db
+def test_async_search_reads_embeddings_back(tenant_products, aio_sessionmaker):
+    from models.product import Product
+
+    async def load(session):
+        product = (await session.execute(
+            Product.__table__.select().where(Product.tenant_id == tenant_products, Product.name == "near")
+        )).one()
+        return product.embedding
+
+    embedding = run(aio_sessionmaker, load)
+    assert len(embedding) == DIMENSIONS
+    assert list(embedding[:2]) == pytest.approx([1.0, 0.1])
+
+
+class Row:
+    def __init__(self, name, embedding):
+        self.name = name
+        self.embedding = embedding
+
+
+def test_within_distance_applies_the_cutoff_after_the_index_scan():
+    from models.vector_search import within_distance
+
+    rows = [Row("near", unit_vector(1.0, 0.1)), Row("far", unit_vector(0.1, 1.0))]
+    assert [row.name for row in within_distance(rows, unit_vector(1.0, 0.0), 0.5)] == ["near"]
+    assert within_distance(rows, unit_vector(1.0, 0.0), 2.0) == rows
+
+
+def test_only_a_short_index_scan_falls_back_to_the_exact_search(monkeypatch):
+    from models import vector_search
+
+    monkeypatch.setattr(vector_search, "_pgvector_version", (0, 6))
+    monkeypatch.setattr(vector_search, "VECTOR_SEARCH_ITERATIVE_SCAN", "relaxed_order")
+    rows = [Row("near", unit_vector(1.0, 0.1)), Row("far", unit_vector(0.1, 1.0))]
+    # The cutoff leaves one row of two, but the scan itself was full: no second query
+    assert not vector_search.needs_exact_search(rows, 2)
+    assert vector_search.needs_exact_search(rows, 3)
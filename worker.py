@@ -0,0 +1,110 @@
+import argparse
+import signal
+import threading
+import time
+
+from app import create_app
+from app.job_queue import default_worker_name, recover_jobs, dequeue_job, ack_job, retry_job, promote_due_jobs
+from app.log_config import logger
+from app.warmup import warm_up
+from app.reembed import drain
+from config import WORKER_CONCURRENCY
+
+
+stop_event = threading.Event()
+
+
+def response_status(response):
+    if isinstance(response, tuple):
+        return response[1]
+    return getattr(response, 'status_code', 200)
+
+
+def run_job(app, job):
+    from app.routes import process_events, process_whatsapp_message
+    from app.utils import WebhookEvent
+
+    with app.app_context():
+        if 'events' in job:
+            response = process_events([WebhookEvent(**event) for event in job['events']])
+        elif 'event' in job:
+            response = process_events([WebhookEvent(**job['event'])])
+        else:
+            response = process_whatsapp_message(job['data'], job['display_phone_number'])
+        return response_status(response)
+
+
+def work(app, worker_name):
+    while not stop_event.is_set():
+        try:
+            raw, job = dequeue_job(worker_name)
+        except Exception as e:
+            logger.error("Error reading job queue", extra={"error": str(e)})
+            stop_event.wait(5)
+            continue
+
+        if not job:
+            continue
+
+        start = time.time()
+        try:
+            status_code = run_job(app, job)
+        except Exception as e:
+            retry_job(worker_name, raw, job, str(e))
+            continue
+
+        # The handlers report failures as 5xx responses instead of raising; 4xx jobs can never succeed
+        if status_code >= 500:
+            retry_job(worker_name, raw, job, f"status {status_code}")
+            continue
+
+        try:
+            ack_job(worker_name, raw)
+            logger.info("Job processed", extra={
+                "job_id": job.get('id'),
+                "status_code": status_code,
+                "queue_delay": round(start - job.get('enqueued_at', start), 4),
+                "duration": round(time.time() - start, 4)
+            })
+        except Exception as e:
+            logger.error("Error acknowledging job", extra={"job_id": job.get('id'), "error": str(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain the webhook job queue")
+    parser.add_argument('--concurrency', type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument('--name', default=default_worker_name(), help="stable worker name, used to recover its unfinished jobs")
+    parser.add_argument('--no-reembed', action='store_true', help="do not re-embed edited catalog rows in this worker")
+    args = parser.parse_args()
+
+    app = create_app()
+    warm_up(app)
+    recover_jobs(args.name)
+
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    threads = [
+        threading.Thread(target=work, args=(app, args.name), name=f"worker-{i}", daemon=True)
+        for i in range(args.concurrency)
+    ]
+    if not args.no_reembed:
+        threads.append(threading.Thread(target=drain, args=(app, stop_event), name="reembed", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    logger.info("Worker started", extra={"worker": args.name, "concurrency": args.concurrency})
+
+    # The main thread promotes retried jobs once their backoff is over
+    while not stop_event.is_set():
+        try:
+            promote_due_jobs()
+        except Exception as e:
+            logger.error("Error promoting delayed jobs", extra={"error": str(e)})
+        stop_event.wait(1)
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()